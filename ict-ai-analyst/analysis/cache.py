@@ -0,0 +1,115 @@
+from typing import Optional
+from collections import OrderedDict
+from contextlib import closing
+from pathlib import Path
+import asyncio
+import sqlite3
+import time
+import structlog
+from config import settings
+from utils.metrics import metrics
+
+logger = structlog.get_logger()
+
+
+class AnalysisCache:
+    """
+    TTL + LRU cache of analysis text keyed by payload fingerprint.
+    Optionally backed by a SQLite file so entries survive restarts; the file is
+    only touched from a worker thread, never on the event loop.
+    """
+
+    def __init__(self, max_entries: int = 256, ttl: float = 300, path: Optional[str] = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = Path(path) if path else None
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # key → (expires_at, text)
+        self._schema_ready = False
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if not self._schema_ready:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS analyses "
+                "(key TEXT PRIMARY KEY, expires_at REAL NOT NULL, text TEXT NOT NULL)"
+            )
+            conn.execute("DELETE FROM analyses WHERE expires_at < ?", (time.time(),))
+            conn.commit()
+            self._schema_ready = True
+        return conn
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None and self.path:
+            entry = await asyncio.to_thread(self._load, key)
+            if entry is not None:
+                self._store(key, entry)
+
+        if entry is not None and entry[0] < time.time():
+            self._entries.pop(key, None)
+            entry = None
+
+        if entry is None:
+            metrics.incr("analysis_cache.misses")
+            return None
+
+        self._entries.move_to_end(key)
+        metrics.incr("analysis_cache.hits")
+        return entry[1]
+
+    async def put(self, key: str, text: str):
+        entry = (time.time() + self.ttl, text)
+        self._store(key, entry)
+        if self.path:
+            await asyncio.to_thread(self._save, key, entry)
+
+    def clear(self):
+        """Drop every entry (blocking; for tests and maintenance, not the event loop)."""
+        self._entries.clear()
+        if self.path:
+            with closing(self._connect()) as conn, conn:
+                conn.execute("DELETE FROM analyses")
+
+    def _store(self, key: str, entry: tuple):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            metrics.incr("analysis_cache.evictions")
+        metrics.gauge("analysis_cache.size", len(self._entries))
+
+    def _load(self, key: str) -> Optional[tuple]:
+        with closing(self._connect()) as conn:
+            row = conn.execute(
+                "SELECT expires_at, text FROM analyses WHERE key = ?", (key,)
+            ).fetchone()
+        return tuple(row) if row else None
+
+    def _save(self, key: str, entry: tuple):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO analyses (key, expires_at, text) VALUES (?, ?, ?)",
+                (key, *entry)
+            )
+
+
+# Singleton instance
+_analysis_cache: Optional[AnalysisCache] = None
+
+
+def get_analysis_cache() -> AnalysisCache:
+    """Get the shared analysis cache."""
+    global _analysis_cache
+    if _analysis_cache is None:
+        _analysis_cache = AnalysisCache(
+            max_entries=settings.ANALYSIS_CACHE_MAX_ENTRIES,
+            ttl=settings.ANALYSIS_CACHE_TTL,
+            path=settings.ANALYSIS_CACHE_PATH or None,
+        )
+    return _analysis_cache
@@ -1,47 +1,73 @@
-from typing import Optional
-import base64
+from typing import Callable, List, Optional
+from contextlib import contextmanager
+import hashlib
+import json
+import time
 import structlog
 from pathlib import Path
 from config import settings
 from webhook.models import TradingViewPayload
-from screenshot.capture import get_screenshot
+from screenshot.capture import chart_layout
+from screenshot.frame import ChartFrame
+from screenshot.precapture import get_precapture
+from screenshot.workers import request_screenshot, request_composite
+from utils.metrics import metrics
+from jobs.journal import get_journal
 from .prompts import ICT_SYSTEM_PROMPT
+from .providers import get_provider_clients
+from .cache import get_analysis_cache
+from .ticks import tick_size, round_to_tick
+from .singleflight import SingleFlight
+from .streaming import SectionStream
+from .rules import evaluate_rules, render_rule_analysis
+from .geometry import compute_geometry, format_geometry_for_ai
+from .vision import image_block, record_vision_latency
 
 logger = structlog.get_logger()
 
-# Try to import the right client based on config
-try:
-    import anthropic
-    HAS_ANTHROPIC = True
-except ImportError:
-    HAS_ANTHROPIC = False
 
-try:
-    import httpx
-    HAS_HTTPX = True
-except ImportError:
-    HAS_HTTPX = False
+class ProviderError(RuntimeError):
+    """The AI provider answered with a non-200 status."""
 
+    def __init__(self, status: int):
+        super().__init__(f"status {status}")
+        self.status = status
 
-async def run_analysis_pipeline(payload: TradingViewPayload):
+# Concurrent identical requests share one provider call and one delivery. A delivery
+# lingers only if some destination got it: a retry of a failed one must go out again.
+_analysis_flights = SingleFlight("analysis")
+_pipeline_flights = SingleFlight("pipeline", linger=settings.PIPELINE_DEDUP_WINDOW, keep=any)
+
+
+async def run_analysis_pipeline(
+    payload: TradingViewPayload,
+    job_id: Optional[str] = None,
+    analysis: Optional[str] = None
+):
     """
     Full pipeline: screenshot → AI analysis → delivery.
+    With a `job_id`, each stage is recorded in the job journal. A replayed job
+    that was already analyzed passes its `analysis` and goes straight to delivery.
+    The same alert (trigger, bar + payload fingerprint) arriving while one is in
+    flight, or within PIPELINE_DEDUP_WINDOW after it was delivered, rides along
+    instead of re-delivering.
+    An alert that every destination refused is journaled as "failed", not "delivered".
     """
-    # Step 1: Skip screenshot for now (Playwright TradingView login is flaky)
-    # TODO: Use OpenClaw browser for chart screenshots instead
-    screenshot_path = None
-
-    # Step 2: Run AI analysis
-    analysis = await analyze_with_ai(payload, screenshot_path)
+    flight_key = f"{payload.trigger}:{payload.ts}:{payload_fingerprint(payload)}"
+    delivered = await _pipeline_flights.do(
+        flight_key,
+        lambda: _analyze_and_deliver(payload, job_id, analysis)
+    )
 
-    # Step 3: Deliver results
-    from delivery.discord_bot import send_discord_alert
-    from delivery.telegram_bot import send_telegram_alert
+    if delivered and not any(delivered):
+        metrics.incr("pipeline.undelivered")
+        logger.error("pipeline_undelivered", trigger=payload.trigger, destinations=len(delivered))
+        if job_id:
+            get_journal().record(job_id, "failed")
+        return
 
-    if settings.DELIVERY_METHOD in ("discord", "both"):
-        await send_discord_alert(payload, analysis, screenshot_path)
-    if settings.DELIVERY_METHOD in ("telegram", "both"):
-        await send_telegram_alert(payload, analysis, screenshot_path)
+    if job_id:
+        get_journal().record(job_id, "delivered")
 
     logger.info("pipeline_complete",
         trigger=payload.trigger,
@@ -49,76 +75,331 @@ async def run_analysis_pipeline(payload: TradingViewPayload):
     )
 
 
+async def _analyze_and_deliver(
+    payload: TradingViewPayload,
+    job_id: Optional[str] = None,
+    analysis: Optional[str] = None
+) -> List[bool]:
+    """Returns whether each destination got the alert."""
+    started = time.perf_counter()
+
+    # Step 1: Chart screenshot from the warm page pool (optional)
+    chart = await capture_chart(payload) if settings.SCREENSHOTS_ENABLED else None
+
+    from delivery.fanout import deliver_alert
+    from delivery.progressive import ProgressiveDelivery
+
+    # Step 2: Run AI analysis
+    # With streaming on, bias and trade setup go out as soon as they are written
+    live = None
+    if analysis is None:
+        if settings.AI_STREAMING:
+            live = ProgressiveDelivery(payload, started_at=started)
+        analysis = await analyze_with_ai(
+            payload, chart,
+            on_section=live.push if live else None,
+            started_at=started
+        )
+        if job_id:
+            get_journal().record(job_id, "analyzed", analysis=analysis)
+
+    # Step 3: Deliver results, to every destination at once
+    if live:
+        delivered = await live.finish(analysis, chart)
+    else:
+        delivered = await deliver_alert(payload, analysis, chart)
+    metrics.observe("pipeline.total_ms", (time.perf_counter() - started) * 1000)
+    return delivered
+
+
+async def capture_chart(payload: TradingViewPayload) -> Optional[ChartFrame]:
+    """
+    Screenshot the alert's chart, in memory. A frame pre-captured for a scheduled
+    trigger is used when it is fresh enough; with SCREENSHOT_COMPOSITE_TFS the
+    timeframes are tiled into one image. A failed capture never blocks the alert.
+    """
+    composite_tfs = [tf.strip() for tf in settings.SCREENSHOT_COMPOSITE_TFS.split(",") if tf.strip()]
+    if settings.SCREENSHOT_PRECAPTURE and not composite_tfs:
+        frame = get_precapture().take(chart_layout(payload.sym, payload.tf))
+        if frame:
+            return frame.image
+
+    archive_path = None
+    if settings.SCREENSHOT_ARCHIVE:
+        archive_path = str(Path("screenshots") / f"{payload.sym.replace(':', '_').replace('!', '')}_{payload.tf}_{payload.ts}")
+    try:
+        if composite_tfs:
+            return await request_composite(payload.sym, composite_tfs, archive_path)
+        return await request_screenshot(payload.sym, payload.tf, archive_path)
+    except Exception as e:
+        logger.error("screenshot_failed", symbol=payload.sym, error=str(e))
+        return None
+
+
 async def analyze_with_ai(
     payload: TradingViewPayload,
-    screenshot_path: Optional[str] = None
+    chart: Optional[ChartFrame] = None,
+    on_section: Optional[Callable[[str], None]] = None,
+    started_at: Optional[float] = None
 ) -> str:
     """
-    Send JSON data to AI for ICT analysis.
+    Send JSON data (and the chart, to vision-capable providers) to AI for ICT analysis.
     Uses DeepSeek (cheap) or Anthropic (premium) based on config.
     Returns the formatted analysis text.
+    Identical setups (same payload fingerprint) are answered from the analysis cache.
+    With `on_section`, the response is streamed and the callback gets the text so far
+    each time a progressive section (bias, trade setup) is complete.
+    Alerts the trade rules already classify as NO TRADE / DEVELOPING never reach the LLM.
+    `started_at` (perf_counter) is when the alert arrived; the chart is left out
+    if sending it would exceed AI_LATENCY_BUDGET.
     """
+    if settings.RULES_FAST_PATH:
+        verdict = evaluate_rules(payload)
+        if not verdict.needs_llm:
+            metrics.incr("rules.llm_calls_avoided")
+            logger.info("ai_analysis_skipped", trigger=payload.trigger,
+                        status=verdict.status, reasons=verdict.reasons)
+            return render_rule_analysis(payload, verdict)
+
+    cache_key = payload_fingerprint(payload)
+    if settings.ANALYSIS_CACHE_ENABLED:
+        cached = await get_analysis_cache().get(cache_key)
+        if cached is not None:
+            logger.info("ai_analysis_cached", trigger=payload.trigger, key=cache_key[:12])
+            return cached
+
+    return await _analysis_flights.do(
+        cache_key,
+        lambda: _request_analysis(payload, chart, cache_key, on_section, started_at)
+    )
+
+
+async def _request_analysis(
+    payload: TradingViewPayload,
+    chart: Optional[ChartFrame],
+    cache_key: str,
+    on_section: Optional[Callable[[str], None]] = None,
+    started_at: Optional[float] = None
+) -> str:
+    """One provider round trip. Successful analyses are written to the cache."""
     json_summary = format_payload_for_ai(payload)
-    
+
+    # Stop, targets and R are computed here; the model only has to explain them
+    geometry = compute_geometry(payload)
+    max_tokens = settings.AI_MAX_TOKENS
+    if geometry:
+        json_summary += "\n\n" + format_geometry_for_ai(geometry)
+        max_tokens = settings.AI_MAX_TOKENS_WITH_GEOMETRY
+
+    provider = getattr(settings, 'AI_PROVIDER', 'deepseek')
+
+    # Chart image for vision-capable providers (resized + base64 off the event loop)
+    image = await image_block(chart, provider, started_at)
+    sources = "the JSON data and the attached chart screenshot" if image else "the JSON data"
+
+    # Static instructions first, per-alert data last: the longer the identical
+    # prefix, the more of the prompt the provider's context cache can serve
     user_text = f"""
 Here is the current ICT indicator data. Produce your market breakdown.
+Analyze based on {sources}. Produce your ICT market breakdown following the exact output format specified.
 
 **Alert Trigger:** {payload.trigger}
 **Symbol:** {payload.sym} | **Timeframe:** {payload.tf}min | **Current Price:** {payload.px}
 
 {json_summary}
-
-Analyze based on the JSON data. Produce your ICT market breakdown following the exact output format specified.
 """
 
+    try:
+        analysis_text = await _ask_provider(provider, user_text, image, max_tokens, on_section)
+    except Exception as e:
+        # Timeouts, dropped connections, API errors: the alert still goes out, with the
+        # locally computed levels and the raw data instead of the model's breakdown
+        metrics.incr(f"ai.{provider}.errors")
+        logger.error("ai_analysis_failed", provider=provider, error=str(e) or type(e).__name__)
+        reason = str(e) if isinstance(e, ProviderError) else type(e).__name__
+        return f"⚠️ AI analysis failed ({reason}). Raw data:\n{json_summary}"
+
+    logger.info("ai_analysis_complete", provider=provider, length=len(analysis_text))
+    if settings.ANALYSIS_CACHE_ENABLED:
+        await get_analysis_cache().put(cache_key, analysis_text)
+    return analysis_text
+
+
+async def _ask_provider(
+    provider: str,
+    user_text: str,
+    image: Optional[dict],
+    max_tokens: int,
+    on_section: Optional[Callable[[str], None]] = None
+) -> str:
+    """The provider call itself. Raises ProviderError on a non-200 answer."""
     # Use DeepSeek (OpenAI-compatible API) — much cheaper
-    provider = getattr(settings, 'AI_PROVIDER', 'deepseek')
-    
     if provider == 'deepseek':
         api_key = getattr(settings, 'DEEPSEEK_API_KEY', settings.ANTHROPIC_API_KEY)
         model = getattr(settings, 'DEEPSEEK_MODEL', 'deepseek-chat')
         
-        async with httpx.AsyncClient(timeout=60) as client:
-            response = await client.post(
-                "https://api.deepseek.com/v1/chat/completions",
-                headers={
-                    "Authorization": f"Bearer {api_key}",
-                    "Content-Type": "application/json"
-                },
-                json={
-                    "model": model,
-                    "messages": [
-                        {"role": "system", "content": ICT_SYSTEM_PROMPT},
-                        {"role": "user", "content": user_text}
-                    ],
-                    "max_tokens": 2000,
-                    "temperature": 0.3
-                }
-            )
-            
+        client = get_provider_clients().http("deepseek")
+        headers = {
+            "Authorization": f"Bearer {api_key}",
+            "Content-Type": "application/json"
+        }
+        body = {
+            "model": model,
+            "messages": [
+                {"role": "system", "content": ICT_SYSTEM_PROMPT},
+                {"role": "user", "content": [image, {"type": "text", "text": user_text}] if image else user_text}
+            ],
+            "max_tokens": max_tokens,
+            "temperature": 0.3
+        }
+
+        if on_section:
+            started = time.perf_counter()
+            with _request_timer("deepseek", image is not None):
+                async with client.stream(
+                    "POST", "/v1/chat/completions",
+                    headers=headers,
+                    json={**body, "stream": True, "stream_options": {"include_usage": True}}
+                ) as response:
+                    if response.status_code != 200:
+                        error_body = (await response.aread()).decode(errors="replace")
+                        logger.error("deepseek_error", status=response.status_code, body=error_body[:200])
+                        raise ProviderError(response.status_code)
+                    analysis_text = await _read_deepseek_stream(response, SectionStream(on_section), started)
+        else:
+            with _request_timer("deepseek", image is not None):
+                response = await client.post("/v1/chat/completions", headers=headers, json=body)
+
             if response.status_code != 200:
                 logger.error("deepseek_error", status=response.status_code, body=response.text[:200])
-                return f"⚠️ AI analysis failed (status {response.status_code}). Raw data:\n{json_summary}"
-            
+                raise ProviderError(response.status_code)
+
             data = response.json()
             analysis_text = data["choices"][0]["message"]["content"]
+            _record_usage("deepseek", data.get("usage"))
     else:
-        # Anthropic fallback
-        client = anthropic.Anthropic(api_key=settings.ANTHROPIC_API_KEY)
+        # Anthropic fallback — async client so the event loop keeps serving webhooks
+        client = get_provider_clients().anthropic()
         user_content = [{"type": "text", "text": user_text}]
-        
-        response = client.messages.create(
+        if image:
+            user_content.insert(0, image)  # image before text, as Anthropic recommends
+
+        # The system prompt is identical on every call: mark it as a cache breakpoint
+        system = ICT_SYSTEM_PROMPT
+        if settings.AI_PROMPT_CACHE:
+            system = [{"type": "text", "text": ICT_SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}]
+
+        request = dict(
             model=settings.CLAUDE_MODEL,
-            max_tokens=2000,
-            system=ICT_SYSTEM_PROMPT,
+            max_tokens=max_tokens,
+            system=system,
             messages=[{"role": "user", "content": user_content}]
         )
-        analysis_text = response.content[0].text
 
-    logger.info("ai_analysis_complete", provider=provider, length=len(analysis_text))
+        if on_section:
+            sections = SectionStream(on_section)
+            started = time.perf_counter()
+            with _request_timer("anthropic", image is not None):
+                async with client.messages.stream(**request) as stream:
+                    async for text in stream.text_stream:
+                        if not sections.text:
+                            metrics.observe("ai.anthropic.first_token_ms", (time.perf_counter() - started) * 1000)
+                        sections.feed(text)
+                    final = await stream.get_final_message()
+            analysis_text = sections.text
+            _record_usage("anthropic", final.usage)
+        else:
+            with _request_timer("anthropic", image is not None):
+                response = await client.messages.create(**request)
+            analysis_text = response.content[0].text
+            _record_usage("anthropic", response.usage)
+
     return analysis_text
 
 
+@contextmanager
+def _request_timer(provider: str, with_image: bool):
+    """Time a provider call; calls carrying a chart image are also timed on their own."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = (time.perf_counter() - start) * 1000
+        metrics.observe(f"ai.{provider}.request_ms", elapsed)
+        if with_image:
+            metrics.observe(f"ai.{provider}.vision_request_ms", elapsed)
+            record_vision_latency(provider, elapsed)
+
+
+def _record_usage(provider: str, usage):
+    """
+    Record prompt-cache token counts from a provider's usage block.
+    Anthropic reports cache_read/cache_creation_input_tokens. DeepSeek reports
+    prompt_cache_hit/miss_tokens; it fills its cache on its own and bills no write,
+    so a miss is only uncached input.
+    """
+    if usage is None:
+        return
+    if not isinstance(usage, dict):
+        usage = usage.model_dump()
+
+    if provider == "anthropic":
+        read = usage.get("cache_read_input_tokens") or 0
+        written = usage.get("cache_creation_input_tokens") or 0
+        uncached = usage.get("input_tokens") or 0
+    else:
+        read = usage.get("prompt_cache_hit_tokens") or 0
+        written = 0
+        uncached = usage.get("prompt_cache_miss_tokens") or 0
+
+    metrics.incr(f"ai.{provider}.cache_read_tokens", read)
+    metrics.incr(f"ai.{provider}.cache_write_tokens", written)
+    metrics.incr(f"ai.{provider}.uncached_input_tokens", uncached)
+    logger.info("ai_usage", provider=provider, cache_read=read, cache_write=written, uncached=uncached)
+
+
+async def _read_deepseek_stream(response, sections: SectionStream, started: float) -> str:
+    """Consume an OpenAI-style SSE stream, feeding each content delta to `sections`."""
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+        chunk = json.loads(data)
+        if chunk.get("usage"):
+            _record_usage("deepseek", chunk["usage"])
+        if not chunk.get("choices"):
+            continue  # the usage chunk carries no choices
+        delta = chunk["choices"][0].get("delta", {}).get("content")
+        if delta:
+            if not sections.text:
+                metrics.observe("ai.deepseek.first_token_ms", (time.perf_counter() - started) * 1000)
+            sections.feed(delta)
+    return sections.text
+
+
+def payload_fingerprint(payload: TradingViewPayload) -> str:
+    """
+    Canonical hash of what the AI is actually shown: symbol, timeframe, price and the
+    rendered indicator summary, with every price snapped to the symbol's tick.
+    Trigger and timestamp are left out so re-fired alerts on the same bar share a key.
+    """
+    tick = tick_size(payload.sym)
+    data = payload.model_dump()
+    data["px"] = round_to_tick(data["px"], tick)
+    data["bias"]["dol"] = round_to_tick(data["bias"]["dol"], tick)
+    for field in ("px", "top", "bot"):
+        data["entry"][field] = round_to_tick(data["entry"][field], tick)
+    for field, value in data["levels"].items():
+        if isinstance(value, float):
+            data["levels"][field] = round_to_tick(value, tick)
+
+    snapped = TradingViewPayload(**data)
+    canonical = f"{snapped.sym}|{snapped.tf}|{snapped.px}\n{format_payload_for_ai(snapped)}"
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
 def format_payload_for_ai(payload: TradingViewPayload) -> str:
     """
     Format the JSON payload into a readable summary for the AI.
@@ -0,0 +1,129 @@
+from typing import List, Optional
+from dataclasses import dataclass
+import math
+from webhook.models import TradingViewPayload
+from .ticks import tick_size, stop_buffer
+
+# Liquidity levels that can serve as targets, in LevelsData field names
+TARGET_LEVELS = (
+    "pdh", "pdl", "asia_h", "asia_l", "deal_h", "deal_l", "eq",
+    "ipda20h", "ipda20l", "ipda40h", "ipda40l", "ipda60h", "ipda60l",
+)
+MIN_TARGET_R = 1.0  # nearer levels are not worth the risk
+
+
+@dataclass
+class Target:
+    price: float
+    points: float
+    r: float
+    source: str
+
+
+@dataclass
+class TradeGeometry:
+    """Stop, targets and R multiples for the Smart Entry, all on the symbol's tick grid."""
+    direction: str                  # "LONG" or "SHORT"
+    entry: float
+    stop: float
+    risk: float                     # points from entry to stop
+    targets: List[Target]
+    tick: float
+
+    @property
+    def t1(self) -> Optional[Target]:
+        return self.targets[0] if self.targets else None
+
+    @property
+    def t2(self) -> Optional[Target]:
+        return self.targets[1] if len(self.targets) > 1 else None
+
+    @property
+    def rr(self) -> Optional[float]:
+        """Reward-to-risk of the furthest target."""
+        return self.targets[-1].r if self.targets else None
+
+
+def _floor_tick(price: float, tick: float) -> float:
+    return round(math.floor(price / tick + 1e-9) * tick, 6)
+
+
+def _ceil_tick(price: float, tick: float) -> float:
+    return round(math.ceil(price / tick - 1e-9) * tick, 6)
+
+
+def compute_geometry(payload: TradingViewPayload) -> Optional[TradeGeometry]:
+    """
+    Trade geometry for the payload's Smart Entry, or None without a usable entry.
+    Stop sits a per-symbol buffer beyond the entry zone. T1 is the nearest liquidity
+    level at least 1R away; T2 is the DOL when it lies further out, else the next level.
+    """
+    e = payload.entry
+    if not e.found or e.px is None or e.dir not in ("BULL", "BEAR"):
+        return None
+
+    tick = tick_size(payload.sym)
+    long = e.dir == "BULL"
+    side = 1 if long else -1
+    entry = _floor_tick(e.px, tick) if long else _ceil_tick(e.px, tick)
+
+    zone_edge = e.bot if long else e.top
+    if zone_edge is None:
+        zone_edge = e.px
+    buffer = stop_buffer(payload.sym)
+    # Round the stop away from the entry so the buffer is never shaved
+    stop = _floor_tick(zone_edge - buffer, tick) if long else _ceil_tick(zone_edge + buffer, tick)
+    risk = round((entry - stop) * side, 6)
+    if risk <= 0:
+        return None
+
+    # Liquidity levels at least MIN_TARGET_R away in the trade direction, nearest first
+    levels = payload.levels.model_dump()
+    eligible = sorted(
+        ((levels[name] - entry) * side, levels[name], name.upper())
+        for name in TARGET_LEVELS
+        if levels[name] is not None and (levels[name] - entry) * side >= MIN_TARGET_R * risk
+    )
+
+    def target(price: float, source: str) -> Target:
+        price = _floor_tick(price, tick) if long else _ceil_tick(price, tick)
+        pts = round((price - entry) * side, 6)
+        return Target(price=price, points=pts, r=round(pts / risk, 2), source=source)
+
+    targets: List[Target] = []
+    if eligible:
+        targets.append(target(eligible[0][1], eligible[0][2]))
+
+    dol = payload.bias.dol
+    if dol is not None and (dol - entry) * side / risk >= MIN_TARGET_R and \
+            (not targets or (dol - entry) * side > targets[0].points):
+        targets.append(target(dol, f"DOL {payload.bias.dol_src}"))
+    elif len(eligible) > 1:
+        targets.append(target(eligible[1][1], eligible[1][2]))
+
+    return TradeGeometry(
+        direction="LONG" if long else "SHORT",
+        entry=entry,
+        stop=stop,
+        risk=risk,
+        targets=targets,
+        tick=tick,
+    )
+
+
+def format_geometry_for_ai(geometry: TradeGeometry) -> str:
+    """Prompt section with the computed numbers, so the model doesn't redo the arithmetic."""
+    g = geometry
+    lines = [
+        "## TRADE GEOMETRY (pre-computed — use these numbers as given)",
+        f"- Direction: {g.direction}",
+        f"- Entry: {g.entry}",
+        f"- Stop Loss: {g.stop} ({g.risk} points risk)",
+    ]
+    for n, t in enumerate(g.targets, start=1):
+        lines.append(f"- Target {n}: {t.price} ({t.points} points, {t.r}R) — {t.source}")
+    if g.rr is not None:
+        lines.append(f"- Risk-Reward: {g.rr}:1" + (" (below 2:1)" if g.rr < 2 else ""))
+    else:
+        lines.append("- No target at least 1R away")
+    return "\n".join(lines)
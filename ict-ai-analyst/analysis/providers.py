@@ -0,0 +1,148 @@
+from typing import Dict, Optional
+import time
+import httpx
+import structlog
+from config import settings
+from utils.metrics import metrics
+
+logger = structlog.get_logger()
+
+try:
+    import anthropic
+    HAS_ANTHROPIC = True
+except ImportError:
+    HAS_ANTHROPIC = False
+
+# httpx only negotiates HTTP/2 when the `h2` package is available
+try:
+    import h2  # noqa: F401
+    HAS_H2 = True
+except ImportError:
+    HAS_H2 = False
+
+# Connection setup steps reported by httpcore's trace extension
+CONNECT_STEPS = ("connection.connect_tcp", "connection.start_tls")
+
+
+class TimedTransport(httpx.AsyncHTTPTransport):
+    """
+    HTTP transport that records how long each request spent opening a connection
+    (TCP connect + TLS handshake) under `ai.<provider>.connect_ms`.
+    Once the pool is warm this should be 0 for every call.
+    """
+
+    def __init__(self, provider: str, **kwargs):
+        super().__init__(**kwargs)
+        self.provider = provider
+
+    async def handle_async_request(self, request):
+        started: Dict[str, float] = {}
+        spent = 0.0
+        outer_trace = request.extensions.get("trace")
+
+        async def trace(event_name: str, info: dict):
+            nonlocal spent
+            step, _, phase = event_name.rpartition(".")
+            if step in CONNECT_STEPS:
+                if phase == "started":
+                    started[step] = time.perf_counter()
+                elif step in started:
+                    spent += time.perf_counter() - started.pop(step)
+            if outer_trace is not None:
+                await outer_trace(event_name, info)
+
+        request.extensions["trace"] = trace
+        response = await super().handle_async_request(request)
+        metrics.observe(f"ai.{self.provider}.connect_ms", spent * 1000)
+        return response
+
+
+class ProviderClients:
+    """
+    Long-lived, pooled HTTP clients for the AI providers.
+    One keep-alive pool per provider, created on first use and closed by the app lifespan.
+    """
+
+    BASE_URLS = {
+        "deepseek": lambda: settings.DEEPSEEK_BASE_URL,
+        "anthropic": lambda: settings.ANTHROPIC_BASE_URL,
+    }
+
+    def __init__(self):
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._anthropic = None
+
+    def _build(self, provider: str) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=settings.AI_POOL_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.AI_POOL_MAX_KEEPALIVE,
+            keepalive_expiry=settings.AI_POOL_KEEPALIVE_EXPIRY,
+        )
+        transport = TimedTransport(
+            provider,
+            http2=settings.AI_HTTP2 and HAS_H2,
+            limits=limits,
+        )
+        logger.info("ai_pool_created",
+            provider=provider,
+            http2=settings.AI_HTTP2 and HAS_H2,
+            max_connections=settings.AI_POOL_MAX_CONNECTIONS
+        )
+        return httpx.AsyncClient(
+            base_url=self.BASE_URLS[provider](),
+            transport=transport,
+            timeout=settings.AI_TIMEOUT,
+        )
+
+    def http(self, provider: str) -> httpx.AsyncClient:
+        """Pooled httpx client for a provider."""
+        client = self._clients.get(provider)
+        if client is None or client.is_closed:
+            client = self._clients[provider] = self._build(provider)
+        return client
+
+    def anthropic(self) -> "anthropic.AsyncAnthropic":
+        """Long-lived async Anthropic SDK client riding on the pooled httpx client."""
+        if self._anthropic is None:
+            self._anthropic = anthropic.AsyncAnthropic(
+                api_key=settings.ANTHROPIC_API_KEY,
+                base_url=settings.ANTHROPIC_BASE_URL,
+                timeout=settings.AI_TIMEOUT,
+                http_client=self.http("anthropic"),
+            )
+        return self._anthropic
+
+    async def warm_up(self, provider: str):
+        """Open a connection ahead of the first alert so it doesn't pay the TCP+TLS handshake."""
+        try:
+            await self.http(provider).get("/", timeout=10)
+            logger.info("ai_pool_warmed", provider=provider)
+        except Exception as e:
+            logger.warning("ai_pool_warmup_failed", provider=provider, error=str(e))
+
+    async def close(self):
+        for provider, client in self._clients.items():
+            await client.aclose()
+            logger.info("ai_pool_closed", provider=provider)
+        self._clients.clear()
+        self._anthropic = None
+
+
+# Singleton instance
+_provider_clients: Optional[ProviderClients] = None
+
+
+def get_provider_clients() -> ProviderClients:
+    """Get the shared provider clients. Created lazily so the poller works without the app lifespan."""
+    global _provider_clients
+    if _provider_clients is None:
+        _provider_clients = ProviderClients()
+    return _provider_clients
+
+
+async def close_provider_clients():
+    """Close all provider connection pools."""
+    global _provider_clients
+    if _provider_clients:
+        await _provider_clients.close()
+        _provider_clients = None
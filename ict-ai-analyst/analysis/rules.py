@@ -0,0 +1,106 @@
+from typing import List
+from dataclasses import dataclass, field
+from webhook.models import TradingViewPayload
+
+# Mirrors the CRITICAL RULES in ICT_SYSTEM_PROMPT. When these already decide the
+# outcome, the breakdown is rendered locally and no LLM call is made.
+
+NO_TRADE = "NO TRADE"
+DEVELOPING = "DEVELOPING"
+ACTIVE = "ACTIVE SETUP"
+
+MIN_CONVICTION = 50
+KILL_ZONES = {"LONDON", "NY_AM", "NY_PM"}
+KZ_EXEMPT_MODELS = {"2022_MODEL", "UNICORN"}  # may trade outside a Kill Zone
+
+
+@dataclass
+class RuleVerdict:
+    status: str                                   # NO_TRADE, DEVELOPING or ACTIVE
+    reasons: List[str] = field(default_factory=list)
+
+    @property
+    def needs_llm(self) -> bool:
+        """Only a setup that could be ACTIVE is worth a model call."""
+        return self.status == ACTIVE
+
+
+def evaluate_rules(payload: TradingViewPayload) -> RuleVerdict:
+    """Apply the deterministic trade rules. NO TRADE outranks DEVELOPING."""
+    p = payload
+    no_trade: List[str] = []
+    developing: List[str] = []
+
+    # Rule 1
+    if p.narr.score < MIN_CONVICTION:
+        no_trade.append(f"Conviction {p.narr.score}% is below {MIN_CONVICTION}%")
+    # Rule 2
+    if p.session.kz not in KILL_ZONES and p.model.name not in KZ_EXEMPT_MODELS:
+        no_trade.append("No Kill Zone active")
+    # Rule 5
+    if p.bias.dol_status == "DELIVERED":
+        no_trade.append("DOL already delivered — waiting for a new draw on liquidity")
+    # Rule 3
+    if p.model.name == "GENERIC":
+        developing.append("No specific ICT model confirmed (GENERIC)")
+    # Rule 6
+    if p.struct.mss == "NONE":
+        developing.append("Waiting for MSS confirmation")
+
+    if no_trade:
+        return RuleVerdict(NO_TRADE, no_trade)
+    if developing:
+        return RuleVerdict(DEVELOPING, developing)
+    return RuleVerdict(ACTIVE)
+
+
+def render_rule_analysis(payload: TradingViewPayload, verdict: RuleVerdict) -> str:
+    """Render a NO TRADE / DEVELOPING breakdown in the prompt's output format."""
+    p = payload
+    bias = "BULLISH" if p.bias.dir == "BULL" else "BEARISH"
+
+    story = [f"Bias is {bias.lower()} ({p.bias.reason.replace('_', ' ').lower()})"]
+    if p.narr.sweep:
+        story.append("liquidity has been swept")
+    story.append(f"structure shows MSS {p.struct.mss}")
+    narrative = ", ".join(story) + f", with price drawing toward {p.bias.dol} ({p.bias.dol_src})."
+
+    lines = [
+        "### 🔮 MARKET NARRATIVE",
+        narrative,
+        "",
+        f"### 📊 DIRECTIONAL BIAS: {bias}",
+        f"**DOL Target:** {p.bias.dol} ({p.bias.dol_src})",
+        f"**Bias Reason:** {p.bias.reason.replace('_', ' ')}",
+        f"**Confidence:** {p.narr.score}%",
+        "",
+        f"### 🧩 ICT MODEL: {p.model.name.replace('_', ' ')}",
+        f"**Active Flags:** {p.model.flags.strip(',') or 'None'}",
+        "",
+        "### 🎯 TRADE SETUP",
+        f"**Status:** {verdict.status}",
+    ]
+
+    if verdict.status == NO_TRADE:
+        lines.append(f"**Reason:** {'; '.join(verdict.reasons)}")
+    else:
+        watch = [f"EQ {p.levels.eq}"]
+        if p.entry.found:
+            watch.insert(0, f"{p.entry.type} {p.entry.bot}—{p.entry.top}")
+        lines += [
+            f"**What's Missing:** {'; '.join(verdict.reasons)}",
+            f"**Levels to Watch:** {', '.join(watch)}, DOL {p.bias.dol}",
+        ]
+
+    lines += [
+        "",
+        "### ⏰ SESSION CONTEXT",
+        f"**Kill Zone:** {p.session.kz.replace('_', ' ')}",
+        f"**PO3 Phase:** {p.session.po3.title()}",
+        f"**Key Levels:** PDH {p.levels.pdh}, PDL {p.levels.pdl}, "
+        f"Asia {p.levels.asia_h}-{p.levels.asia_l}, EQ {p.levels.eq}",
+        "",
+        "### ⚠️ RISK NOTES",
+        "Rules-based read — no AI analysis was run for this alert.",
+    ]
+    return "\n".join(lines)
@@ -0,0 +1,69 @@
+from typing import Any, Awaitable, Callable, Dict
+import asyncio
+import time
+import structlog
+from utils.metrics import metrics
+
+logger = structlog.get_logger()
+
+
+class SingleFlight:
+    """
+    Collapse concurrent calls that share a key into one execution.
+    Callers that arrive while a call is in flight await the same future instead
+    of running `fn` again. With `linger`, a finished result for which `keep(result)`
+    is true keeps being shared for that many seconds, so a retry that lands right
+    after the first call completes is coalesced too.
+    """
+
+    def __init__(self, name: str, linger: float = 0.0, keep: Callable[[Any], bool] = lambda result: True):
+        self.name = name
+        self.linger = linger
+        self.keep = keep
+        self._calls: Dict[str, asyncio.Future] = {}
+        self._finished: Dict[str, tuple] = {}  # key → (expires_at, result)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        finished = self._finished.get(key)
+        if finished is not None:
+            if finished[0] >= time.monotonic():
+                metrics.incr(f"singleflight.{self.name}.coalesced")
+                logger.info("singleflight_coalesced", flight=self.name, key=key[:24], finished=True)
+                return finished[1]
+            del self._finished[key]
+
+        future = self._calls.get(key)
+        if future is not None:
+            metrics.incr(f"singleflight.{self.name}.coalesced")
+            logger.info("singleflight_coalesced", flight=self.name, key=key[:24], finished=False)
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        metrics.incr(f"singleflight.{self.name}.calls")
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        else:
+            future.set_result(result)
+            if self.linger > 0 and self.keep(result):
+                self._prune()
+                self._finished[key] = (time.monotonic() + self.linger, result)
+            return result
+        finally:
+            del self._calls[key]
+
+    @property
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def _prune(self):
+        now = time.monotonic()
+        for key in [k for k, (expires_at, _) in self._finished.items() if expires_at < now]:
+            del self._finished[key]
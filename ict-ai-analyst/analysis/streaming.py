@@ -0,0 +1,42 @@
+from typing import Callable, List, Optional, Tuple
+import re
+
+# Sections worth pushing to the phone before the rest of the breakdown is written
+PROGRESSIVE_SECTIONS = ("DIRECTIONAL BIAS", "TRADE SETUP")
+
+SECTION_HEADER = re.compile(r"^### ", re.MULTILINE)
+
+
+class SectionStream:
+    """
+    Accumulates streamed completion text and reports each watched section as soon
+    as it is complete — i.e. the moment the next `### ` header starts.
+    `on_section(text)` receives the analysis so far, up to the end of that section.
+    """
+
+    def __init__(
+        self,
+        on_section: Optional[Callable[[str], None]] = None,
+        watch: Tuple[str, ...] = PROGRESSIVE_SECTIONS,
+    ):
+        self.on_section = on_section
+        self.watch = watch
+        self.text = ""
+        self._starts: List[int] = []  # offsets of `### ` headers seen so far
+
+    def feed(self, delta: str):
+        # A header may straddle two deltas, so rescan from just before the new text
+        scan_from = max(0, len(self.text) - 4)
+        if self._starts:
+            scan_from = max(scan_from, self._starts[-1] + 1)
+        self.text += delta
+
+        for match in SECTION_HEADER.finditer(self.text, scan_from):
+            if self._starts:
+                self._section_closed(self._starts[-1], match.start())
+            self._starts.append(match.start())
+
+    def _section_closed(self, start: int, end: int):
+        header = self.text[start:self.text.find("\n", start)]
+        if self.on_section and any(name in header for name in self.watch):
+            self.on_section(self.text[:end].rstrip())
@@ -0,0 +1,47 @@
+import re
+from typing import Optional
+
+# Minimum price increment per futures root symbol
+TICK_SIZES = {
+    "MNQ": 0.25, "NQ": 0.25,
+    "MES": 0.25, "ES": 0.25,
+    "MYM": 1.0, "YM": 1.0,
+    "M2K": 0.1, "RTY": 0.1,
+    "MGC": 0.1, "GC": 0.1,
+    "MCL": 0.01, "CL": 0.01,
+}
+DEFAULT_TICK = 0.25
+
+# Stop buffer beyond the entry zone, in points (MNQ: the prompt's 5-10 point rule)
+STOP_BUFFERS = {
+    "MNQ": 5.0, "NQ": 5.0,
+    "MES": 1.5, "ES": 1.5,
+    "MYM": 10.0, "YM": 10.0,
+    "M2K": 1.0, "RTY": 1.0,
+    "MGC": 1.0, "GC": 1.0,
+    "MCL": 0.1, "CL": 0.1,
+}
+DEFAULT_STOP_BUFFER_TICKS = 20
+
+
+def symbol_root(symbol: str) -> str:
+    """'MNQ1!' / 'CME_MINI:MNQH2026' → 'MNQ'."""
+    name = symbol.split(":")[-1].upper()
+    match = re.match(r"(M2K|[A-Z]+?)(\d+!|[FGHJKMNQUVXZ]\d{2,4})?$", name)
+    return match.group(1) if match else name
+
+
+def tick_size(symbol: str) -> float:
+    return TICK_SIZES.get(symbol_root(symbol), DEFAULT_TICK)
+
+
+def stop_buffer(symbol: str) -> float:
+    root = symbol_root(symbol)
+    return STOP_BUFFERS.get(root, DEFAULT_STOP_BUFFER_TICKS * TICK_SIZES.get(root, DEFAULT_TICK))
+
+
+def round_to_tick(price: Optional[float], tick: float) -> Optional[float]:
+    """Snap a price to the nearest tick (None passes through)."""
+    if price is None:
+        return None
+    return round(round(price / tick) * tick, 6)
@@ -0,0 +1,95 @@
+from typing import Deque, Dict, List, Optional, Tuple
+from collections import deque
+import asyncio
+import base64
+import math
+import time
+import structlog
+from config import settings
+from screenshot.capture import pixel_budget
+from screenshot.frame import ChartFrame, encode_frame
+from utils.metrics import metrics
+
+logger = structlog.get_logger()
+
+PIXELS_PER_TOKEN = 750  # Anthropic: image tokens ≈ width * height / 750
+
+# (monotonic time, ms) of recent requests that carried an image, per provider
+_vision_latency: Dict[str, Deque[Tuple[float, float]]] = {}
+
+
+def image_tokens(width: int, height: int) -> int:
+    return math.ceil(width * height / PIXELS_PER_TOKEN)
+
+
+def vision_providers() -> List[str]:
+    return [p.strip() for p in settings.AI_VISION_PROVIDERS.split(",") if p.strip()]
+
+
+def fit_for_vision(frame: ChartFrame, max_pixels: int = 0, max_tokens: int = 0) -> ChartFrame:
+    """Downscale `frame` (keeping its format) until it fits both limits; 0 = no limit."""
+    limits = [limit for limit in (max_pixels, max_tokens * PIXELS_PER_TOKEN) if limit]
+    if not limits or frame.width * frame.height <= min(limits):
+        return frame
+    return encode_frame(frame.data, format=frame.format, max_width=0, max_pixels=min(limits))
+
+
+def build_image_block(frame: ChartFrame, provider: str, max_pixels: int, max_tokens: int) -> Tuple[dict, int]:
+    """Resize + base64 a frame into the provider's image content block. CPU-bound."""
+    frame = fit_for_vision(frame, max_pixels, max_tokens)
+    data = base64.b64encode(frame.data).decode("ascii")
+    if provider == "anthropic":
+        block = {"type": "image", "source": {"type": "base64", "media_type": frame.content_type, "data": data}}
+    else:
+        # OpenAI-compatible chat completions
+        block = {"type": "image_url", "image_url": {"url": f"data:{frame.content_type};base64,{data}"}}
+    return block, image_tokens(frame.width, frame.height)
+
+
+def record_vision_latency(provider: str, ms: float):
+    _vision_latency.setdefault(provider, deque(maxlen=200)).append((time.monotonic(), ms))
+
+
+def expected_vision_seconds(provider: str) -> float:
+    """
+    p95 of the provider's vision request times over the last AI_VISION_LATENCY_WINDOW
+    seconds (0 with none). Old samples age out: while images are being dropped no new
+    ones arrive, so a slow spell must not keep vision off forever.
+    """
+    cutoff = time.monotonic() - settings.AI_VISION_LATENCY_WINDOW
+    samples = sorted(ms for at, ms in _vision_latency.get(provider, ()) if at >= cutoff)
+    if not samples:
+        return 0.0
+    return samples[min(len(samples) - 1, int(0.95 * len(samples)))] / 1000
+
+
+async def image_block(
+    frame: Optional[ChartFrame],
+    provider: str,
+    started_at: Optional[float] = None
+) -> Optional[dict]:
+    """
+    The chart as an image content block for `provider`, or None when there is no
+    chart, the provider isn't vision-capable, or waiting for a vision answer would
+    push the alert past AI_LATENCY_BUDGET (judged from recent vision request times).
+    Every request is stateless, so a chart that looks like the last one is still sent.
+    """
+    if frame is None or not settings.AI_VISION or provider not in vision_providers():
+        return None
+
+    if started_at is not None and settings.AI_LATENCY_BUDGET:
+        elapsed = time.perf_counter() - started_at
+        expected = expected_vision_seconds(provider)
+        if elapsed + expected > settings.AI_LATENCY_BUDGET:
+            metrics.incr("ai.vision.images_dropped")
+            logger.info("vision_image_dropped", provider=provider,
+                        elapsed=round(elapsed, 2), expected=round(expected, 2))
+            return None
+
+    with metrics.timer("ai.vision.encode_ms"):
+        block, tokens = await asyncio.to_thread(
+            build_image_block, frame, provider, pixel_budget(provider), settings.AI_VISION_MAX_TOKENS
+        )
+    metrics.incr("ai.vision.images_sent")
+    metrics.incr(f"ai.{provider}.image_tokens", tokens)
+    return block
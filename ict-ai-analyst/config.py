@@ -12,20 +12,117 @@ class Settings(BaseSettings):
     TV_USERNAME: str = ""
     TV_PASSWORD: str = ""
     TV_CHART_URL: str = ""
+    TV_SESSION_PATH: str = "data/tv-session.enc"  # Encrypted storage_state, reused across restarts
+    TV_SESSION_KEY: str = ""            # Fernet key; derived from TV_PASSWORD when empty (no session saved without either)
 
     ANTHROPIC_API_KEY: str = ""
     CLAUDE_MODEL: str = "claude-sonnet-4-5-20250929"
+    ANTHROPIC_BASE_URL: str = "https://api.anthropic.com"
+    ANTHROPIC_PIXEL_BUDGET: int = 1_150_000  # Max pixels per chart image sent to Claude (0 = no limit)
+
+    # Chart screenshots (warm Playwright page pool, one live page per symbol/timeframe)
+    SCREENSHOTS_ENABLED: bool = False   # Attach charts to alerts (needs TV_* credentials)
+    SCREENSHOT_LAYOUTS: str = ""        # Pre-loaded at startup, e.g. "MNQ1!/5,ES1!/15"
+    SCREENSHOT_POOL_SIZE: int = 4
+    SCREENSHOT_POOL_MAX_CAPTURES: int = 50       # Recycle a page after this many captures (caps Chromium memory)
+    SCREENSHOT_POOL_HEALTH_INTERVAL: float = 60.0  # seconds between page health checks
+    SCREENSHOT_WORKERS: int = 1                  # Browser worker processes (0 = Chromium in the app process)
+    SCREENSHOT_WORKER_PORT: int = 8701           # First worker's local port; worker N listens on PORT+N
+    SCREENSHOT_WORKER_CONCURRENCY: int = 2       # Captures one worker runs at once
+    SCREENSHOT_WORKER_HEALTH_INTERVAL: float = 10.0  # seconds between supervisor health checks
+    SCREENSHOT_RPC_TIMEOUT: float = 20.0         # seconds before a capture is abandoned (alert goes without chart)
+    SCREENSHOT_READY_TIMEOUT: float = 11.5       # Upper bound on waiting for the chart to finish drawing
+    SCREENSHOT_READY_POLL: float = 0.1           # seconds between canvas checksum polls
+    SCREENSHOT_READY_STABLE_POLLS: int = 3       # Unchanged polls in a row that count as "rendered"
+    SCREENSHOT_FORMAT: str = "jpeg"              # "jpeg", "webp" or "png"
+    SCREENSHOT_MAX_WIDTH: int = 1600             # Downscale wider captures
+    SCREENSHOT_QUALITY: int = 80
+    SCREENSHOT_TARGET_BYTES: int = 300_000       # Lower quality until the frame fits (0 = off)
+    SCREENSHOT_ARCHIVE: bool = False             # Also write each frame to screenshots/ (background)
+    SCREENSHOT_COALESCE_WINDOW: float = 1.0      # seconds; requests for a chart captured this recently share the frame
+    SCREENSHOT_CLIP_SELECTOR: str = ".chart-markup-table"  # Capture only this element's box ("" = whole viewport)
+    SCREENSHOT_COMPOSITE_TFS: str = ""           # e.g. "1,5,15": one tiled image of these timeframes per alert
+    SCREENSHOT_COMPOSITE_COLUMNS: int = 2
+    SCREENSHOT_DEDUP: bool = True                # Near-identical charts of the same bar reuse the last upload
+    SCREENSHOT_DEDUP_THRESHOLD: int = 4          # Max differing bits (of 64) between perceptual hashes
+    SCREENSHOT_DEDUP_MAX_AGE: float = 900.0      # seconds an upload may be reused
+    SCREENSHOT_PRECAPTURE: bool = True           # Capture SCREENSHOT_LAYOUTS just before scheduled triggers
+    SCREENSHOT_PRECAPTURE_LEAD: float = 5.0      # seconds before the trigger time
+    SCREENSHOT_PRECAPTURE_MAX_AGE: float = 30.0  # seconds a pre-captured frame may be used for an alert
 
     DISCORD_WEBHOOK_URL: str = ""
+    DISCORD_WEBHOOK_URLS: str = ""    # Comma-separated extra webhooks, delivered to in parallel
+    DISCORD_BATCH_WINDOW: float = 0.25  # seconds alerts to one webhook are collected into one message (0 = off)
+    DISCORD_BATCH_MAX_EMBEDS: int = 10  # Discord's per-message embed limit
+    DISCORD_BATCH_MAX_CHARS: int = 6000 # Discord's per-message embed text limit
 
     TELEGRAM_BOT_TOKEN: str = ""
     TELEGRAM_CHAT_ID: str = ""
+    TELEGRAM_CHAT_IDS: str = ""       # Comma-separated extra chats, delivered to in parallel
+    TELEGRAM_API_URL: str = "https://api.telegram.org"
 
     DELIVERY_METHOD: str = "discord"  # "discord", "telegram", "both"
+    DELIVERY_DESTINATION_TIMEOUT: float = 15.0  # seconds one HTTP attempt to a destination may take
+    DELIVERY_DEADLINE: float = 600.0    # seconds a send may spend queued on rate limits / 429 pauses before it's dropped
+    DELIVERY_MAX_RETRIES: int = 3       # Retries of a send that got 429 or 5xx
+    DELIVERY_RETRY_BASE: float = 0.5    # seconds; 5xx backoff doubles per attempt (full jitter)
+    DELIVERY_RETRY_JITTER: float = 0.25 # seconds of random extra wait after a 429's retry_after
+
+    # Rate limits: never more than LIMIT sends per period, BURST of them back to back
+    DISCORD_RATE_PER_MINUTE: int = 30   # per webhook
+    DISCORD_BURST: int = 5
+    TELEGRAM_RATE_PER_SECOND: int = 30  # bot-wide
+    TELEGRAM_BURST: int = 5
+    TELEGRAM_GROUP_RATE_PER_MINUTE: int = 20  # per group chat
+    TELEGRAM_GROUP_BURST: int = 3
+
+    # Delivery sessions (one long-lived aiohttp session per destination host)
+    DELIVERY_TIMEOUT: float = 30.0
+    DELIVERY_POOL_MAX_CONNECTIONS: int = 10
+    DELIVERY_POOL_KEEPALIVE_EXPIRY: float = 60.0  # seconds an idle connection stays open
+    DELIVERY_DNS_CACHE_TTL: int = 300             # seconds resolved hosts are cached
+
+    # Pipeline job queue
+    PIPELINE_WORKERS: int = 4           # Alerts analyzed concurrently (one at a time per symbol)
+    PIPELINE_MAX_QUEUE: int = 100       # Waiting alerts before /webhook answers 503
+    PIPELINE_DEDUP_WINDOW: float = 30.0 # seconds an identical alert (e.g. a TradingView retry) is coalesced
+
+    # Durable job journal (SQLite WAL) — replays unfinished alerts after a restart
+    JOURNAL_PATH: str = "data/journal.db"
+    JOURNAL_REPLAY_MAX_AGE: int = 900   # seconds; older unfinished alerts are stale and dropped
+    JOURNAL_COMPACT_EVERY: int = 1000   # commits between prunes of finished/stale jobs (0 = only at startup)
 
     AI_PROVIDER: str = "deepseek"
     DEEPSEEK_API_KEY: str = ""
     DEEPSEEK_MODEL: str = "deepseek-chat"
+    DEEPSEEK_BASE_URL: str = "https://api.deepseek.com"
+    DEEPSEEK_PIXEL_BUDGET: int = 1_150_000
+
+    # AI provider connection pools (one long-lived client per provider)
+    AI_TIMEOUT: float = 60.0
+    AI_HTTP2: bool = True               # Used when the `h2` package is installed
+    AI_POOL_MAX_CONNECTIONS: int = 10
+    AI_POOL_MAX_KEEPALIVE: int = 5
+    AI_POOL_KEEPALIVE_EXPIRY: float = 120.0  # seconds an idle connection stays open
+    AI_POOL_WARMUP: bool = True         # Open provider connections at startup
+    AI_MAX_TOKENS: int = 2000
+    AI_MAX_TOKENS_WITH_GEOMETRY: int = 1200  # Stop/targets/R are pre-computed, so the answer is shorter
+    AI_PROMPT_CACHE: bool = True        # Mark the static system prompt cacheable (Anthropic cache_control)
+    AI_STREAMING: bool = False          # Stream completions; bias + trade setup are delivered before the rest
+    AI_VISION: bool = True              # Send the chart screenshot along with the JSON
+    AI_VISION_PROVIDERS: str = "anthropic"  # Vision-capable providers (OpenAI-compatible ones get an image_url part)
+    AI_VISION_MAX_TOKENS: int = 1600    # Downscale the image to ≈ this many tokens (width*height/750)
+    AI_LATENCY_BUDGET: float = 20.0     # seconds; drop the image if a vision answer would arrive later (0 = never)
+    AI_VISION_LATENCY_WINDOW: float = 300.0  # seconds of vision request times the budget estimate is based on
+
+    # Rules fast path: NO TRADE / DEVELOPING alerts are rendered locally, no LLM call
+    RULES_FAST_PATH: bool = True
+
+    # Analysis cache (re-fired alerts with identical data skip the LLM)
+    ANALYSIS_CACHE_ENABLED: bool = True
+    ANALYSIS_CACHE_TTL: int = 300       # seconds
+    ANALYSIS_CACHE_MAX_ENTRIES: int = 256
+    ANALYSIS_CACHE_PATH: str = ""       # e.g. "data/analysis-cache.db" to persist across restarts
 
     CARETAKER_URL: str = "https://decrypt-caretaker-production.up.railway.app"
 
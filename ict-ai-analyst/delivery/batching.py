@@ -0,0 +1,76 @@
+from typing import Awaitable, Callable, Generic, List, Optional, Set, TypeVar
+import asyncio
+
+T = TypeVar("T")
+
+
+class MicroBatcher(Generic[T]):
+    """
+    Collects items for up to `window` seconds — or until there are `max_items` of
+    them, or `max_size` by `size()` — then hands them to `flush` as one batch.
+    `submit()` returns once the batch holding the item has been flushed, and raises
+    what `flush` raised.
+    """
+
+    def __init__(
+        self,
+        flush: Callable[[List[T]], Awaitable[None]],
+        window: float = 0.25,
+        max_items: int = 10,
+        max_size: int = 0,
+        size: Callable[[T], int] = lambda item: 0,
+    ):
+        self.flush = flush
+        self.window = window
+        self.max_items = max_items
+        self.max_size = max_size
+        self.size = size
+        self._items: List[T] = []
+        self._futures: List[asyncio.Future] = []
+        self._size = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._sending: Set[asyncio.Task] = set()
+
+    async def submit(self, item: T):
+        size = self.size(item)
+        if self._items and self.max_size and self._size + size > self.max_size:
+            self._flush()  # doesn't fit: what's collected so far goes now, this starts the next batch
+
+        future = asyncio.get_running_loop().create_future()
+        self._items.append(item)
+        self._futures.append(future)
+        self._size += size
+        if len(self._items) >= self.max_items:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.window, self._flush)
+        await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._items:
+            return
+        items, futures = self._items, self._futures
+        self._items, self._futures, self._size = [], [], 0
+        task = asyncio.create_task(self._send(items, futures))
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, items: List[T], futures: List[asyncio.Future]):
+        try:
+            await self.flush(items)
+        except Exception as e:
+            for future in futures:
+                if not future.done():  # the submitter may have timed out
+                    future.set_exception(e)
+        else:
+            for future in futures:
+                if not future.done():
+                    future.set_result(None)
+
+    async def close(self):
+        """Send whatever is still collected and wait for batches in flight."""
+        self._flush()
+        await asyncio.gather(*self._sending, return_exceptions=True)
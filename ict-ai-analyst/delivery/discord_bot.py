@@ -1,10 +1,19 @@
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
+from dataclasses import dataclass
 import json
 import aiohttp
 import structlog
-from pathlib import Path
 from config import settings
 from webhook.models import TradingViewPayload
+from analysis.geometry import compute_geometry
+from analysis.rules import evaluate_rules, ACTIVE
+from screenshot.capture import chart_layout
+from screenshot.frame import ChartFrame
+from screenshot.dedup import duplicate_of, remember_chart, bar_key
+from utils.metrics import metrics
+from .transport import get_delivery_transport, DeliveryFailed
+from .ratelimit import trigger_priority
+from .batching import MicroBatcher
 
 logger = structlog.get_logger()
 
@@ -32,17 +41,8 @@ MODEL_EMOJI = {
 }
 
 
-async def send_discord_alert(
-    payload: TradingViewPayload,
-    analysis: str,
-    screenshot_path: Optional[str] = None
-):
-    """Send analysis + screenshot to Discord via webhook."""
-
-    if not settings.DISCORD_WEBHOOK_URL:
-        logger.warning("discord_skipped", reason="No webhook URL configured")
-        return
-
+def build_discord_embed(payload: TradingViewPayload, analysis: str) -> dict:
+    """Build the alert embed for a (possibly partial) analysis."""
     trigger_emoji = TRIGGER_EMOJI.get(payload.trigger, "📡")
     model_emoji = MODEL_EMOJI.get(payload.model.name, "📌")
 
@@ -80,31 +80,218 @@ async def send_discord_alert(
         }
     }
 
-    # Build the JSON payload
+    # Trade levels come from the payload, so they're filled even if the AI call failed —
+    # but only for a setup the rules call ACTIVE, or a NO TRADE alert reads like a trade call
+    geometry = compute_geometry(payload)
+    if geometry and evaluate_rules(payload).status == ACTIVE:
+        embed["fields"].append({
+            "name": "🛑 Stop",
+            "value": f"{geometry.stop} ({geometry.risk} pts)",
+            "inline": True
+        })
+        for n, target in enumerate(geometry.targets, start=1):
+            embed["fields"].append({
+                "name": f"🏁 T{n}",
+                "value": f"{target.price} ({target.r}R)",
+                "inline": True
+            })
+
+    return embed
+
+
+def embed_length(embed: dict) -> int:
+    """Characters Discord counts against its 6000-per-message embed limit."""
+    fields = embed.get("fields", [])
+    return (
+        len(embed.get("title", "")) + len(embed.get("description", ""))
+        + len(embed.get("footer", {}).get("text", "")) + len(embed.get("author", {}).get("name", ""))
+        + sum(len(f["name"]) + len(f["value"]) for f in fields)
+    )
+
+
+def _attachment_name(chart: ChartFrame, n: int) -> str:
+    """Filename of the n-th chart attached to one message (chart.jpg, chart-1.jpg, ...)."""
+    return chart.filename if n == 0 else chart.filename.replace("chart.", f"chart-{n}.", 1)
+
+
+def _embed_chart(embed: dict, layout: str, bar: str, chart: Optional[ChartFrame], n: int = 0) -> bool:
+    """
+    Show the chart inside the embed. A near-duplicate of the last chart uploaded for
+    this layout and bar points at that upload; otherwise the bytes must be attached
+    (True), as the message's n-th file.
+    """
+    if chart is None:
+        return False
+    seen = duplicate_of(layout, chart, bar)
+    if seen and seen.discord_url:
+        embed["image"] = {"url": seen.discord_url}
+        metrics.incr("screenshot.dedup.discord_reused")
+        return False
+    embed["image"] = {"url": f"attachment://{_attachment_name(chart, n)}"}
+    return True
+
+
+def _remember_uploads(uploads: List[Tuple[str, str, ChartFrame]], message: dict):
+    # Attachments come back in the order the files were sent
+    for (layout, bar, chart), attachment in zip(uploads, message.get("attachments") or []):
+        remember_chart(layout, chart, bar, discord_url=attachment["url"])
+
+
+def _chart_form(body: dict, charts: List[ChartFrame]) -> aiohttp.FormData:
+    """Message JSON plus the chart files. Built per attempt: a FormData can only be sent once."""
+    form = aiohttp.FormData()
+    form.add_field('payload_json', json.dumps(body))
+    for n, chart in enumerate(charts):
+        form.add_field('file' if n == 0 else f'file{n}', chart.data,
+                       filename=_attachment_name(chart, n), content_type=chart.content_type)
+    return form
+
+
+@dataclass
+class DiscordAlert:
+    """One alert's embed, waiting to go out (possibly alongside others) to a webhook."""
+    payload: TradingViewPayload
+    embed: dict
+    chart: Optional[ChartFrame] = None
+
+    @property
+    def layout(self) -> str:
+        return chart_layout(self.payload.sym, self.payload.tf)
+
+    @property
+    def bar(self) -> str:
+        return bar_key(self.payload.ts, self.payload.px)
+
+
+async def send_discord_alert(
+    payload: TradingViewPayload,
+    analysis: str,
+    chart: Optional[ChartFrame] = None,
+    webhook_url: Optional[str] = None
+):
+    """Send analysis + chart to a Discord webhook (DISCORD_WEBHOOK_URL by default)."""
+
+    webhook_url = webhook_url or settings.DISCORD_WEBHOOK_URL
+    if not webhook_url:
+        logger.warning("discord_skipped", reason="No webhook URL configured")
+        return
+
+    alert = DiscordAlert(payload, build_discord_embed(payload, analysis), chart)
+    if settings.DISCORD_BATCH_WINDOW > 0:
+        # Alerts fired together (a kill-zone open) share one message of up to 10 embeds
+        await _batcher(webhook_url).submit(alert)
+    else:
+        await _post_alerts(webhook_url, [alert])
+
+
+async def _post_alerts(webhook_url: str, alerts: List[DiscordAlert]):
+    """Post one webhook message carrying every alert's embed."""
+    # Attach charts if available (in-memory bytes, shared with the other channels);
+    # without a file the message is plain JSON
+    uploads: List[Tuple[str, str, ChartFrame]] = []
+    for alert in alerts:
+        if _embed_chart(alert.embed, alert.layout, alert.bar, alert.chart, n=len(uploads)):
+            uploads.append((alert.layout, alert.bar, alert.chart))
     webhook_payload = {
-        "embeds": [embed],
+        "embeds": [alert.embed for alert in alerts],
         "username": "ICT Analyst",
     }
+    request = {"json": webhook_payload}
+    if uploads:
+        request = {"data": lambda: _chart_form(webhook_payload, [chart for _, _, chart in uploads])}
 
-    form = aiohttp.FormData()
-    form.add_field(
-        'payload_json',
-        json.dumps(webhook_payload)
-    )
+    # wait=true returns the message, with the CDN URLs of the uploaded charts
+    priority = min(trigger_priority(alert.payload.trigger) for alert in alerts)
+    metrics.observe("delivery.discord.batch_size", len(alerts))
+    transport = get_delivery_transport()
+    async with transport.request("discord", "POST", webhook_url,
+                                 destination=webhook_url, priority=priority,
+                                 params={"wait": "true"}, **request) as resp:
+        if resp.status not in (200, 204):
+            raise DeliveryFailed("discord", resp.status, await resp.text())
+        if uploads and resp.status == 200:
+            _remember_uploads(uploads, await resp.json())
+        for alert in alerts:
+            logger.info("discord_sent", trigger=alert.payload.trigger, batch=len(alerts))
 
-    # Attach screenshot if available
-    if screenshot_path and Path(screenshot_path).exists():
-        form.add_field(
-            'file',
-            open(screenshot_path, 'rb'),
-            filename='chart.png',
-            content_type='image/png'
+
+# One batcher per webhook
+_batchers: Dict[str, MicroBatcher] = {}
+
+
+def _batcher(webhook_url: str) -> MicroBatcher:
+    batcher = _batchers.get(webhook_url)
+    if batcher is None:
+        batcher = _batchers[webhook_url] = MicroBatcher(
+            lambda alerts: _post_alerts(webhook_url, alerts),
+            window=settings.DISCORD_BATCH_WINDOW,
+            max_items=settings.DISCORD_BATCH_MAX_EMBEDS,
+            max_size=settings.DISCORD_BATCH_MAX_CHARS,
+            size=lambda alert: embed_length(alert.embed),
         )
+    return batcher
+
+
+async def close_discord_batches():
+    """Send alerts still waiting in a batch (app shutdown)."""
+    for batcher in _batchers.values():
+        await batcher.close()
+    _batchers.clear()
+
+
+class DiscordLiveMessage:
+    """
+    A Discord webhook message that is posted as soon as the first section of a
+    streamed analysis is ready, then edited in place as more of it arrives.
+    """
+
+    channel = "discord"
+
+    def __init__(self, payload: TradingViewPayload, webhook_url: Optional[str] = None):
+        self.payload = payload
+        self.webhook_url = webhook_url or settings.DISCORD_WEBHOOK_URL
+        self.message_id: Optional[str] = None
+
+    async def update(self, analysis: str, chart: Optional[ChartFrame] = None):
+        if not self.webhook_url:
+            return
+
+        layout = chart_layout(self.payload.sym, self.payload.tf)
+        embed = build_discord_embed(self.payload, analysis)
+        bar = bar_key(self.payload.ts, self.payload.px)
+        upload = _embed_chart(embed, layout, bar, chart)
+        body = {
+            "embeds": [embed],
+            "username": "ICT Analyst",
+        }
+
+        transport = get_delivery_transport()
+        priority = trigger_priority(self.payload.trigger)
+        if self.message_id is None:
+            # wait=true makes Discord return the message, so we can edit it later
+            async with transport.request("discord", "POST", self.webhook_url,
+                                         destination=self.webhook_url, priority=priority,
+                                         params={"wait": "true"}, json=body) as resp:
+                if resp.status != 200:
+                    raise DeliveryFailed("discord", resp.status, await resp.text())
+                self.message_id = (await resp.json())["id"]
+                logger.info("discord_live_posted", trigger=self.payload.trigger)
+        else:
+            url = f"{self.webhook_url}/messages/{self.message_id}"
+            request = {"json": body}
+            if upload:
+                request = {"data": lambda: _chart_form(body, [chart])}
+            async with transport.request("discord", "PATCH", url, destination=self.webhook_url,
+                                         priority=priority, **request) as resp:
+                if resp.status != 200:
+                    raise DeliveryFailed("discord", resp.status, await resp.text())
+                if upload:
+                    _remember_uploads([(layout, bar, chart)], await resp.json())
 
-    async with aiohttp.ClientSession() as session:
-        async with session.post(settings.DISCORD_WEBHOOK_URL, data=form) as resp:
-            if resp.status in (200, 204):
-                logger.info("discord_sent", trigger=payload.trigger)
-            else:
-                text = await resp.text()
-                logger.error("discord_error", status=resp.status, body=text)
+    async def finalize(self, analysis: str, chart: Optional[ChartFrame] = None):
+        """Write the complete analysis. Falls back to a normal alert if nothing was posted yet."""
+        if self.message_id is None:
+            await send_discord_alert(self.payload, analysis, chart, webhook_url=self.webhook_url)
+            return
+        await self.update(analysis, chart)
+        logger.info("discord_sent", trigger=self.payload.trigger, live=True)
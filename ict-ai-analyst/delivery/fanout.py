@@ -0,0 +1,78 @@
+from typing import Awaitable, List, Optional
+import asyncio
+import time
+import structlog
+from config import settings
+from webhook.models import TradingViewPayload
+from screenshot.frame import ChartFrame
+from utils.metrics import metrics
+from . import discord_bot, telegram_bot
+
+logger = structlog.get_logger()
+
+
+def _split(primary: str, extra: str) -> List[str]:
+    """The single-destination setting plus a comma-separated list, without duplicates."""
+    destinations = [primary] + extra.split(",")
+    return list(dict.fromkeys(d.strip() for d in destinations if d.strip()))
+
+
+def discord_webhooks() -> List[str]:
+    """DISCORD_WEBHOOK_URL plus DISCORD_WEBHOOK_URLS, when Discord delivery is on."""
+    if settings.DELIVERY_METHOD not in ("discord", "both"):
+        return []
+    return _split(settings.DISCORD_WEBHOOK_URL, settings.DISCORD_WEBHOOK_URLS)
+
+
+def telegram_chats() -> List[str]:
+    """TELEGRAM_CHAT_ID plus TELEGRAM_CHAT_IDS, when Telegram delivery is on."""
+    if settings.DELIVERY_METHOD not in ("telegram", "both") or not settings.TELEGRAM_BOT_TOKEN:
+        return []
+    return _split(settings.TELEGRAM_CHAT_ID, settings.TELEGRAM_CHAT_IDS)
+
+
+async def guarded(channel: str, destination: int, send: Awaitable) -> bool:
+    """
+    One destination's send. Each HTTP attempt is bounded by DELIVERY_DESTINATION_TIMEOUT
+    (in the transport); waiting for the destination's rate limits is not, up to the
+    much longer DELIVERY_DEADLINE. Errors and timeouts are logged and counted here
+    so they never reach the other destinations.
+    """
+    try:
+        await asyncio.wait_for(send, settings.DELIVERY_DEADLINE)
+        return True
+    except asyncio.TimeoutError:
+        metrics.incr(f"delivery.{channel}.timeouts")
+        logger.error("delivery_timeout", channel=channel, destination=destination)
+    except Exception as e:
+        metrics.incr(f"delivery.{channel}.errors")
+        logger.error("delivery_failed", channel=channel, destination=destination, error=str(e))
+    return False
+
+
+async def deliver_alert(
+    payload: TradingViewPayload,
+    analysis: str,
+    chart: Optional[ChartFrame] = None
+) -> List[bool]:
+    """
+    Send the alert to every configured Discord webhook and Telegram chat at once,
+    so delivery takes as long as the slowest destination, not the sum of them.
+    Returns whether each destination got it (empty with none configured).
+    """
+    sends = [
+        guarded("discord", n, discord_bot.send_discord_alert(payload, analysis, chart, webhook_url=url))
+        for n, url in enumerate(discord_webhooks())
+    ] + [
+        guarded("telegram", n, telegram_bot.send_telegram_alert(payload, analysis, chart, chat_id=chat))
+        for n, chat in enumerate(telegram_chats())
+    ]
+    if not sends:
+        logger.warning("delivery_skipped", reason="No destinations configured")
+        return []
+
+    started = time.perf_counter()
+    delivered = await asyncio.gather(*sends)
+    metrics.observe("delivery.fanout_ms", (time.perf_counter() - started) * 1000)
+    logger.info("alert_delivered", trigger=payload.trigger, destinations=len(sends), failed=delivered.count(False))
+    return delivered
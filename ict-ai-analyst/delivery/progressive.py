@@ -0,0 +1,66 @@
+from typing import List, Optional
+import asyncio
+import time
+import structlog
+from webhook.models import TradingViewPayload
+from utils.metrics import metrics
+from screenshot.frame import ChartFrame
+from .discord_bot import DiscordLiveMessage
+from .telegram_bot import TelegramLiveMessage
+from .fanout import discord_webhooks, telegram_chats, guarded
+
+logger = structlog.get_logger()
+
+
+class ProgressiveDelivery:
+    """
+    Pushes a streamed analysis to every configured channel while it is still being
+    written. `push()` never blocks the stream: only the newest snapshot is sent,
+    and a snapshot that arrives mid-send replaces any older one still waiting.
+    """
+
+    def __init__(self, payload: TradingViewPayload, started_at: Optional[float] = None):
+        self.payload = payload
+        self.started_at = started_at or time.perf_counter()
+        self.messages: List = (
+            [DiscordLiveMessage(payload, webhook_url=url) for url in discord_webhooks()]
+            + [TelegramLiveMessage(payload, chat_id=chat) for chat in telegram_chats()]
+        )
+        self._pending: Optional[str] = None
+        self._sender: Optional[asyncio.Task] = None
+        self._first_sent = False
+
+    def push(self, text: str):
+        """Queue a partial analysis (called from the stream, synchronously)."""
+        self._pending = text
+        if self._sender is None or self._sender.done():
+            self._sender = asyncio.create_task(self._drain())
+
+    async def _drain(self):
+        while self._pending is not None:
+            text, self._pending = self._pending, None
+            results = await asyncio.gather(
+                *[m.update(text) for m in self.messages], return_exceptions=True
+            )
+            for result in results:
+                if isinstance(result, Exception):
+                    logger.error("progressive_update_error", error=str(result))
+            if not self._first_sent:
+                self._first_sent = True
+                metrics.observe(
+                    "pipeline.time_to_first_section_ms",
+                    (time.perf_counter() - self.started_at) * 1000
+                )
+
+    async def finish(self, analysis: str, chart: Optional[ChartFrame] = None) -> List[bool]:
+        """
+        Wait for in-flight updates, then write the complete analysis everywhere.
+        Returns whether each destination got it.
+        """
+        self._pending = None
+        if self._sender is not None:
+            await asyncio.gather(self._sender, return_exceptions=True)
+        return await asyncio.gather(*[
+            guarded(getattr(m, "channel", "live"), n, m.finalize(analysis, chart))
+            for n, m in enumerate(self.messages)
+        ])
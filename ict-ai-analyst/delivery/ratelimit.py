@@ -0,0 +1,140 @@
+from typing import Dict, List, Mapping, Optional
+import asyncio
+import heapq
+import itertools
+import random
+import time
+import structlog
+from config import settings
+from utils.metrics import metrics
+
+logger = structlog.get_logger()
+
+# Lower goes first when a destination is throttled (README "Alert Trigger Types" urgency)
+TRIGGER_PRIORITY = {
+    "SETUP_FORMING": 0,
+    "CONVICTION_CROSSED": 1,
+    "KZ_OPEN_NY_AM": 1,
+    "PRE_OPEN_0929": 2,
+    "KZ_OPEN_LONDON": 2,
+    "KZ_OPEN_NY_PM": 2,
+    "PRE_MARKET_0915": 3,
+}
+DEFAULT_PRIORITY = 2
+
+
+def trigger_priority(trigger: Optional[str]) -> int:
+    return TRIGGER_PRIORITY.get(trigger or "", DEFAULT_PRIORITY)
+
+
+class TokenBucket:
+    """
+    At most `limit` sends in any `period` seconds: up to `burst` at once, refilled at
+    (limit - burst) / period. Waiters are served lowest priority value first, FIFO
+    within a priority. `pause()` holds everyone back when the server says so.
+    """
+
+    def __init__(self, limit: int, period: float, burst: int = 1):
+        self.capacity = float(max(1, min(burst, limit)))
+        self.rate = max(limit - self.capacity, 1) / period
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._waiters: list = []  # heap of (priority, seq, future)
+        self._seq = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def acquire(self, priority: int = DEFAULT_PRIORITY):
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._seq), future))
+        self._dispatch()
+        await future
+
+    def pause(self, seconds: float):
+        """Send nothing for `seconds` (429 retry_after, or a bucket the server reports empty)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+        self._dispatch()
+
+    def _dispatch(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        while self._waiters and self.tokens >= 1 and now >= self.blocked_until:
+            _, _, future = heapq.heappop(self._waiters)
+            if future.done():  # caller gave up (timeout/cancel)
+                continue
+            self.tokens -= 1
+            future.set_result(None)
+        while self._waiters and self._waiters[0][2].done():
+            heapq.heappop(self._waiters)
+
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._waiters:
+            delay = max(self.blocked_until - now, (1 - self.tokens) / self.rate, 0.001)
+            self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+
+class RateLimiter:
+    """
+    Token buckets per delivery destination: one per Discord webhook, and for Telegram
+    one bot-wide bucket plus one per group chat. Learns from X-RateLimit-* headers
+    and 429 responses so queued sends wait out the server's window too.
+    """
+
+    def __init__(self):
+        self._buckets: Dict[str, TokenBucket] = {}
+
+    def _bucket(self, key: str, limit: int, period: float, burst: int) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(limit, period, burst)
+        return bucket
+
+    def buckets(self, channel: str, destination: str) -> List[TokenBucket]:
+        if channel == "discord":
+            return [self._bucket(f"discord:{destination}", settings.DISCORD_RATE_PER_MINUTE, 60.0, settings.DISCORD_BURST)]
+        buckets = []
+        if destination.startswith("-"):  # group and channel ids are negative
+            buckets.append(self._bucket(
+                f"telegram:{destination}", settings.TELEGRAM_GROUP_RATE_PER_MINUTE, 60.0, settings.TELEGRAM_GROUP_BURST
+            ))
+        buckets.append(self._bucket("telegram", settings.TELEGRAM_RATE_PER_SECOND, 1.0, settings.TELEGRAM_BURST))
+        return buckets
+
+    async def acquire(self, channel: str, destination: str, priority: int = DEFAULT_PRIORITY):
+        started = time.perf_counter()
+        for bucket in self.buckets(channel, destination):
+            await bucket.acquire(priority)
+        metrics.observe(f"delivery.{channel}.throttle_ms", (time.perf_counter() - started) * 1000)
+
+    def pause(self, channel: str, destination: str, seconds: float):
+        # A little jitter so every queued send doesn't hit the server in the same instant
+        seconds += random.uniform(0, settings.DELIVERY_RETRY_JITTER)
+        for bucket in self.buckets(channel, destination):
+            bucket.pause(seconds)
+        logger.warning("delivery_rate_limited", channel=channel, wait=round(seconds, 2))
+
+    def observe(self, channel: str, destination: str, headers: Mapping[str, str]):
+        """Discord reports the bucket on every response; an empty one means wait for its reset."""
+        if headers.get("X-RateLimit-Remaining") == "0" and headers.get("X-RateLimit-Reset-After"):
+            self.pause(channel, destination, float(headers["X-RateLimit-Reset-After"]))
+
+
+def retry_after(body: object, headers: Mapping[str, str]) -> Optional[float]:
+    """Seconds to wait from a 429: Discord's `retry_after`, Telegram's `parameters.retry_after`, or Retry-After."""
+    if isinstance(body, dict):
+        seconds = body.get("retry_after") or (body.get("parameters") or {}).get("retry_after")
+        if seconds:
+            return float(seconds)
+    try:
+        return float(headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+def backoff(attempt: int) -> float:
+    """Full-jitter exponential backoff for retried server errors."""
+    return random.uniform(0, settings.DELIVERY_RETRY_BASE * 2 ** attempt)
@@ -1,9 +1,16 @@
 from typing import Optional
+import json
 import aiohttp
 import structlog
-from pathlib import Path
 from config import settings
 from webhook.models import TradingViewPayload
+from screenshot.capture import chart_layout
+from screenshot.frame import ChartFrame
+from screenshot.dedup import duplicate_of, remember_chart, bar_key
+from utils.metrics import metrics
+from .transport import get_delivery_transport, DeliveryFailed
+from .ratelimit import trigger_priority
+from .telegram_format import telegram_text
 
 logger = structlog.get_logger()
 
@@ -11,65 +18,139 @@ logger = structlog.get_logger()
 async def send_telegram_alert(
     payload: TradingViewPayload,
     analysis: str,
-    screenshot_path: Optional[str] = None
+    chart: Optional[ChartFrame] = None,
+    chat_id: Optional[str] = None
 ):
-    """Send analysis + screenshot to Telegram."""
+    """Send analysis + chart to a Telegram chat (TELEGRAM_CHAT_ID by default)."""
 
-    if not settings.TELEGRAM_BOT_TOKEN or not settings.TELEGRAM_CHAT_ID:
+    chat_id = chat_id or settings.TELEGRAM_CHAT_ID
+    if not settings.TELEGRAM_BOT_TOKEN or not chat_id:
         logger.warning("telegram_skipped", reason="No bot token or chat ID configured")
         return
 
-    base_url = f"https://api.telegram.org/bot{settings.TELEGRAM_BOT_TOKEN}"
+    base_url = f"{settings.TELEGRAM_API_URL}/bot{settings.TELEGRAM_BOT_TOKEN}"
+    priority = trigger_priority(payload.trigger)
 
     # Telegram has a 1024 char caption limit for photos
     # Send photo first, then full analysis as a separate message
+    # Formatting goes as pre-computed entities, so Telegram has no Markdown to reject
 
     # Step 1: Send screenshot with brief caption
     direction_emoji = "🟢" if payload.bias.dir == "BULL" else "🔴"
-    caption = (
+    caption, caption_entities = telegram_text(
         f"{direction_emoji} **{payload.trigger.replace('_', ' ')}**\n"
         f"📈 {payload.sym} | {payload.model.name.replace('_', ' ')}\n"
         f"🎯 Entry: {payload.entry.px if payload.entry.found else 'Scanning'}\n"
-        f"📊 Conviction: {payload.narr.score}%"
+        f"📊 Conviction: {payload.narr.score}%",
+        limit=1024
     )
 
-    async with aiohttp.ClientSession() as session:
-        # Send photo if screenshot exists
-        if screenshot_path and Path(screenshot_path).exists():
+    # Send photo if a chart was captured (in-memory bytes, shared with the other channels)
+    photo_failed: Optional[DeliveryFailed] = None
+    if chart:
+        # A near-duplicate of the last chart sent for this layout and bar re-sends its file_id
+        layout = chart_layout(payload.sym, payload.tf)
+        bar = bar_key(payload.ts, payload.px)
+        seen = duplicate_of(layout, chart, bar)
+        if seen and seen.telegram_file_id:
+            metrics.incr("screenshot.dedup.telegram_reused")
+
+        def photo_form() -> aiohttp.FormData:
+            # Built per attempt: a FormData can only be sent once
             form = aiohttp.FormData()
-            form.add_field('chat_id', settings.TELEGRAM_CHAT_ID)
+            form.add_field('chat_id', chat_id)
             form.add_field('caption', caption)
-            form.add_field('parse_mode', 'Markdown')
-            form.add_field(
-                'photo',
-                open(screenshot_path, 'rb'),
-                filename='chart.png',
-                content_type='image/png'
-            )
-
-            async with session.post(f"{base_url}/sendPhoto", data=form) as resp:
-                if resp.status != 200:
-                    text = await resp.text()
-                    logger.error("telegram_photo_error", status=resp.status, body=text)
-
-        # Step 2: Send full analysis as text message
-        # Telegram max message length is 4096
-        truncated = analysis[:4090] if len(analysis) > 4090 else analysis
-
-        # Try Markdown first, fall back to plain text if parsing fails
-        for parse_mode in ["Markdown", None]:
-            async with session.post(f"{base_url}/sendMessage", json={
-                "chat_id": settings.TELEGRAM_CHAT_ID,
-                "text": truncated,
-                **({"parse_mode": parse_mode} if parse_mode else {})
-            }) as resp:
-                if resp.status == 200:
-                    logger.info("telegram_sent", trigger=payload.trigger, parse_mode=parse_mode or "plain")
-                    return  # Success!
-                else:
-                    text = await resp.text()
-                    if "can't parse entities" in text and parse_mode:
-                        logger.warning("telegram_markdown_failed", msg="Retrying without parse_mode")
-                        continue  # Try plain text
-                    logger.error("telegram_text_error", status=resp.status, body=text)
-                    return
+            if caption_entities:
+                form.add_field('caption_entities', json.dumps(caption_entities))
+            if seen and seen.telegram_file_id:
+                form.add_field('photo', seen.telegram_file_id)
+            else:
+                form.add_field(
+                    'photo',
+                    chart.data,
+                    filename=chart.filename,
+                    content_type=chart.content_type
+                )
+            return form
+
+        async with get_delivery_transport().request("telegram", "POST", f"{base_url}/sendPhoto",
+                                                    destination=chat_id, priority=priority, data=photo_form) as resp:
+            if resp.status != 200:
+                # The analysis below still goes out; the send fails once it has
+                photo_failed = DeliveryFailed("telegram", resp.status, await resp.text())
+                logger.error("telegram_photo_error", status=resp.status, body=str(photo_failed))
+            elif not (seen and seen.telegram_file_id):
+                sizes = (await resp.json())["result"]["photo"]
+                remember_chart(layout, chart, bar, telegram_file_id=sizes[-1]["file_id"])
+
+    # Step 2: Send full analysis as text message
+    # Telegram max message length is 4096
+    await _send_text(base_url, "sendMessage", chat_id, analysis, priority)
+    if photo_failed:
+        raise photo_failed
+    logger.info("telegram_sent", trigger=payload.trigger)
+
+
+async def _send_text(
+    base_url: str,
+    method: str,
+    chat_id: str,
+    analysis: str,
+    priority: int,
+    **fields
+) -> Optional[dict]:
+    """
+    Call sendMessage / editMessageText with the analysis as plain text + entities,
+    in a single request. Returns the sent message; None for an edit that changed
+    nothing. Raises DeliveryFailed on any other error.
+    """
+    text, entities = telegram_text(analysis, limit=4090)
+    body = {"chat_id": chat_id, "text": text, **fields}
+    if entities:
+        body["entities"] = entities
+    async with get_delivery_transport().request("telegram", "POST", f"{base_url}/{method}",
+                                                destination=str(chat_id), priority=priority, json=body) as resp:
+        if resp.status == 200:
+            data = await resp.json()
+            return data.get("result")
+        text = await resp.text()
+        if "message is not modified" in text:
+            return None
+        raise DeliveryFailed("telegram", resp.status, text)
+
+
+class TelegramLiveMessage:
+    """
+    A Telegram message that is sent as soon as the first section of a streamed
+    analysis is ready, then edited in place as more of it arrives.
+    """
+
+    channel = "telegram"
+
+    def __init__(self, payload: TradingViewPayload, chat_id: Optional[str] = None):
+        self.payload = payload
+        self.chat_id = chat_id or settings.TELEGRAM_CHAT_ID
+        self.message_id: Optional[int] = None
+
+    async def update(self, analysis: str):
+        if not settings.TELEGRAM_BOT_TOKEN or not self.chat_id:
+            return
+
+        base_url = f"{settings.TELEGRAM_API_URL}/bot{settings.TELEGRAM_BOT_TOKEN}"
+        priority = trigger_priority(self.payload.trigger)
+
+        if self.message_id is None:
+            result = await _send_text(base_url, "sendMessage", self.chat_id, analysis, priority)
+            self.message_id = result["message_id"]
+            logger.info("telegram_live_posted", trigger=self.payload.trigger)
+        else:
+            await _send_text(base_url, "editMessageText", self.chat_id, analysis, priority,
+                             message_id=self.message_id)
+
+    async def finalize(self, analysis: str, chart: Optional[ChartFrame] = None):
+        """Write the complete analysis. Falls back to a normal alert if nothing was sent yet."""
+        if self.message_id is None:
+            await send_telegram_alert(self.payload, analysis, chart, chat_id=self.chat_id)
+            return
+        await self.update(analysis)
+        logger.info("telegram_sent", trigger=self.payload.trigger, live=True)
@@ -0,0 +1,110 @@
+"""
+Telegram formatting without a parse mode.
+
+The analysis is written in the prompt's Markdown (`### headings`, `**bold**`,
+`` `code` ``, `*italic*`), which Telegram's own parsers reject as soon as a marker
+is unbalanced or an underscore sits in a symbol name. Converting it here to plain
+text plus `entities` (offsets in UTF-16 code units) means Telegram never has
+anything to parse, so every message goes out in one request.
+"""
+from typing import List, Tuple
+import re
+import structlog
+from utils.metrics import metrics
+
+logger = structlog.get_logger()
+
+HEADING = re.compile(r"^#{1,6}\s+(.*)$")
+INLINE = re.compile(
+    r"\*\*(?P<bold>[^\n]+?)\*\*"
+    r"|`(?P<code>[^`\n]+)`"
+    r"|(?<![*\w])\*(?P<italic>[^*\s](?:[^*\n]*[^*\s])?)\*(?![*\w])"
+)
+ENTITY_TYPES = {"bold": "bold", "code": "code", "italic": "italic"}
+
+
+def utf16_len(text: str) -> int:
+    """Length as Telegram counts entity offsets (emoji outside the BMP are 2)."""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def _inline(text: str, offset: int) -> Tuple[str, List[dict]]:
+    """Strip inline markers from one line; entities are placed from `offset` on."""
+    out, entities, position = [], [], offset
+    last = 0
+    for match in INLINE.finditer(text):
+        before = text[last:match.start()]
+        out.append(before)
+        position += utf16_len(before)
+        kind = match.lastgroup
+        inner = match.group(kind)
+        out.append(inner)
+        length = utf16_len(inner)
+        if inner.strip():
+            entities.append({"type": ENTITY_TYPES[kind], "offset": position, "length": length})
+        position += length
+        last = match.end()
+    out.append(text[last:])
+    return "".join(out), entities
+
+
+def markdown_to_entities(markdown: str) -> Tuple[str, List[dict]]:
+    """LLM Markdown → (plain text, Telegram message entities). Unmatched markers stay as text."""
+    lines, entities, position = [], [], 0
+    for line in markdown.split("\n"):
+        heading = HEADING.match(line)
+        text, inline = _inline(heading.group(1) if heading else line, position)
+        if heading and text.strip():
+            # Bold already covers the whole heading; code/italic nest inside it
+            inline = [e for e in inline if e["type"] != "bold"]
+            entities.append({"type": "bold", "offset": position, "length": utf16_len(text)})
+        entities.extend(inline)
+        lines.append(text)
+        position += utf16_len(text) + 1  # the newline
+    return "\n".join(lines), sorted(entities, key=lambda e: (e["offset"], -e["length"]))
+
+
+def truncate(text: str, entities: List[dict], limit: int) -> Tuple[str, List[dict]]:
+    """Cut the text to `limit` characters, clipping entities that ran past the cut."""
+    if len(text) <= limit:
+        return text, entities
+    text = text[:limit]
+    end = utf16_len(text)
+    clipped = []
+    for entity in entities:
+        length = min(entity["length"], end - entity["offset"])
+        if length > 0:
+            clipped.append({**entity, "length": length})
+    return text, clipped
+
+
+def validate_entities(text: str, entities: List[dict]) -> bool:
+    """What Telegram checks: entities inside the text, non-empty, nested or disjoint."""
+    size = utf16_len(text)
+    spans = []
+    for entity in entities:
+        start, length = entity["offset"], entity["length"]
+        if start < 0 or length <= 0 or start + length > size:
+            return False
+        spans.append((start, start + length))
+    for i, (start, end) in enumerate(spans):
+        for other_start, other_end in spans[i + 1:]:
+            overlap = start < other_end and other_start < end
+            nested = (start <= other_start and other_end <= end) or (other_start <= start and end <= other_end)
+            if overlap and not nested:
+                return False
+    return True
+
+
+def telegram_text(markdown: str, limit: int) -> Tuple[str, List[dict]]:
+    """
+    Text and entities ready for sendMessage/sendPhoto, at most `limit` characters.
+    Should conversion ever produce entities Telegram would refuse, the message goes
+    out unformatted rather than being rejected.
+    """
+    text, entities = truncate(*markdown_to_entities(markdown), limit)
+    if not validate_entities(text, entities):
+        metrics.incr("delivery.telegram.entity_fallbacks")
+        logger.warning("telegram_entities_invalid", msg="Sending without formatting")
+        return markdown[:limit], []
+    return text, entities
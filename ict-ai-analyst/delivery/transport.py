@@ -0,0 +1,165 @@
+from typing import AsyncIterator, Dict, Optional
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
+import asyncio
+import time
+import aiohttp
+import structlog
+from config import settings
+from utils.metrics import metrics
+from .ratelimit import RateLimiter, DEFAULT_PRIORITY, retry_after, backoff
+
+logger = structlog.get_logger()
+
+
+class DeliveryFailed(RuntimeError):
+    """A destination answered with a non-2xx status (after any retries)."""
+
+    def __init__(self, channel: str, status: int, body: str):
+        super().__init__(f"{channel} {status}: {body[:200]}")
+        self.status = status
+
+
+def _trace_config() -> aiohttp.TraceConfig:
+    """
+    Per-request timings under `delivery.<channel>.*`: connect_ms (DNS + TCP + TLS,
+    0 on a reused connection) and ttfb_ms (until the response headers arrived).
+    """
+    trace = aiohttp.TraceConfig()
+
+    async def on_request_start(session, ctx, params):
+        ctx.started = time.perf_counter()
+        ctx.connect_ms = 0.0
+
+    async def on_connection_create_start(session, ctx, params):
+        ctx.connecting = time.perf_counter()
+
+    async def on_connection_create_end(session, ctx, params):
+        ctx.connect_ms += (time.perf_counter() - ctx.connecting) * 1000
+
+    async def on_request_end(session, ctx, params):
+        channel = (ctx.trace_request_ctx or {}).get("channel", "other")
+        metrics.observe(f"delivery.{channel}.connect_ms", ctx.connect_ms)
+        metrics.observe(f"delivery.{channel}.ttfb_ms", (time.perf_counter() - ctx.started) * 1000)
+
+    trace.on_request_start.append(on_request_start)
+    trace.on_connection_create_start.append(on_connection_create_start)
+    trace.on_connection_create_end.append(on_connection_create_end)
+    trace.on_request_end.append(on_request_end)
+    return trace
+
+
+class DeliveryTransport:
+    """
+    Long-lived aiohttp sessions for the delivery channels, one per destination host
+    (discord.com, api.telegram.org), so alerts reuse warm keep-alive connections
+    and cached DNS instead of paying the handshake every time. Requests for a known
+    destination also go through its rate limits (see `delivery.ratelimit`).
+    """
+
+    def __init__(self):
+        self._sessions: Dict[str, aiohttp.ClientSession] = {}
+        self.limiter = RateLimiter()
+
+    def _build(self, host: str) -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=settings.DELIVERY_POOL_MAX_CONNECTIONS,
+            limit_per_host=settings.DELIVERY_POOL_MAX_CONNECTIONS,
+            keepalive_timeout=settings.DELIVERY_POOL_KEEPALIVE_EXPIRY,
+            ttl_dns_cache=settings.DELIVERY_DNS_CACHE_TTL,
+        )
+        logger.info("delivery_session_created", host=host)
+        return aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=settings.DELIVERY_TIMEOUT),
+            trace_configs=[_trace_config()],
+        )
+
+    def session(self, url: str) -> aiohttp.ClientSession:
+        """Pooled session for the host `url` points at."""
+        parts = urlsplit(url)
+        host = f"{parts.scheme}://{parts.netloc}"
+        session = self._sessions.get(host)
+        if session is None or session.closed:
+            session = self._sessions[host] = self._build(host)
+        return session
+
+    @asynccontextmanager
+    async def request(
+        self,
+        channel: str,
+        method: str,
+        url: str,
+        destination: Optional[str] = None,
+        priority: int = DEFAULT_PRIORITY,
+        **kwargs
+    ) -> AsyncIterator[aiohttp.ClientResponse]:
+        """
+        A request on the host's pooled session. With a `destination` (webhook URL or
+        chat id) it waits for that destination's rate limits, queued by `priority`.
+        Each attempt is cut off after DELIVERY_DESTINATION_TIMEOUT; the time spent
+        queued for a token doesn't count against it. 429s and 5xx are retried up to
+        DELIVERY_MAX_RETRIES times — 429s after the server's retry_after, 5xx after a
+        jittered backoff — so `data` may be a callable that builds a fresh FormData
+        per attempt. Records `delivery.<channel>.total_ms` once the caller is done
+        with the response.
+        """
+        timeout = aiohttp.ClientTimeout(total=settings.DELIVERY_DESTINATION_TIMEOUT)
+        started = time.perf_counter()
+        data = kwargs.pop("data", None)
+        for attempt in range(settings.DELIVERY_MAX_RETRIES + 1):
+            if destination:
+                await self.limiter.acquire(channel, destination, priority)
+            body = data() if callable(data) else data
+            async with self.session(url).request(
+                method, url, data=body, timeout=timeout, trace_request_ctx={"channel": channel}, **kwargs
+            ) as resp:
+                if destination:
+                    self.limiter.observe(channel, destination, resp.headers)
+                retryable = resp.status == 429 or resp.status >= 500
+                if not retryable or attempt == settings.DELIVERY_MAX_RETRIES:
+                    yield resp
+                    # An unread body would close the connection instead of returning it to the pool
+                    await resp.read()
+                    break
+                wait = None
+                if resp.status == 429:
+                    metrics.incr(f"delivery.{channel}.rate_limited")
+                    try:
+                        wait = retry_after(await resp.json(content_type=None), resp.headers)
+                    except ValueError:
+                        wait = retry_after(None, resp.headers)
+                else:
+                    await resp.read()
+            metrics.incr(f"delivery.{channel}.retries")
+            if wait is not None and destination:
+                self.limiter.pause(channel, destination, wait)
+            else:
+                await asyncio.sleep(wait if wait is not None else backoff(attempt))
+        metrics.observe(f"delivery.{channel}.total_ms", (time.perf_counter() - started) * 1000)
+
+    async def close(self):
+        for host, session in self._sessions.items():
+            await session.close()
+            logger.info("delivery_session_closed", host=host)
+        self._sessions.clear()
+
+
+# Singleton instance
+_transport: Optional[DeliveryTransport] = None
+
+
+def get_delivery_transport() -> DeliveryTransport:
+    """Get the shared delivery transport. Created lazily so the poller works without the app lifespan."""
+    global _transport
+    if _transport is None:
+        _transport = DeliveryTransport()
+    return _transport
+
+
+async def close_delivery_transport():
+    """Close all delivery sessions."""
+    global _transport
+    if _transport:
+        await _transport.close()
+        _transport = None
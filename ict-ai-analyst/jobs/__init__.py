@@ -0,0 +1,3 @@
+# Jobs package
+from .queue import PipelineQueue, QueueFull
+from .journal import JobJournal, JournalEntry, get_journal, close_journal, journal_path
@@ -0,0 +1,270 @@
+from typing import List, Optional
+from contextlib import closing
+from dataclasses import dataclass
+from pathlib import Path
+import asyncio
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+import structlog
+from config import settings
+from utils.metrics import metrics
+
+logger = structlog.get_logger()
+
+APP_DIR = Path(__file__).resolve().parent.parent
+
+# Pipeline stages, in order. "delivered" and "failed" are terminal.
+STAGES = ("received", "analyzed", "delivered", "failed")
+TERMINAL_STAGES = ("delivered", "failed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    payload TEXT,
+    analysis TEXT,
+    at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS events_job ON events (job_id, seq);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+MAX_BATCH = 256
+
+
+@dataclass
+class JournalEntry:
+    """An accepted job that has not reached a terminal stage."""
+    job_id: str
+    stage: str
+    payload: str                    # TradingViewPayload JSON
+    analysis: Optional[str] = None  # Set once the job has been analyzed
+    received_at: float = 0.0
+
+
+class JobJournal:
+    """
+    Append-only SQLite (WAL) journal of accepted alerts and their pipeline stage.
+
+    All writes go through one background thread that drains whatever is pending and
+    commits it in a single transaction (group commit), so a burst of webhooks shares
+    one commit instead of paying for one each. Every `compact_every` commits the
+    same thread drops finished jobs and ones too old to replay, so the table stays
+    bounded between restarts.
+    """
+
+    def __init__(self, path: str, compact_every: int = 0, max_age: Optional[float] = None):
+        self.path = Path(path)
+        self.compact_every = compact_every
+        self.max_age = max_age
+        self._writes: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        # WAL + NORMAL survives process crashes/restarts; only an OS crash can lose the tail
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def start(self):
+        """Create the store and start the writer thread."""
+        if self._thread:
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+        self._thread = threading.Thread(target=self._writer, name="job-journal", daemon=True)
+        self._thread.start()
+        logger.info("journal_started", path=str(self.path))
+
+    def close(self):
+        """Flush pending writes and stop the writer thread."""
+        if self._thread:
+            self._writes.put(None)
+            self._thread.join()
+            self._thread = None
+            logger.info("journal_closed")
+
+    # --- Write path ---
+
+    def record(
+        self,
+        job_id: str,
+        stage: str,
+        payload: Optional[str] = None,
+        analysis: Optional[str] = None,
+        wait: bool = False,
+    ) -> Optional[asyncio.Future]:
+        """
+        Append a stage event. Returns a future resolved once the event is committed
+        when `wait` is set; otherwise the write is fire-and-forget (still ordered).
+        """
+        if self._thread is None:
+            self.start()
+        future = None
+        if wait:
+            loop = asyncio.get_running_loop()
+            future = loop.create_future()
+        row = (job_id, stage, payload, analysis, time.time())
+        self._writes.put((row, future))
+        return future
+
+    async def record_received(self, payload_json: str) -> str:
+        """Journal a newly accepted alert and wait for the commit. Returns the job id."""
+        job_id = uuid.uuid4().hex
+        start = time.perf_counter()
+        await self.record(job_id, "received", payload=payload_json, wait=True)
+        metrics.observe("journal.append_ms", (time.perf_counter() - start) * 1000)
+        return job_id
+
+    def _writer(self):
+        conn = self._connect()
+        commits = 0
+        running = True
+        while running:
+            batch = [self._writes.get()]
+            if batch[0] is None:
+                break
+            while len(batch) < MAX_BATCH:
+                try:
+                    item = self._writes.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    running = False
+                    break
+                batch.append(item)
+
+            error = None
+            try:
+                with conn:
+                    conn.executemany(
+                        "INSERT INTO events (job_id, stage, payload, analysis, at) VALUES (?, ?, ?, ?, ?)",
+                        [row for row, _ in batch]
+                    )
+            except Exception as e:
+                error = e
+                logger.error("journal_write_error", error=str(e), batch=len(batch))
+            metrics.observe("journal.batch_size", len(batch))
+
+            commits += 1
+            if self.compact_every and commits % self.compact_every == 0:
+                self._prune(conn)
+
+            for _, future in batch:
+                if future is not None:
+                    future.get_loop().call_soon_threadsafe(_resolve, future, error)
+        conn.close()
+
+    def _prune(self, conn: sqlite3.Connection):
+        """Delete jobs that reached a terminal stage, and unfinished ones past `max_age`."""
+        terminal = ",".join("?" * len(TERMINAL_STAGES))
+        stale_before = time.time() - self.max_age if self.max_age is not None else 0
+        try:
+            with conn:
+                deleted = conn.execute(f"""
+                    DELETE FROM events WHERE job_id IN (
+                        SELECT job_id FROM events WHERE stage IN ({terminal})
+                        UNION
+                        SELECT job_id FROM events WHERE stage = 'received' AND at < ?
+                    )
+                """, (*TERMINAL_STAGES, stale_before)).rowcount
+        except Exception as e:
+            logger.error("journal_compact_error", error=str(e))
+            return
+        metrics.incr("journal.compactions")
+        logger.info("journal_compacted", events=deleted)
+
+    # --- Read path ---
+
+    def unfinished(self, max_age: Optional[float] = None) -> List[JournalEntry]:
+        """Jobs that were accepted but never reached a terminal stage, oldest first."""
+        with closing(self._connect()) as conn:
+            rows = conn.execute("""
+                SELECT r.job_id, r.payload, r.at,
+                    (SELECT stage FROM events WHERE job_id = r.job_id ORDER BY seq DESC LIMIT 1),
+                    (SELECT analysis FROM events WHERE job_id = r.job_id AND stage = 'analyzed'
+                        ORDER BY seq DESC LIMIT 1)
+                FROM events r
+                WHERE r.stage = 'received'
+                ORDER BY r.seq
+            """).fetchall()
+
+        now = time.time()
+        return [
+            JournalEntry(job_id=job_id, stage=stage, payload=payload, analysis=analysis, received_at=at)
+            for job_id, payload, at, stage, analysis in rows
+            if stage not in TERMINAL_STAGES and (max_age is None or now - at <= max_age)
+        ]
+
+    def compact(self, keep: List[str] = ()):
+        """Drop the events of every job except the ones in `keep`."""
+        with closing(self._connect()) as conn, conn:
+            if keep:
+                placeholders = ",".join("?" * len(keep))
+                conn.execute(f"DELETE FROM events WHERE job_id NOT IN ({placeholders})", list(keep))
+            else:
+                conn.execute("DELETE FROM events")
+
+    # --- Checkpoints (used by the poller, which runs in its own process) ---
+
+    def get_checkpoint(self, name: str) -> Optional[str]:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.executescript(SCHEMA)
+            row = conn.execute("SELECT value FROM checkpoints WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else None
+
+    def set_checkpoint(self, name: str, value: str):
+        with closing(self._connect()) as conn, conn:
+            conn.execute(
+                "INSERT INTO checkpoints (name, value) VALUES (?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+                (name, value)
+            )
+
+
+def _resolve(future: asyncio.Future, error: Optional[Exception]):
+    if future.done():
+        return
+    if error is None:
+        future.set_result(None)
+    else:
+        future.set_exception(error)
+
+
+# Singleton instance
+_journal: Optional[JobJournal] = None
+
+
+def journal_path() -> Path:
+    """JOURNAL_PATH, a relative one taken from the app directory rather than the working directory."""
+    return APP_DIR / settings.JOURNAL_PATH
+
+
+def get_journal() -> JobJournal:
+    """Get the shared job journal (the webhook server and the poller open the same file)."""
+    global _journal
+    if _journal is None:
+        _journal = JobJournal(
+            str(journal_path()),
+            compact_every=settings.JOURNAL_COMPACT_EVERY,
+            max_age=settings.JOURNAL_REPLAY_MAX_AGE,
+        )
+    return _journal
+
+
+def close_journal():
+    """Flush and close the job journal."""
+    global _journal
+    if _journal:
+        _journal.close()
+        _journal = None
@@ -0,0 +1,143 @@
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Set
+from collections import deque
+from dataclasses import dataclass, field
+import asyncio
+import time
+import structlog
+from utils.metrics import metrics
+
+logger = structlog.get_logger()
+
+
+class QueueFull(Exception):
+    """Raised when the pipeline queue is at its max depth."""
+
+
+@dataclass
+class Job:
+    key: str
+    item: Any
+    enqueued_at: float = field(default_factory=time.perf_counter)
+
+
+class PipelineQueue:
+    """
+    Bounded in-process job queue with a fixed pool of workers.
+
+    Jobs sharing a key (the symbol) run strictly in submission order, one at a time.
+    Different keys run concurrently, up to `workers` at once, round-robin between keys.
+    """
+
+    def __init__(
+        self,
+        handler: Callable[[Any], Awaitable[None]],
+        workers: int = 4,
+        max_depth: int = 100,
+        name: str = "pipeline",
+    ):
+        self.handler = handler
+        self.workers = workers
+        self.max_depth = max_depth
+        self.name = name
+        self._lanes: Dict[str, Deque[Job]] = {}
+        self._scheduled: Set[str] = set()  # keys queued on _ready or being worked on
+        self._ready: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+        self._depth = 0
+        self._in_flight = 0
+
+    @property
+    def depth(self) -> int:
+        """Jobs waiting for a worker (excludes in-flight)."""
+        return self._depth
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    @property
+    def full(self) -> bool:
+        return self._depth >= self.max_depth
+
+    def submit(self, key: str, item: Any, force: bool = False):
+        """
+        Enqueue a job. Raises QueueFull instead of growing past max_depth,
+        unless `force` is set (for jobs that were already accepted, e.g. replays).
+        """
+        if self.full and not force:
+            metrics.incr(f"{self.name}.rejected")
+            raise QueueFull(f"{self.name} queue full ({self._depth} jobs)")
+
+        self._lanes.setdefault(key, deque()).append(Job(key, item))
+        self._depth += 1
+        metrics.gauge(f"{self.name}.queue_depth", self._depth)
+
+        if key not in self._scheduled:
+            self._scheduled.add(key)
+            if self._ready is not None:
+                self._ready.put_nowait(key)
+
+    async def start(self):
+        """Start the worker pool. Jobs submitted before start are picked up now."""
+        if self._tasks:
+            return
+        self._ready = asyncio.Queue()
+        for key in self._scheduled:
+            self._ready.put_nowait(key)
+        self._tasks = [
+            asyncio.create_task(self._worker(n), name=f"{self.name}-worker-{n}")
+            for n in range(self.workers)
+        ]
+        logger.info("queue_started", queue=self.name, workers=self.workers, max_depth=self.max_depth)
+
+    async def join(self):
+        """Wait until every submitted job has been processed."""
+        if self._ready is not None:
+            await self._ready.join()
+
+    async def stop(self):
+        """
+        Cancel the workers and drop anything still queued.
+        Accepted jobs are in the job journal and get replayed on the next start.
+        """
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        logger.info("queue_stopped", queue=self.name, dropped=self._depth)
+        self._tasks = []
+        self._ready = None
+        self._lanes.clear()
+        self._scheduled.clear()
+        self._depth = 0
+        metrics.gauge(f"{self.name}.queue_depth", 0)
+
+    async def _worker(self, n: int):
+        while True:
+            key = await self._ready.get()
+            lane = self._lanes[key]
+            job = lane.popleft()
+            self._depth -= 1
+            self._in_flight += 1
+            metrics.gauge(f"{self.name}.queue_depth", self._depth)
+            metrics.gauge(f"{self.name}.in_flight", self._in_flight)
+            metrics.observe(f"{self.name}.wait_ms", (time.perf_counter() - job.enqueued_at) * 1000)
+
+            try:
+                with metrics.timer(f"{self.name}.service_ms"):
+                    await self.handler(job.item)
+                metrics.incr(f"{self.name}.completed")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                metrics.incr(f"{self.name}.failed")
+                logger.error("queue_job_error", queue=self.name, key=key, error=str(e))
+            finally:
+                self._in_flight -= 1
+                metrics.gauge(f"{self.name}.in_flight", self._in_flight)
+                if lane:
+                    # Re-queue the key at the back: keeps per-key order, round-robins keys
+                    self._ready.put_nowait(key)
+                else:
+                    del self._lanes[key]
+                    self._scheduled.discard(key)
+                self._ready.task_done()
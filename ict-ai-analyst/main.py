@@ -1,8 +1,16 @@
+import asyncio
 import uvicorn
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
-from webhook.receiver import router as webhook_router
-from screenshot.capture import close_screenshotter
+from webhook.receiver import router as webhook_router, pipeline_queue, replay_unfinished_jobs
+from jobs.journal import get_journal, close_journal
+from screenshot.capture import close_screenshotter, warm_screenshot_pool
+from screenshot.precapture import get_precapture, close_precapture
+from screenshot.workers import get_workers, close_workers
+from analysis.providers import get_provider_clients, close_provider_clients
+from delivery.transport import close_delivery_transport
+from delivery.discord_bot import close_discord_batches
+from utils.metrics import metrics
 from utils.logger import setup_logging
 from config import settings
 import structlog
@@ -19,9 +27,34 @@ async def lifespan(app: FastAPI):
     # Create directories
     Path("screenshots").mkdir(exist_ok=True)
     logger.info("server_starting", host=settings.HOST, port=settings.PORT)
+    if settings.AI_POOL_WARMUP:
+        # Don't hold up startup on the provider — first alert just waits on the handshake
+        provider = "deepseek" if settings.AI_PROVIDER == "deepseek" else "anthropic"
+        app.state.ai_warmup = asyncio.create_task(get_provider_clients().warm_up(provider))
+    if settings.SCREENSHOTS_ENABLED:
+        if settings.SCREENSHOT_WORKERS:
+            # Chromium lives in worker processes; each logs in and loads its charts itself
+            await get_workers().start()
+        else:
+            # Log in and load the chart pages in the background; captures then hit warm pages
+            app.state.screenshot_warmup = asyncio.create_task(warm_screenshot_pool())
+        if settings.SCREENSHOT_PRECAPTURE:
+            get_precapture().start()
+    get_journal().start()
+    replayed = replay_unfinished_jobs()
+    if replayed:
+        logger.info("journal_replayed", jobs=replayed)
+    await pipeline_queue.start()
     yield
     # Cleanup
+    await pipeline_queue.stop()
+    close_journal()
+    await close_precapture()
+    await close_workers()
     await close_screenshotter()
+    await close_provider_clients()
+    await close_discord_batches()
+    await close_delivery_transport()
     logger.info("server_stopped")
 
 
@@ -45,6 +78,7 @@ async def root():
         "endpoints": {
             "webhook": "/webhook",
             "health": "/health",
+            "metrics": "/metrics",
             "test": "/webhook/test"
         }
     }
@@ -56,6 +90,12 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def get_metrics():
+    """Pipeline counters and timing percentiles (ms)."""
+    return metrics.snapshot()
+
+
 if __name__ == "__main__":
     uvicorn.run(
         "main:app",
@@ -15,20 +15,28 @@ from pathlib import Path
 # Add parent to path
 sys.path.insert(0, str(Path(__file__).parent))
 
+from jobs.journal import get_journal
+
 CARETAKER_URL = "https://decrypt-caretaker-production.up.railway.app"
 POLL_INTERVAL = 30  # seconds
-LAST_SEEN_FILE = Path(__file__).parent / ".last-alert-ts"
+LAST_SEEN_FILE = Path(__file__).parent / ".last-alert-ts"  # Legacy checkpoint, migrated on first read
+LAST_SEEN_CHECKPOINT = "poller.last_alert_ts"
+
+# Checkpoint lives in the job journal store (shared with the webhook server)
+journal = get_journal()
 
 def get_last_seen():
     """Get timestamp of last processed alert."""
-    try:
-        return LAST_SEEN_FILE.read_text().strip()
-    except:
-        return None
+    last_seen = journal.get_checkpoint(LAST_SEEN_CHECKPOINT)
+    if last_seen is None and LAST_SEEN_FILE.exists():
+        last_seen = LAST_SEEN_FILE.read_text().strip() or None
+        if last_seen:
+            set_last_seen(last_seen)
+    return last_seen
 
 def set_last_seen(ts):
     """Save timestamp of last processed alert."""
-    LAST_SEEN_FILE.write_text(ts)
+    journal.set_checkpoint(LAST_SEEN_CHECKPOINT, ts)
 
 async def poll_for_alerts():
     """Poll caretaker API for new ICT alerts."""
@@ -1,2 +1,4 @@
 # Screenshot package
-from .capture import get_screenshot, TradingViewScreenshot, close_screenshotter
+from .capture import get_screenshot, get_composite, TradingViewScreenshot, close_screenshotter, warm_screenshot_pool
+from .frame import ChartFrame
+from .pool import PagePool
@@ -1,11 +1,71 @@
+from typing import List, Optional, Sequence, Tuple
+from urllib.parse import urlencode, urlsplit, urlunsplit, parse_qsl
 import asyncio
+import time
 from playwright.async_api import async_playwright
-from pathlib import Path
 import structlog
 from config import settings
+from utils.metrics import metrics
+from .pool import PagePool
+from .readiness import wait_for_chart_ready
+from .session import SessionStore, session_is_valid, signed_in
+from .frame import ChartFrame, encode_frame_async, encode_composite_async, archive_frame
+from .scheduler import CaptureScheduler
 
 logger = structlog.get_logger()
 
+DEFAULT_LAYOUT = "default"
+
+# Hide header, toolbars, watchlist for a clean chart
+HIDE_UI_SCRIPT = '''
+    document.querySelectorAll(
+        '.header-chart-panel, .bottom-widgetbar-content, .tv-side-toolbar'
+    ).forEach(el => el.style.display = 'none');
+'''
+
+
+def chart_layout(symbol: Optional[str] = None, tf: Optional[str] = None) -> str:
+    """Pool key for a symbol/timeframe chart ("MNQ1!|5"); DEFAULT_LAYOUT is TV_CHART_URL as-is."""
+    if not symbol:
+        return DEFAULT_LAYOUT
+    return f"{symbol}|{tf or ''}"
+
+
+def parse_layout(layout: str) -> Tuple[Optional[str], Optional[str]]:
+    """Inverse of chart_layout: "MNQ1!|5" → ("MNQ1!", "5")."""
+    if layout == DEFAULT_LAYOUT:
+        return None, None
+    symbol, tf = layout.split("|", 1)
+    return symbol, tf or None
+
+
+def configured_layouts() -> List[str]:
+    """SCREENSHOT_LAYOUTS ("MNQ1!/5,ES1!/15") as pool keys."""
+    layouts = []
+    for item in filter(None, (x.strip() for x in settings.SCREENSHOT_LAYOUTS.split(","))):
+        symbol, _, tf = item.partition("/")
+        layouts.append(chart_layout(symbol, tf))
+    return layouts
+
+
+def pixel_budget(provider: Optional[str] = None) -> int:
+    """Max pixels per chart image for the AI provider (<PROVIDER>_PIXEL_BUDGET, 0 = no limit)."""
+    provider = (provider or settings.AI_PROVIDER).upper()
+    return getattr(settings, f"{provider}_PIXEL_BUDGET", 0)
+
+
+def layout_url(layout: str) -> str:
+    """TV_CHART_URL with the layout's symbol/interval applied as query parameters."""
+    if layout == DEFAULT_LAYOUT:
+        return settings.TV_CHART_URL
+    symbol, tf = parse_layout(layout)
+    parts = urlsplit(settings.TV_CHART_URL)
+    query = dict(parse_qsl(parts.query))
+    query["symbol"] = symbol
+    if tf:
+        query["interval"] = tf
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
 
 class TradingViewScreenshot:
     def __init__(self):
@@ -13,27 +73,55 @@ class TradingViewScreenshot:
         self.context = None
         self.page = None
         self._authenticated = False
+        self._unverified_session = False  # restored from disk, not yet confirmed by TradingView
         self._playwright = None
+        self._launched_at: Optional[float] = None
+        self._archiving: set = set()
+        self._login_lock = asyncio.Lock()
+        self.scheduler = CaptureScheduler(window=settings.SCREENSHOT_COALESCE_WINDOW)
+        self.sessions = SessionStore(settings.TV_SESSION_PATH, secret=settings.TV_PASSWORD)
+        self.pool = PagePool(
+            self._open_chart,
+            size=settings.SCREENSHOT_POOL_SIZE,
+            max_captures=settings.SCREENSHOT_POOL_MAX_CAPTURES,
+            health_interval=settings.SCREENSHOT_POOL_HEALTH_INTERVAL,
+        )
 
     async def initialize(self):
-        """Launch browser and authenticate to TradingView."""
+        """Launch browser, reusing the saved TradingView session when it is still valid."""
+        self._launched_at = time.perf_counter()
         self._playwright = await async_playwright().start()
         self.browser = await self._playwright.chromium.launch(
             headless=True,
             args=['--no-sandbox', '--disable-dev-shm-usage']
         )
+        storage_state = await self.sessions.load()
         self.context = await self.browser.new_context(
             viewport={'width': 1920, 'height': 1080},
-            device_scale_factor=2  # Retina-quality screenshots
+            device_scale_factor=2,  # Retina-quality screenshots
+            storage_state=storage_state
         )
         self.page = await self.context.new_page()
-        logger.info("browser_initialized")
+
+        if storage_state and await session_is_valid(self.context):
+            self._authenticated = True
+            self._unverified_session = True
+            metrics.incr("screenshot.session_restored")
+        logger.info("browser_initialized", session_restored=self._authenticated)
+
+    async def start_pool(self, layouts=()):
+        """Log in once (cookies are shared by every page in the context), then pre-load layouts."""
+        await self.authenticate()
+        await self.pool.start(layouts)
 
     async def authenticate(self):
         """Log into TradingView. Call once, session persists."""
-        if self._authenticated:
-            return
+        # The warm-up and a page opened for an early alert may both get here first
+        async with self._login_lock:
+            if not self._authenticated:
+                await self._login()
 
+    async def _login(self):
         await self.page.goto('https://www.tradingview.com/accounts/signin/')
         await self.page.wait_for_timeout(2000)
 
@@ -55,51 +143,160 @@ class TradingViewScreenshot:
         # Wait for login to complete
         await self.page.wait_for_timeout(5000)
         self._authenticated = True
+        metrics.incr("screenshot.logins")
         logger.info("tradingview_authenticated")
 
-    async def capture(self, output_path: str = "chart.png") -> str:
-        """
-        Navigate to chart and capture screenshot.
-        Returns the file path of the saved screenshot.
-        """
+        # Save cookies/localStorage so the next start skips this form
+        await self.sessions.save(await self.context.storage_state())
+
+    async def _open_chart(self, layout: str):
+        """Open and fully render a chart page for the pool. Slow — paid once per page."""
         if not self._authenticated:
             await self.authenticate()
 
-        # Navigate to chart
-        await self.page.goto(settings.TV_CHART_URL)
+        verify = self._unverified_session
+        page = await self.context.new_page()
+        await self._load_chart(page, layout)
+
+        if verify:
+            # The cookie only looked valid locally; this is TradingView's answer
+            if not await signed_in(page):
+                await self._relogin()
+                await self._load_chart(page, layout)
+            self._unverified_session = False
+        return page
+
+    async def _load_chart(self, page, layout: str):
+        await page.goto(layout_url(layout))
 
-        # Wait for chart to fully render
-        # The indicator needs time to calculate and draw
-        await self.page.wait_for_timeout(8000)
+        # Wait until the chart and indicator overlay have finished drawing,
+        # bounded by the old fixed 8 s + 3 s + 0.5 s
+        await wait_for_chart_ready(
+            page,
+            timeout=settings.SCREENSHOT_READY_TIMEOUT,
+            interval=settings.SCREENSHOT_READY_POLL,
+            stable_polls=settings.SCREENSHOT_READY_STABLE_POLLS,
+        )
+
+    async def _relogin(self):
+        """The restored session was revoked server-side: forget it and sign in again."""
+        async with self._login_lock:
+            if not self._unverified_session:
+                return  # another page already did
+            self._unverified_session = False
+            metrics.incr("screenshot.session_revoked")
+            logger.warning("tv_session_revoked", msg="Saved session rejected, logging in again")
+            self.sessions.clear()
+            await self._login()
+
+    async def capture(
+        self,
+        symbol: Optional[str] = None,
+        tf: Optional[str] = None,
+        archive_path: Optional[str] = None
+    ) -> ChartFrame:
+        """
+        Capture the live chart for symbol/timeframe from the warm page pool.
+        Returns the encoded frame in memory; with `archive_path` a copy is also
+        written to disk in the background. Concurrent requests for the same chart
+        within SCREENSHOT_COALESCE_WINDOW share one capture.
+        """
+        layout = chart_layout(symbol, tf)
+
+        async def capture() -> ChartFrame:
+            start = time.perf_counter()
+            raw = await self._grab(layout)
+            frame = await encode_frame_async(raw, **self._encode_options())
+            self._captured(start)
+            logger.info("screenshot_captured", layout=layout, format=frame.format, bytes=len(frame))
+            return frame
+
+        frame = await self.scheduler.run(layout, capture)
+        if archive_path:
+            self._archive(frame, archive_path)
+        return frame
+
+    async def capture_composite(
+        self,
+        symbol: str,
+        tfs: Sequence[str],
+        archive_path: Optional[str] = None
+    ) -> ChartFrame:
+        """
+        Capture several timeframes of `symbol` (each from its own pooled page,
+        concurrently) and tile them into one image within the provider's pixel budget.
+        """
+        async def capture() -> ChartFrame:
+            start = time.perf_counter()
+            raws = await asyncio.gather(*[self._grab(chart_layout(symbol, tf)) for tf in tfs])
+            frame = await encode_composite_async(
+                raws,
+                labels=[f"{symbol} {tf}" for tf in tfs],
+                columns=settings.SCREENSHOT_COMPOSITE_COLUMNS,
+                **self._encode_options(),
+            )
+            self._captured(start)
+            logger.info("screenshot_composite_captured", symbol=symbol, tfs=list(tfs), bytes=len(frame))
+            return frame
 
-        # Wait for the chart canvas to be present
-        await self.page.wait_for_selector('canvas', timeout=15000)
+        frame = await self.scheduler.run(f"composite:{symbol}|{','.join(tfs)}", capture)
+        if archive_path:
+            self._archive(frame, archive_path)
+        return frame
 
-        # Additional wait for indicator overlays to render
-        await self.page.wait_for_timeout(3000)
+    async def _grab(self, layout: str) -> bytes:
+        """Raw PNG of a pooled chart page, clipped to the price pane when it can be found."""
+        async with self.pool.page(layout) as page:
+            # Hide TradingView UI elements for clean screenshot, then let the
+            # chart redraw into the freed space (the old fixed 500 ms is the bound)
+            await page.evaluate(HIDE_UI_SCRIPT)
+            await wait_for_chart_ready(
+                page, timeout=0.5, interval=0.05, stable_polls=1,
+                metric="screenshot.cleanup_settle_ms",
+            )
 
-        # Hide TradingView UI elements for clean screenshot
-        await self.page.evaluate('''
-            // Hide header, toolbars, watchlist for clean chart
-            document.querySelectorAll(
-                '.header-chart-panel, .bottom-widgetbar-content, .tv-side-toolbar'
-            ).forEach(el => el.style.display = 'none');
-        ''')
+            # Capture screenshot (CSS pixels: the retina buffer is downsampled by the browser)
+            clip = await self._clip(page)
+            return await page.screenshot(full_page=False, type="png", scale="css", clip=clip)
 
-        await self.page.wait_for_timeout(500)
+    async def _clip(self, page) -> Optional[dict]:
+        """Bounding box of SCREENSHOT_CLIP_SELECTOR; None (whole viewport) if it isn't there."""
+        if not settings.SCREENSHOT_CLIP_SELECTOR:
+            return None
+        try:
+            box = await page.locator(settings.SCREENSHOT_CLIP_SELECTOR).first.bounding_box(timeout=500)
+        except Exception:
+            box = None
+        if not box or box["width"] < 1 or box["height"] < 1:
+            metrics.incr("screenshot.clip_missed")
+            return None
+        return box
 
-        # Ensure output directory exists
-        path = Path(output_path)
-        path.parent.mkdir(parents=True, exist_ok=True)
+    def _encode_options(self) -> dict:
+        return dict(
+            format=settings.SCREENSHOT_FORMAT,
+            max_width=settings.SCREENSHOT_MAX_WIDTH,
+            quality=settings.SCREENSHOT_QUALITY,
+            target_bytes=settings.SCREENSHOT_TARGET_BYTES,
+            max_pixels=pixel_budget(),
+        )
 
-        # Capture screenshot
-        await self.page.screenshot(path=str(path), full_page=False)
+    def _captured(self, start: float):
+        metrics.observe("screenshot.capture_ms", (time.perf_counter() - start) * 1000)
+        if self._launched_at is not None:
+            # First capture since launch: how long a cold start really took
+            metrics.observe("screenshot.cold_start_ms", (time.perf_counter() - self._launched_at) * 1000)
+            self._launched_at = None
 
-        logger.info("screenshot_captured", path=str(path))
-        return str(path)
+    def _archive(self, frame: ChartFrame, path: str):
+        task = asyncio.create_task(archive_frame(frame, path))
+        self._archiving.add(task)
+        task.add_done_callback(self._archiving.discard)
 
     async def close(self):
         """Clean up browser resources."""
+        await self.pool.close()
+        await asyncio.gather(*self._archiving, return_exceptions=True)
         if self.browser:
             await self.browser.close()
         if self._playwright:
@@ -109,15 +306,62 @@ class TradingViewScreenshot:
 
 # Singleton instance
 _screenshotter = None
+_launching: Optional[asyncio.Task] = None
+
+
+async def get_screenshotter() -> TradingViewScreenshot:
+    """Get the shared screenshotter. Launches the browser on first call (once, however many callers race)."""
+    global _screenshotter, _launching
+    if _screenshotter is not None:
+        return _screenshotter
+    if _launching is None:
+        _launching = asyncio.create_task(_launch())
+    launching = _launching
+    try:
+        _screenshotter = await asyncio.shield(launching)
+    finally:
+        if _launching is launching and launching.done():
+            _launching = None  # a failed launch is retried by the next caller
+    return _screenshotter
+
+
+async def _launch() -> TradingViewScreenshot:
+    screenshotter = TradingViewScreenshot()
+    metrics.incr("screenshot.browser_launches")
+    await screenshotter.initialize()
+    return screenshotter
 
 
-async def get_screenshot(output_path: str = "chart.png") -> str:
+async def get_screenshot(
+    symbol: Optional[str] = None,
+    tf: Optional[str] = None,
+    archive_path: Optional[str] = None
+) -> ChartFrame:
     """Get a chart screenshot. Initializes browser on first call."""
-    global _screenshotter
-    if _screenshotter is None:
-        _screenshotter = TradingViewScreenshot()
-        await _screenshotter.initialize()
-    return await _screenshotter.capture(output_path)
+    screenshotter = await get_screenshotter()
+    return await screenshotter.capture(symbol, tf, archive_path)
+
+
+async def get_composite(
+    symbol: str,
+    tfs: Sequence[str],
+    archive_path: Optional[str] = None
+) -> ChartFrame:
+    """Get one tiled image of several timeframes. Initializes browser on first call."""
+    screenshotter = await get_screenshotter()
+    return await screenshotter.capture_composite(symbol, tfs, archive_path)
+
+
+async def warm_screenshot_pool(layouts: Optional[List[str]] = None):
+    """Launch the browser and pre-load the SCREENSHOT_LAYOUTS charts (e.g. "MNQ1!/5,ES1!/15")."""
+    if layouts is None:
+        layouts = configured_layouts()
+    try:
+        screenshotter = await get_screenshotter()
+        await screenshotter.start_pool(layouts)
+        logger.info("screenshot_pool_warm", layouts=len(layouts))
+    except Exception as e:
+        logger.error("screenshot_pool_warmup_failed", error=str(e))
 
 
 async def close_screenshotter():
@@ -0,0 +1,87 @@
+from typing import Dict, Optional
+from dataclasses import dataclass, field
+import time
+from config import settings
+from .frame import ChartFrame, hamming
+
+
+@dataclass
+class ChartRecord:
+    """The last chart sent for a layout, and where it was already uploaded."""
+    dhash: int
+    bar: str = ""                   # the alert's bar (see `bar_key`)
+    discord_url: Optional[str] = None
+    telegram_file_id: Optional[str] = None
+    created_at: float = field(default_factory=time.monotonic)
+
+
+class ChartHistory:
+    """
+    Perceptual-hash dedup of consecutive charts, per layout ("MNQ1!|5").
+    A frame of the same bar within `threshold` bits of the last recorded one is a
+    near-duplicate: its upload URL / file id is reused instead of sending the bytes
+    again. The hash is far too coarse to see a new candle on a full chart, so a
+    frame for another bar is never a duplicate. Records older than `max_age`
+    seconds are not reused (CDN links expire).
+    """
+
+    def __init__(self, threshold: int = 4, max_age: float = 900.0):
+        self.threshold = threshold
+        self.max_age = max_age
+        self.records: Dict[str, ChartRecord] = {}
+
+    def match(self, layout: str, frame: Optional[ChartFrame], bar: str = "") -> Optional[ChartRecord]:
+        """The record `frame` (a chart of `bar`) duplicates, or None."""
+        record = self.records.get(layout)
+        if frame is None or not frame.dhash or record is None or record.bar != bar:
+            return None
+        if time.monotonic() - record.created_at > self.max_age:
+            return None
+        if hamming(record.dhash, frame.dhash) > self.threshold:
+            return None
+        return record
+
+    def remember(self, layout: str, frame: ChartFrame, bar: str = "", **uploads) -> ChartRecord:
+        """
+        Note where `frame` went (discord_url=..., telegram_file_id=...).
+        A near-duplicate updates the existing record, keeping its hash as the anchor,
+        so slow drift still ends in a fresh upload.
+        """
+        record = self.match(layout, frame, bar)
+        if record is None:
+            record = self.records[layout] = ChartRecord(frame.dhash, bar)
+        for name, value in uploads.items():
+            setattr(record, name, value)
+        return record
+
+
+# Singleton instance
+_history: Optional[ChartHistory] = None
+
+
+def get_chart_history() -> ChartHistory:
+    """Get the shared chart history (SCREENSHOT_DEDUP_THRESHOLD / _MAX_AGE)."""
+    global _history
+    if _history is None:
+        _history = ChartHistory(
+            threshold=settings.SCREENSHOT_DEDUP_THRESHOLD,
+            max_age=settings.SCREENSHOT_DEDUP_MAX_AGE,
+        )
+    return _history
+
+
+def bar_key(ts: int, px: float) -> str:
+    """What a chart shows for an alert: its bar time and the price at that moment."""
+    return f"{ts}@{px}"
+
+
+def duplicate_of(layout: str, frame: Optional[ChartFrame], bar: str = "") -> Optional[ChartRecord]:
+    """The recorded chart `frame` near-duplicates (None when SCREENSHOT_DEDUP is off)."""
+    if not settings.SCREENSHOT_DEDUP:
+        return None
+    return get_chart_history().match(layout, frame, bar)
+
+
+def remember_chart(layout: str, frame: Optional[ChartFrame], bar: str = "", **uploads):
+    if settings.SCREENSHOT_DEDUP and frame is not None and frame.dhash:
+        get_chart_history().remember(layout, frame, bar, **uploads)
@@ -0,0 +1,167 @@
+from typing import Optional, Sequence
+from dataclasses import dataclass, field
+from io import BytesIO
+from pathlib import Path
+import asyncio
+import math
+import time
+import structlog
+from PIL import Image, ImageDraw
+from utils.metrics import metrics
+
+logger = structlog.get_logger()
+
+CONTENT_TYPES = {"png": "image/png", "jpeg": "image/jpeg", "webp": "image/webp"}
+MIN_QUALITY = 40
+COMPOSITE_BACKGROUND = (19, 23, 34)  # TradingView dark theme
+
+
+@dataclass(frozen=True)
+class ChartFrame:
+    """
+    An encoded chart image held in memory. `data` is immutable bytes, so the same
+    frame is handed to every delivery channel without copying or touching disk.
+    """
+    data: bytes
+    format: str                     # "png", "jpeg" or "webp"
+    width: int
+    height: int
+    captured_at: float = field(default_factory=time.time)
+    dhash: int = 0                  # 64-bit perceptual hash (see `dhash()`), 0 = unknown
+
+    @property
+    def content_type(self) -> str:
+        return CONTENT_TYPES[self.format]
+
+    @property
+    def filename(self) -> str:
+        return f"chart.{'jpg' if self.format == 'jpeg' else self.format}"
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+
+def encode_frame(
+    raw: bytes,
+    format: str = "jpeg",
+    max_width: int = 1600,
+    quality: int = 80,
+    target_bytes: int = 0,
+    max_pixels: int = 0,
+) -> ChartFrame:
+    """
+    Downscale a raw screenshot to `max_width` (and `max_pixels`, 0 = no limit) and
+    encode it as WebP/JPEG (or PNG). With `target_bytes`, quality steps down until
+    the image fits (never below MIN_QUALITY). CPU-bound: call through asyncio.to_thread.
+    """
+    with Image.open(BytesIO(raw)) as image:
+        image.load()
+        return _encode(image, format, max_width, quality, target_bytes, max_pixels)
+
+
+def encode_composite(
+    raws: Sequence[bytes],
+    labels: Sequence[str] = (),
+    columns: int = 2,
+    format: str = "jpeg",
+    max_width: int = 1600,
+    quality: int = 80,
+    target_bytes: int = 0,
+    max_pixels: int = 0,
+) -> ChartFrame:
+    """
+    Tile several screenshots (e.g. the 1m/5m/15m charts) into one labelled image,
+    so a single vision call sees every timeframe within one pixel budget.
+    """
+    tiles = [Image.open(BytesIO(raw)) for raw in raws]
+    try:
+        width = min(tile.width for tile in tiles)
+        height = min(tile.height for tile in tiles)
+        columns = max(1, min(columns, len(tiles)))
+        rows = -(-len(tiles) // columns)
+        sheet = Image.new("RGB", (width * columns, height * rows), COMPOSITE_BACKGROUND)
+        draw = ImageDraw.Draw(sheet)
+        for n, tile in enumerate(tiles):
+            x, y = (n % columns) * width, (n // columns) * height
+            sheet.paste(tile.convert("RGB").resize((width, height), Image.LANCZOS), (x, y))
+            if n < len(labels):
+                draw.rectangle((x, y, x + 8 * len(labels[n]) + 12, y + 20), fill=COMPOSITE_BACKGROUND)
+                draw.text((x + 6, y + 4), labels[n], fill=(255, 255, 255))
+    finally:
+        for tile in tiles:
+            tile.close()
+    return _encode(sheet, format, max_width, quality, target_bytes, max_pixels)
+
+
+def _encode(image, format, max_width, quality, target_bytes, max_pixels) -> ChartFrame:
+    scale = 1.0
+    if max_width and image.width > max_width:
+        scale = max_width / image.width
+    if max_pixels and image.width * image.height * scale * scale > max_pixels:
+        scale = math.sqrt(max_pixels / (image.width * image.height))
+    if scale < 1.0:
+        size = (max(1, int(image.width * scale)), max(1, int(image.height * scale)))
+        image = image.resize(size, Image.LANCZOS)
+    if format != "png" and image.mode != "RGB":
+        image = image.convert("RGB")
+
+    while True:
+        out = BytesIO()
+        if format == "png":
+            image.save(out, "PNG", optimize=True)
+        elif format == "webp":
+            image.save(out, "WEBP", quality=quality, method=4)
+        else:
+            image.save(out, "JPEG", quality=quality, optimize=True)
+        data = out.getvalue()
+        if format == "png" or not target_bytes or len(data) <= target_bytes or quality <= MIN_QUALITY:
+            return ChartFrame(data, format, image.width, image.height, dhash=dhash(image))
+        quality = max(MIN_QUALITY, quality - 10)
+
+
+def dhash(image: Image.Image, size: int = 8, margin: int = 2) -> int:
+    """
+    Difference hash: one bit per horizontally adjacent pixel pair of a tiny grayscale
+    copy, set when the left one is brighter by more than `margin` (so flat chart
+    background stays 0 instead of flickering with compression noise). Re-encoding,
+    scaling and small redraws flip few bits; a new swing or a moved level flips many.
+    """
+    small = image.convert("L").resize((size + 1, size), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            value = (value << 1) | (left - pixels[row * (size + 1) + col + 1] > margin)
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    """Number of differing bits between two hashes."""
+    return bin(a ^ b).count("1")
+
+
+async def encode_frame_async(raw: bytes, **options) -> ChartFrame:
+    with metrics.timer("screenshot.encode_ms"):
+        frame = await asyncio.to_thread(encode_frame, raw, **options)
+    metrics.observe("screenshot.frame_bytes", len(frame))
+    return frame
+
+
+async def encode_composite_async(raws: Sequence[bytes], **options) -> ChartFrame:
+    with metrics.timer("screenshot.encode_ms"):
+        frame = await asyncio.to_thread(encode_composite, raws, **options)
+    metrics.observe("screenshot.frame_bytes", len(frame))
+    return frame
+
+
+async def archive_frame(frame: ChartFrame, path: str) -> Optional[str]:
+    """Write a frame to disk off the event loop. Archival only — delivery never waits on it."""
+    target = Path(path).with_suffix(Path(frame.filename).suffix)
+    try:
+        target.parent.mkdir(parents=True, exist_ok=True)
+        await asyncio.to_thread(target.write_bytes, frame.data)
+    except OSError as e:
+        logger.error("screenshot_archive_failed", path=str(target), error=str(e))
+        return None
+    return str(target)
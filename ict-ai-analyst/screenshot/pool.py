@@ -0,0 +1,185 @@
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, Optional
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+import asyncio
+import time
+import structlog
+from utils.metrics import metrics
+
+logger = structlog.get_logger()
+
+# Cheap liveness probe: the tab still answers and the chart canvas is on the page
+HEALTH_PROBE = "() => document.querySelector('canvas') !== null"
+
+
+@dataclass
+class PooledPage:
+    layout: str
+    page: Any
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    captures: int = 0
+    recycling: bool = False
+    opened_at: float = field(default_factory=time.monotonic)
+
+
+class PagePool:
+    """
+    Keeps up to `size` chart pages loaded and live, one per layout (symbol/timeframe).
+    `open_page(layout)` must return a page that is navigated, rendered and ready to
+    screenshot — it pays the slow load once, captures then reuse the page.
+
+    Pages are recycled after `max_captures` uses to cap Chromium memory, replaced when
+    a health check fails, and the least recently used layout is closed when a new one
+    needs a slot.
+    """
+
+    def __init__(
+        self,
+        open_page: Callable[[str], Awaitable[Any]],
+        size: int = 4,
+        max_captures: int = 50,
+        health_interval: float = 60.0,
+        health_timeout: float = 5.0,
+    ):
+        self.open_page = open_page
+        self.size = size
+        self.max_captures = max_captures
+        self.health_interval = health_interval
+        self.health_timeout = health_timeout
+        self._pages: "OrderedDict[str, PooledPage]" = OrderedDict()
+        self._opening: Dict[str, asyncio.Lock] = {}
+        self._tasks: set = set()
+        self._health_task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._pages)
+
+    async def start(self, layouts: Iterable[str] = ()):
+        """Open pages for `layouts` up front and start the periodic health check."""
+        await asyncio.gather(*[self._get(layout) for layout in layouts], return_exceptions=True)
+        if self.health_interval > 0 and self._health_task is None:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    @asynccontextmanager
+    async def page(self, layout: str) -> AsyncIterator[Any]:
+        """Borrow the live page for `layout`. One capture per page at a time."""
+        entry = await self._get(layout)
+        waiting = time.perf_counter()
+        async with entry.lock:
+            # Time spent queued behind another capture of the same page
+            metrics.observe("screenshot.page_wait_ms", (time.perf_counter() - waiting) * 1000)
+            if entry.page.is_closed():
+                entry = await self._replace(entry, reason="closed")
+            yield entry.page
+            entry.captures += 1
+
+        if entry.captures >= self.max_captures and not entry.recycling:
+            entry.recycling = True
+            self._spawn(self._recycle(entry))
+
+    async def health_check(self) -> int:
+        """Probe every idle page; replace the ones that don't answer. Returns how many were replaced."""
+        replaced = 0
+        for entry in list(self._pages.values()):
+            if entry.lock.locked():
+                continue  # mid-capture, so evidently alive
+            try:
+                healthy = not entry.page.is_closed() and await asyncio.wait_for(
+                    entry.page.evaluate(HEALTH_PROBE), timeout=self.health_timeout
+                )
+            except Exception as e:
+                logger.warning("page_health_error", layout=entry.layout, error=str(e))
+                healthy = False
+
+            if not healthy:
+                metrics.incr("screenshot.pool.unhealthy")
+                async with entry.lock:
+                    await self._replace(entry, reason="unhealthy")
+                replaced += 1
+        return replaced
+
+    async def close(self):
+        if self._health_task:
+            self._health_task.cancel()
+            self._health_task = None
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        for entry in list(self._pages.values()):
+            await self._close_page(entry.layout, entry.page)
+        self._pages.clear()
+        metrics.gauge("screenshot.pool.size", 0)
+
+    async def _get(self, layout: str) -> PooledPage:
+        entry = self._pages.get(layout)
+        if entry is None:
+            # One opener per layout; concurrent callers wait for the same page
+            async with self._opening.setdefault(layout, asyncio.Lock()):
+                entry = self._pages.get(layout)
+                if entry is None:
+                    await self._make_room()
+                    entry = PooledPage(layout, await self._open(layout))
+                    self._pages[layout] = entry
+                    metrics.gauge("screenshot.pool.size", len(self._pages))
+        self._pages.move_to_end(layout)
+        return entry
+
+    async def _open(self, layout: str) -> Any:
+        with metrics.timer("screenshot.pool.open_ms"):
+            page = await self.open_page(layout)
+        logger.info("pool_page_opened", layout=layout)
+        return page
+
+    async def _make_room(self):
+        while len(self._pages) >= self.size:
+            idle = [e for e in self._pages.values() if not e.lock.locked()]
+            if not idle:
+                return  # every page is mid-capture; run one over size for a moment
+            victim = idle[0]  # least recently used
+            del self._pages[victim.layout]
+            metrics.incr("screenshot.pool.evicted")
+            await self._close_page(victim.layout, victim.page)
+
+    async def _replace(self, entry: PooledPage, reason: str) -> PooledPage:
+        """Swap in a fresh page for `entry`'s layout. Caller holds entry.lock."""
+        await self._close_page(entry.layout, entry.page)
+        entry.page = await self._open(entry.layout)
+        entry.captures = 0
+        entry.opened_at = time.monotonic()
+        logger.info("pool_page_replaced", layout=entry.layout, reason=reason)
+        return entry
+
+    async def _recycle(self, entry: PooledPage):
+        """Load the replacement before retiring the old page, so captures stay warm."""
+        try:
+            fresh = await self._open(entry.layout)
+            if self._pages.get(entry.layout) is not entry:
+                await self._close_page(entry.layout, fresh)  # evicted meanwhile
+                return
+            async with entry.lock:
+                old = entry.page
+                entry.page, entry.captures, entry.opened_at = fresh, 0, time.monotonic()
+        finally:
+            entry.recycling = False
+        metrics.incr("screenshot.pool.recycled")
+        await self._close_page(entry.layout, old)
+
+    async def _close_page(self, layout: str, page: Any):
+        try:
+            await page.close()
+        except Exception as e:
+            logger.warning("pool_page_close_error", layout=layout, error=str(e))
+
+    async def _health_loop(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            try:
+                await self.health_check()
+            except Exception as e:
+                logger.error("pool_health_check_error", error=str(e))
+
+    def _spawn(self, coro: Awaitable):
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
@@ -0,0 +1,149 @@
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+from dataclasses import dataclass
+from datetime import datetime, time as dtime, timedelta
+from zoneinfo import ZoneInfo
+import asyncio
+import time
+import structlog
+from config import settings
+from utils.metrics import metrics
+from .capture import configured_layouts, parse_layout
+from .frame import ChartFrame
+from .workers import request_screenshot
+
+logger = structlog.get_logger()
+
+MARKET_TZ = ZoneInfo("America/New_York")
+
+# Time-scheduled alert triggers (NY time, weekdays). The indicator fires these on
+# the clock, so the chart can be captured a few seconds before they arrive.
+SCHEDULED_TRIGGERS = {
+    "KZ_OPEN_LONDON": dtime(2, 0),
+    "PRE_MARKET_0915": dtime(9, 15),
+    "PRE_OPEN_0929": dtime(9, 29),
+    "KZ_OPEN_NY_AM": dtime(9, 30),
+    "KZ_OPEN_NY_PM": dtime(13, 30),
+}
+
+
+def next_trigger(now: datetime) -> Tuple[str, datetime]:
+    """The next scheduled trigger strictly after `now` (an aware datetime)."""
+    local = now.astimezone(MARKET_TZ)
+    for days in range(8):
+        day = local.date() + timedelta(days=days)
+        if day.weekday() >= 5:
+            continue
+        for trigger, at in sorted(SCHEDULED_TRIGGERS.items(), key=lambda item: item[1]):
+            fires = datetime.combine(day, at, tzinfo=MARKET_TZ)
+            if fires > local:
+                return trigger, fires
+    raise RuntimeError("no scheduled trigger within a week")
+
+
+@dataclass
+class Frame:
+    image: ChartFrame
+    captured_at: float      # time.monotonic()
+    capture_ms: float       # what the capture cost when it was taken ahead of time
+    trigger: str
+
+
+class PreCapture:
+    """
+    Speculatively captures each layout `lead` seconds before every scheduled trigger.
+    `take(layout)` hands out the frame if it is younger than `max_age`, so the
+    pipeline skips the capture; hit rate and latency saved are recorded.
+    """
+
+    def __init__(
+        self,
+        capture: Callable[[str], Awaitable[ChartFrame]],
+        layouts: Iterable[str],
+        lead: float = 5.0,
+        max_age: float = 30.0,
+        clock: Callable[[], datetime] = lambda: datetime.now(MARKET_TZ),
+    ):
+        self.capture = capture      # layout → ChartFrame
+        self.layouts: List[str] = list(layouts)
+        self.lead = lead
+        self.max_age = max_age
+        self.clock = clock
+        self.frames: Dict[str, Frame] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None and self.layouts:
+            self._task = asyncio.create_task(self._run())
+            logger.info("precapture_started", layouts=len(self.layouts), lead=self.lead)
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def capture_all(self, trigger: str):
+        """Take a fresh frame of every layout now (concurrently; one page per layout)."""
+        await asyncio.gather(*[self._capture_one(layout, trigger) for layout in self.layouts])
+
+    def take(self, layout: str) -> Optional[Frame]:
+        """A fresh pre-captured frame for `layout`, or None (counted as a miss)."""
+        if layout not in self.layouts:
+            return None  # never pre-captured; not part of the hit rate
+        frame = self.frames.get(layout)
+        if frame is None or time.monotonic() - frame.captured_at > self.max_age:
+            metrics.incr("screenshot.precapture.misses")
+            return None
+        metrics.incr("screenshot.precapture.hits")
+        metrics.observe("screenshot.precapture.saved_ms", frame.capture_ms)
+        return frame
+
+    async def _run(self):
+        while True:
+            trigger, fires = next_trigger(self.clock())
+            delay = (fires - self.clock()).total_seconds() - self.lead
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await self.capture_all(trigger)
+            # Don't re-capture for the same trigger if we woke up early
+            await asyncio.sleep(max(0.0, (fires - self.clock()).total_seconds()) + 1)
+
+    async def _capture_one(self, layout: str, trigger: str):
+        start = time.perf_counter()
+        try:
+            image = await self.capture(layout)
+        except Exception as e:
+            metrics.incr("screenshot.precapture.failed")
+            logger.error("precapture_failed", layout=layout, trigger=trigger, error=str(e))
+            return
+        capture_ms = (time.perf_counter() - start) * 1000
+        self.frames[layout] = Frame(image, time.monotonic(), capture_ms, trigger)
+        logger.info("precaptured", layout=layout, trigger=trigger, ms=round(capture_ms))
+
+
+# Singleton instance
+_precapture: Optional[PreCapture] = None
+
+
+def get_precapture() -> PreCapture:
+    """Get the shared pre-capture scheduler (captures SCREENSHOT_LAYOUTS)."""
+    global _precapture
+    if _precapture is None:
+        async def capture(layout: str) -> ChartFrame:
+            symbol, tf = parse_layout(layout)
+            return await request_screenshot(symbol, tf)
+
+        _precapture = PreCapture(
+            capture,
+            configured_layouts(),
+            lead=settings.SCREENSHOT_PRECAPTURE_LEAD,
+            max_age=settings.SCREENSHOT_PRECAPTURE_MAX_AGE,
+        )
+    return _precapture
+
+
+async def close_precapture():
+    global _precapture
+    if _precapture:
+        await _precapture.stop()
+        _precapture = None
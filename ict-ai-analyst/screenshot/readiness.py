@@ -0,0 +1,81 @@
+from typing import Any
+import asyncio
+import time
+import structlog
+from utils.metrics import metrics
+
+logger = structlog.get_logger()
+
+# Indicator legend rows: the price series plus at least one study means the overlay is drawn
+OVERLAY_SELECTOR = '[data-name="legend-source-item"]'
+
+# Downsample every chart canvas onto a small scratch canvas and sum the pixels.
+# Cheap enough to poll every ~100 ms; any redraw of the chart changes the sum.
+CANVAS_PROBE = """
+(overlaySelector) => {
+    const canvases = Array.from(document.querySelectorAll('canvas'))
+        .filter(c => c.width > 0 && c.height > 0);
+    const scratch = document.createElement('canvas');
+    scratch.width = 64; scratch.height = 36;
+    const ctx = scratch.getContext('2d', {willReadFrequently: true});
+    let sum = 0;
+    for (const canvas of canvases) {
+        ctx.clearRect(0, 0, 64, 36);
+        try { ctx.drawImage(canvas, 0, 0, 64, 36); } catch (e) { continue; }
+        const data = ctx.getImageData(0, 0, 64, 36).data;
+        for (let i = 0; i < data.length; i += 4) {
+            sum = (sum * 31 + data[i] + data[i + 1] * 7 + data[i + 2] * 13) % 2147483647;
+        }
+    }
+    return {
+        canvases: canvases.length,
+        checksum: sum,
+        overlay: document.querySelectorAll(overlaySelector).length >= 2,
+    };
+}
+"""
+
+
+async def wait_for_chart_ready(
+    page: Any,
+    timeout: float = 11.5,
+    interval: float = 0.1,
+    stable_polls: int = 3,
+    overlay_selector: str = OVERLAY_SELECTOR,
+    metric: str = "screenshot.time_to_ready_ms",
+) -> bool:
+    """
+    Resolve once the chart canvases have stopped changing (same checksum for
+    `stable_polls` polls in a row) and the indicator overlay is present.
+    `timeout` is the upper bound — the old fixed sleeps. Returns False if it was hit.
+    Time to ready is recorded under `metric`.
+    """
+    start = time.perf_counter()
+    deadline = start + timeout
+    last = None
+    stable = 0
+
+    while time.perf_counter() < deadline:
+        try:
+            probe = await page.evaluate(CANVAS_PROBE, overlay_selector)
+        except Exception as e:
+            # Navigation still in progress — the execution context gets replaced
+            logger.debug("chart_probe_error", error=str(e))
+            probe = None
+
+        if probe and probe["canvases"] and probe["overlay"]:
+            stable = stable + 1 if probe["checksum"] == last else 0
+            last = probe["checksum"]
+            if stable >= stable_polls:
+                elapsed = (time.perf_counter() - start) * 1000
+                metrics.observe(metric, elapsed)
+                return True
+        else:
+            stable, last = 0, None
+
+        await asyncio.sleep(interval)
+
+    metrics.observe(metric, timeout * 1000)
+    metrics.incr(metric.removesuffix("_ms") + "_timeouts")
+    logger.warning("chart_ready_timeout", timeout=timeout)
+    return False
@@ -0,0 +1,56 @@
+from typing import Awaitable, Callable, Dict, Tuple
+import asyncio
+import time
+import structlog
+from utils.metrics import metrics
+from .frame import ChartFrame
+
+logger = structlog.get_logger()
+
+
+class CaptureScheduler:
+    """
+    Merges capture requests for the same chart. A request whose chart had a capture
+    start less than `window` seconds ago — still running or just finished — gets
+    that capture's frame instead of queueing for the page behind it.
+    """
+
+    def __init__(self, window: float = 1.0):
+        self.window = window
+        self._flights: Dict[str, Tuple[float, asyncio.Future]] = {}  # key → (started, frame)
+
+    async def run(self, key: str, capture: Callable[[], Awaitable[ChartFrame]]) -> ChartFrame:
+        requested = time.monotonic()
+        flight = self._flights.get(key)
+        if flight is not None and requested - flight[0] <= self.window:
+            metrics.incr("screenshot.merged")
+            frame = await asyncio.shield(flight[1])
+            metrics.observe("screenshot.merged_wait_ms", (time.monotonic() - requested) * 1000)
+            logger.info("screenshot_merged", key=key)
+            return frame
+
+        self._prune(requested)
+        future = asyncio.get_running_loop().create_future()
+        self._flights[key] = (requested, future)
+        try:
+            frame = await capture()
+        except asyncio.CancelledError:
+            future.cancel()
+            self._forget(key, future)
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else was waiting
+            self._forget(key, future)
+            raise
+        future.set_result(frame)
+        return frame
+
+    def _forget(self, key: str, future: asyncio.Future):
+        # A failed capture is never shared with later requests
+        if self._flights.get(key, (0, None))[1] is future:
+            del self._flights[key]
+
+    def _prune(self, now: float):
+        for key in [k for k, (started, f) in self._flights.items() if f.done() and now - started > self.window]:
+            del self._flights[key]
@@ -0,0 +1,159 @@
+"""
+Screenshot worker process: owns Chromium and serves captures over local HTTP.
+
+    python -m screenshot.service --port 8701 --worker 0 --workers 2
+
+The webhook app talks to it through `screenshot.workers`; a hung or crashed
+browser only takes this process down, and the supervisor restarts it.
+"""
+from typing import Awaitable, Callable, List, Optional
+import argparse
+import asyncio
+import time
+import zlib
+from aiohttp import web
+import structlog
+from config import settings
+from utils.logger import setup_logging
+from utils.metrics import metrics
+from .frame import ChartFrame
+
+logger = structlog.get_logger()
+
+# ChartFrame metadata travels as response headers; the body is the encoded image
+FRAME_HEADERS = {
+    "format": "X-Chart-Format",
+    "width": "X-Chart-Width",
+    "height": "X-Chart-Height",
+    "captured_at": "X-Chart-Captured-At",
+    "dhash": "X-Chart-Dhash",
+}
+
+# Consecutive capture timeouts after which /health reports the browser as wedged
+WEDGED_AFTER_TIMEOUTS = 2
+
+
+def worker_for(symbol: Optional[str], workers: int) -> int:
+    """Worker index that owns `symbol`'s charts (every timeframe of a symbol on one worker)."""
+    return zlib.crc32((symbol or "").encode()) % max(1, workers)
+
+
+def frame_response(frame: ChartFrame) -> web.Response:
+    headers = {header: str(getattr(frame, name)) for name, header in FRAME_HEADERS.items()}
+    return web.Response(body=frame.data, content_type=frame.content_type, headers=headers)
+
+
+def frame_from_response(data: bytes, headers) -> ChartFrame:
+    return ChartFrame(
+        data,
+        headers[FRAME_HEADERS["format"]],
+        int(headers[FRAME_HEADERS["width"]]),
+        int(headers[FRAME_HEADERS["height"]]),
+        captured_at=float(headers[FRAME_HEADERS["captured_at"]]),
+        dhash=int(headers[FRAME_HEADERS["dhash"]]),
+    )
+
+
+def build_app(
+    capture: Callable[..., Awaitable[ChartFrame]],
+    composite: Callable[..., Awaitable[ChartFrame]],
+    concurrency: int = 2,
+    timeout: float = 20.0,
+    browser_ok: Callable[[], bool] = lambda: True,
+) -> web.Application:
+    """
+    The worker's RPC surface. At most `concurrency` captures run at once (the rest
+    wait for a slot); each is cut off after `timeout` seconds so a wedged page
+    can't hold a slot forever. A request's `budget` (seconds the caller will wait)
+    bounds slot wait plus capture, so the worker gives up — and counts the
+    timeout — before its caller does, and never starts a capture nobody awaits.
+    """
+    slots = asyncio.Semaphore(concurrency)
+    state = {"timeouts": 0}
+
+    async def run(request: web.Request, body: dict, call: Callable[[], Awaitable[ChartFrame]]) -> web.Response:
+        deadline = time.monotonic() + body.get("budget", timeout)
+        async with slots:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                metrics.incr("screenshot.worker.abandoned")
+                logger.warning("worker_capture_abandoned", path=request.path, budget=body.get("budget"))
+                return web.json_response({"error": "caller gave up while waiting for a slot"}, status=504)
+            try:
+                frame = await asyncio.wait_for(call(), min(timeout, remaining))
+            except asyncio.TimeoutError:
+                state["timeouts"] += 1
+                metrics.incr("screenshot.worker.capture_timeouts")
+                logger.error("worker_capture_timeout", path=request.path, timeout=min(timeout, remaining))
+                return web.json_response({"error": "capture timed out"}, status=504)
+            except Exception as e:
+                logger.error("worker_capture_failed", path=request.path, error=str(e))
+                return web.json_response({"error": str(e)}, status=500)
+        state["timeouts"] = 0
+        return frame_response(frame)
+
+    async def handle_capture(request: web.Request) -> web.Response:
+        body = await request.json()
+        return await run(request, body, lambda: capture(body.get("symbol"), body.get("tf"), body.get("archive_path")))
+
+    async def handle_composite(request: web.Request) -> web.Response:
+        body = await request.json()
+        return await run(request, body, lambda: composite(body["symbol"], body["tfs"], body.get("archive_path")))
+
+    async def handle_health(request: web.Request) -> web.Response:
+        wedged = state["timeouts"] >= WEDGED_AFTER_TIMEOUTS or not browser_ok()
+        return web.json_response({"ok": not wedged, "timeouts": state["timeouts"]}, status=503 if wedged else 200)
+
+    async def handle_metrics(request: web.Request) -> web.Response:
+        return web.json_response(metrics.snapshot())
+
+    app = web.Application()
+    app.router.add_post("/capture", handle_capture)
+    app.router.add_post("/composite", handle_composite)
+    app.router.add_get("/health", handle_health)
+    app.router.add_get("/metrics", handle_metrics)
+    return app
+
+
+def main(argv: Optional[List[str]] = None):
+    from . import capture as engine
+
+    parser = argparse.ArgumentParser(description="Chart screenshot worker")
+    parser.add_argument("--port", type=int, default=settings.SCREENSHOT_WORKER_PORT)
+    parser.add_argument("--worker", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args(argv)
+
+    setup_logging()
+
+    def browser_ok() -> bool:
+        browser = engine._screenshotter.browser if engine._screenshotter else None
+        return browser is None or browser.is_connected()
+
+    app = build_app(
+        engine.get_screenshot,
+        engine.get_composite,
+        concurrency=settings.SCREENSHOT_WORKER_CONCURRENCY,
+        timeout=settings.SCREENSHOT_RPC_TIMEOUT,
+        browser_ok=browser_ok,
+    )
+
+    async def warm(app):
+        # Pre-load only the layouts this worker will be asked for
+        layouts = [
+            layout for layout in engine.configured_layouts()
+            if worker_for(engine.parse_layout(layout)[0], args.workers) == args.worker
+        ]
+        app["warmup"] = asyncio.create_task(engine.warm_screenshot_pool(layouts))
+
+    async def close(app):
+        await engine.close_screenshotter()
+
+    app.on_startup.append(warm)
+    app.on_cleanup.append(close)
+    logger.info("screenshot_worker_starting", worker=args.worker, port=args.port)
+    web.run_app(app, host="127.0.0.1", port=args.port, print=None, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+from typing import Optional
+from pathlib import Path
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import time
+import structlog
+from config import settings
+
+logger = structlog.get_logger()
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+    HAS_CRYPTOGRAPHY = True
+except ImportError:
+    HAS_CRYPTOGRAPHY = False
+
+TV_ORIGIN = "https://www.tradingview.com"
+SESSION_COOKIE = "sessionid"
+# Shown in the header only to signed-out visitors
+SIGNED_OUT_SELECTOR = '.tv-header__user-menu-button--anonymous, [data-name="header-user-menu-sign-in"]'
+
+
+def _derive_key(secret: str) -> bytes:
+    """Fernet key from TV_SESSION_KEY, or from the TradingView password when that isn't set."""
+    if settings.TV_SESSION_KEY:
+        return settings.TV_SESSION_KEY.encode()
+    digest = hashlib.pbkdf2_hmac("sha256", secret.encode(), b"ict-ai-analyst/tv-session", 200_000)
+    return base64.urlsafe_b64encode(digest)
+
+
+class SessionStore:
+    """
+    Playwright storage_state (cookies + localStorage) persisted between restarts,
+    encrypted at rest with Fernet. Nothing is written without the `cryptography`
+    package or without a secret (TV_SESSION_KEY or TV_PASSWORD) — a plaintext
+    cookie, or one encrypted under a key anyone can derive, is worse than logging
+    in again.
+    """
+
+    def __init__(self, path: str, secret: str = ""):
+        self.path = Path(path)
+        self.secret = secret
+        self._fernet = None  # derived on first use, see _cipher()
+
+    @property
+    def enabled(self) -> bool:
+        return HAS_CRYPTOGRAPHY and bool(settings.TV_SESSION_KEY or self.secret)
+
+    async def _cipher(self):
+        if self._fernet is None:
+            # 200k PBKDF2 rounds: keep them off the event loop
+            self._fernet = Fernet(await asyncio.to_thread(_derive_key, self.secret))
+        return self._fernet
+
+    async def load(self) -> Optional[dict]:
+        if not self.enabled or not self.path.exists():
+            return None
+        fernet = await self._cipher()
+        try:
+            return json.loads(fernet.decrypt(self.path.read_bytes()))
+        except (InvalidToken, ValueError) as e:
+            # Key changed or file corrupt — just log in again
+            logger.warning("tv_session_unreadable", path=str(self.path), error=type(e).__name__)
+            return None
+
+    async def save(self, state: dict):
+        if not self.enabled:
+            reason = "no TV_SESSION_KEY or TV_PASSWORD" if HAS_CRYPTOGRAPHY else "cryptography not installed"
+            logger.warning("tv_session_not_saved", reason=reason)
+            return
+        fernet = await self._cipher()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_suffix(".tmp")
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(fernet.encrypt(json.dumps(state).encode()))
+        os.replace(tmp, self.path)
+        logger.info("tv_session_saved", path=str(self.path))
+
+    def clear(self):
+        self.path.unlink(missing_ok=True)
+
+
+async def session_is_valid(context) -> bool:
+    """
+    Cheap validity check — no network: the context holds an unexpired TradingView
+    session cookie. A session cookie without an expiry (-1) counts as valid.
+    The server may still have revoked it; `signed_in` checks the first chart.
+    """
+    now = time.time()
+    for cookie in await context.cookies(TV_ORIGIN):
+        if cookie["name"] == SESSION_COOKIE and cookie.get("value"):
+            expires = cookie.get("expires", -1)
+            if expires == -1 or expires > now:
+                return True
+    return False
+
+
+async def signed_in(page) -> bool:
+    """
+    Whether TradingView served `page` to a signed-in user: not bounced to the
+    sign-in form and no signed-out header. A chart that is slow to settle says
+    nothing about the session (wait_for_chart_ready reports that on its own).
+    """
+    if "/accounts/signin" in (page.url or ""):
+        return False
+    return await page.query_selector(SIGNED_OUT_SELECTOR) is None
@@ -0,0 +1,238 @@
+from typing import Callable, List, Optional, Sequence
+from dataclasses import dataclass
+from pathlib import Path
+import asyncio
+import sys
+import time
+import httpx
+import structlog
+from config import settings
+from utils.metrics import metrics
+from .capture import get_screenshot, get_composite
+from .frame import ChartFrame
+from .service import frame_from_response, worker_for
+
+logger = structlog.get_logger()
+
+APP_DIR = Path(__file__).resolve().parent.parent
+
+# Failed health checks in a row before a live worker is killed and restarted
+UNHEALTHY_AFTER = 2
+MAX_RESTART_DELAY = 30.0
+# Share of the RPC timeout a worker may spend on a capture; the rest is left for the answer
+WORKER_BUDGET = 0.9
+
+
+class WorkerUnavailable(RuntimeError):
+    """The worker that owns a chart is down or restarting."""
+
+
+@dataclass
+class Worker:
+    index: int
+    port: int
+    process: Optional[asyncio.subprocess.Process] = None
+    failures: int = 0           # consecutive failed health checks
+    crashes: int = 0            # consecutive restarts, for backoff
+    started_at: float = 0.0
+    restart_at: float = 0.0     # monotonic time the next spawn is allowed
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    @property
+    def alive(self) -> bool:
+        return self.process is not None and self.process.returncode is None
+
+
+def worker_command(worker: Worker, count: int) -> List[str]:
+    return [
+        sys.executable, "-m", "screenshot.service",
+        "--port", str(worker.port), "--worker", str(worker.index), "--workers", str(count),
+    ]
+
+
+class WorkerSupervisor:
+    """
+    Runs the screenshot workers as child processes and calls them over local HTTP.
+    Crashed workers are respawned (with backoff if they keep dying); workers that
+    stop answering /health — or report a wedged browser — are killed and respawned.
+    Every capture has a hard RPC timeout, so a stuck browser costs an alert its
+    chart, never the webhook receiver its latency. The worker is told how long
+    the caller will wait and gives up first, so it sees the wedge too.
+    """
+
+    def __init__(
+        self,
+        count: int = 1,
+        base_port: int = 8701,
+        timeout: float = 20.0,
+        health_interval: float = 10.0,
+        command: Callable[[Worker, int], List[str]] = worker_command,
+    ):
+        self.workers = [Worker(index, base_port + index) for index in range(count)]
+        self.timeout = timeout
+        self.health_interval = health_interval
+        self.command = command
+        self._client = httpx.AsyncClient(timeout=timeout, trust_env=False)  # local only, never proxied
+        self._watcher: Optional[asyncio.Task] = None
+
+    async def start(self):
+        for worker in self.workers:
+            await self._spawn(worker)
+        self._watcher = asyncio.create_task(self._watch())
+        logger.info("screenshot_workers_started", workers=len(self.workers))
+
+    async def stop(self):
+        if self._watcher:
+            self._watcher.cancel()
+            await asyncio.gather(self._watcher, return_exceptions=True)
+            self._watcher = None
+        await asyncio.gather(*[self._terminate(worker) for worker in self.workers])
+        await self._client.aclose()
+
+    async def capture(
+        self,
+        symbol: Optional[str] = None,
+        tf: Optional[str] = None,
+        archive_path: Optional[str] = None
+    ) -> ChartFrame:
+        return await self._call(symbol, "/capture", {"symbol": symbol, "tf": tf, "archive_path": archive_path})
+
+    async def capture_composite(
+        self,
+        symbol: str,
+        tfs: Sequence[str],
+        archive_path: Optional[str] = None
+    ) -> ChartFrame:
+        return await self._call(symbol, "/composite", {"symbol": symbol, "tfs": list(tfs), "archive_path": archive_path})
+
+    async def _call(self, symbol: Optional[str], path: str, body: dict) -> ChartFrame:
+        worker = self.workers[worker_for(symbol, len(self.workers))]
+        if not worker.alive:
+            metrics.incr("screenshot.worker.unavailable")
+            raise WorkerUnavailable(f"screenshot worker {worker.index} is restarting")
+        try:
+            with metrics.timer("screenshot.rpc_ms"):
+                response = await self._client.post(
+                    worker.url + path, json={**body, "budget": self.timeout * WORKER_BUDGET}
+                )
+        except httpx.TimeoutException:
+            metrics.incr("screenshot.rpc.timeouts")
+            raise
+        if response.status_code != 200:
+            raise RuntimeError(f"screenshot worker {worker.index}: {response.status_code} {response.text[:200]}")
+        return frame_from_response(response.content, response.headers)
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.health_interval)
+            await self.check()
+
+    async def check(self):
+        """Respawn dead workers, kill and respawn ones that are alive but unhealthy."""
+        for worker in self.workers:
+            if not worker.alive:
+                if worker.process is not None:
+                    metrics.incr("screenshot.worker.crashes")
+                    logger.error("screenshot_worker_exited", worker=worker.index,
+                                 code=worker.process.returncode)
+                    worker.process = None
+                    self._backoff(worker)
+                if time.monotonic() >= worker.restart_at:
+                    await self._spawn(worker)
+                continue
+
+            if await self._healthy(worker):
+                worker.failures = 0
+                if time.monotonic() - worker.started_at > MAX_RESTART_DELAY:
+                    worker.crashes = 0
+                continue
+            worker.failures += 1
+            if worker.failures >= UNHEALTHY_AFTER:
+                metrics.incr("screenshot.worker.unhealthy")
+                logger.error("screenshot_worker_unhealthy", worker=worker.index)
+                await self._terminate(worker)
+                self._backoff(worker)
+
+    async def _healthy(self, worker: Worker) -> bool:
+        try:
+            response = await self._client.get(worker.url + "/health", timeout=2.0)
+            return response.status_code == 200
+        except httpx.HTTPError:
+            # Not listening yet counts as healthy while the worker is still starting
+            return time.monotonic() - worker.started_at < self.timeout
+
+    def _backoff(self, worker: Worker):
+        worker.crashes += 1
+        delay = min(MAX_RESTART_DELAY, 2 ** (worker.crashes - 1) - 1)
+        worker.restart_at = time.monotonic() + delay
+
+    async def _spawn(self, worker: Worker):
+        worker.process = await asyncio.create_subprocess_exec(
+            *self.command(worker, len(self.workers)), cwd=str(APP_DIR)
+        )
+        worker.failures = 0
+        worker.started_at = time.monotonic()
+        if worker.crashes:
+            metrics.incr("screenshot.worker.restarts")
+        logger.info("screenshot_worker_spawned", worker=worker.index, port=worker.port,
+                    pid=worker.process.pid, restarts=worker.crashes)
+
+    async def _terminate(self, worker: Worker, grace: float = 5.0):
+        process, worker.process = worker.process, None
+        if process is None or process.returncode is not None:
+            return
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), grace)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+
+
+# Singleton instance
+_workers: Optional[WorkerSupervisor] = None
+
+
+def get_workers() -> WorkerSupervisor:
+    """Get the screenshot worker supervisor (SCREENSHOT_WORKERS processes)."""
+    global _workers
+    if _workers is None:
+        _workers = WorkerSupervisor(
+            count=settings.SCREENSHOT_WORKERS,
+            base_port=settings.SCREENSHOT_WORKER_PORT,
+            timeout=settings.SCREENSHOT_RPC_TIMEOUT,
+            health_interval=settings.SCREENSHOT_WORKER_HEALTH_INTERVAL,
+        )
+    return _workers
+
+
+async def close_workers():
+    global _workers
+    if _workers:
+        await _workers.stop()
+        _workers = None
+
+
+async def request_screenshot(
+    symbol: Optional[str] = None,
+    tf: Optional[str] = None,
+    archive_path: Optional[str] = None
+) -> ChartFrame:
+    """A chart capture from the worker processes, or in-process when SCREENSHOT_WORKERS=0."""
+    if settings.SCREENSHOT_WORKERS:
+        return await get_workers().capture(symbol, tf, archive_path)
+    return await get_screenshot(symbol, tf, archive_path)
+
+
+async def request_composite(
+    symbol: str,
+    tfs: Sequence[str],
+    archive_path: Optional[str] = None
+) -> ChartFrame:
+    """A multi-timeframe composite from the worker processes, or in-process when SCREENSHOT_WORKERS=0."""
+    if settings.SCREENSHOT_WORKERS:
+        return await get_workers().capture_composite(symbol, tfs, archive_path)
+    return await get_composite(symbol, tfs, archive_path)
@@ -0,0 +1,27 @@
+"""
+Shared test setup: every test gets its own journal, analysis cache and TradingView
+session files, so nothing lands in the real data/ directory (a journal left there
+would be replayed to the live destinations on the next start).
+"""
+import pytest
+from pathlib import Path
+
+# Add parent to path for imports
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import settings
+import analysis.cache
+from jobs.journal import close_journal
+
+
+@pytest.fixture(autouse=True)
+def isolated_data_files(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "JOURNAL_PATH", str(tmp_path / "journal.db"))
+    monkeypatch.setattr(settings, "ANALYSIS_CACHE_PATH", str(tmp_path / "analysis-cache.db"))
+    monkeypatch.setattr(settings, "TV_SESSION_PATH", str(tmp_path / "tv-session.enc"))
+    # The singletons remember the path they were opened with
+    close_journal()
+    monkeypatch.setattr(analysis.cache, "_analysis_cache", None)
+    yield
+    close_journal()
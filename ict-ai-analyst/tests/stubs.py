@@ -0,0 +1,297 @@
+"""
+Local stand-ins for external APIs, used by tests.
+StubAIServer serves DeepSeek (/v1/chat/completions) and Anthropic (/v1/messages) shaped
+responses, streamed as server-sent events when the request sets "stream": true.
+StubDeliveryServer serves a Discord webhook (/webhook) and the Telegram Bot API (/bot<token>/...).
+"""
+import json
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl
+
+STUB_ANALYSIS = "### 📊 DIRECTIONAL BIAS: BULLISH\n**DOL Target:** 17920.5 (BSL x3)"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, so connection reuse is observable
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, body: dict, status: int = 200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_stream(self, request: dict):
+        """Server-sent events, one event per chunk of `server.text`."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(data: dict, name: str = None):
+            frame = (f"event: {name}\n" if name else "") + f"data: {json.dumps(data)}\n\n"
+            raw = frame.encode()
+            self.wfile.write(f"{len(raw):x}\r\n".encode() + raw + b"\r\n")
+            self.wfile.flush()
+
+        text = self.server.text
+        chunks = [text[i:i + self.server.chunk_size] for i in range(0, len(text), self.server.chunk_size)]
+
+        if self.path.endswith("/chat/completions"):
+            for chunk in chunks:
+                event({"choices": [{"index": 0, "delta": {"content": chunk}}]})
+                time.sleep(self.server.chunk_delay)
+            if request.get("stream_options", {}).get("include_usage"):
+                event({"choices": [], "usage": self._usage(request)})
+            raw = b"data: [DONE]\n\n"
+            self.wfile.write(f"{len(raw):x}\r\n".encode() + raw + b"\r\n")
+        else:
+            usage = {**self._usage(request), "output_tokens": 0}
+            event({"type": "message_start", "message": {
+                "id": "msg_stub", "type": "message", "role": "assistant",
+                "model": request.get("model", "stub"), "content": [],
+                "stop_reason": None, "stop_sequence": None, "usage": usage,
+            }}, "message_start")
+            event({"type": "content_block_start", "index": 0,
+                   "content_block": {"type": "text", "text": ""}}, "content_block_start")
+            for chunk in chunks:
+                event({"type": "content_block_delta", "index": 0,
+                       "delta": {"type": "text_delta", "text": chunk}}, "content_block_delta")
+                time.sleep(self.server.chunk_delay)
+            event({"type": "content_block_stop", "index": 0}, "content_block_stop")
+            event({"type": "message_delta", "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                   "usage": {"output_tokens": 10}}, "message_delta")
+            event({"type": "message_stop"}, "message_stop")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _usage(self, request: dict) -> dict:
+        """Provider-shaped usage, pretending the system prompt is cached after its first use."""
+        if self.path.endswith("/chat/completions"):
+            system = request["messages"][0]["content"]
+        else:
+            system = json.dumps(request.get("system"))
+        cacheable = self.path.endswith("/chat/completions") or "cache_control" in system
+        hit = cacheable and system in self.server.prompts_seen
+        self.server.prompts_seen.add(system)
+        prefix = 1500
+
+        if self.path.endswith("/chat/completions"):
+            return {
+                "prompt_tokens": prefix + 200, "completion_tokens": 10,
+                "prompt_cache_hit_tokens": prefix if hit else 0,
+                "prompt_cache_miss_tokens": 200 if hit else prefix + 200,
+            }
+        return {
+            "input_tokens": 200 if cacheable else prefix + 200, "output_tokens": 10,
+            "cache_read_input_tokens": prefix if hit else 0,
+            "cache_creation_input_tokens": prefix if cacheable and not hit else 0,
+        }
+
+    def do_GET(self):
+        self._send_json({"ok": True})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        self.server.requests.append((self.path, request))
+        time.sleep(self.server.delay)
+
+        if self.server.drop:
+            self.close_connection = True  # hang up without answering
+            return
+        if request.get("stream"):
+            self._send_stream(request)
+        elif self.path.endswith("/chat/completions"):
+            self._send_json({
+                "choices": [{"message": {"role": "assistant", "content": self.server.text}}],
+                "usage": self._usage(request),
+            })
+        elif self.path.endswith("/messages"):
+            self._send_json({
+                "id": "msg_stub",
+                "type": "message",
+                "role": "assistant",
+                "model": request.get("model", "stub"),
+                "content": [{"type": "text", "text": self.server.text}],
+                "stop_reason": "end_turn",
+                "stop_sequence": None,
+                "usage": self._usage(request),
+            })
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+
+class StubAIServer:
+    """
+    Threaded local HTTP server. Use as a context manager; `url` is the base URL.
+    With `drop`, every request is read and the connection closed without an answer.
+    """
+
+    def __init__(
+        self,
+        delay: float = 0.0,
+        text: str = STUB_ANALYSIS,
+        chunk_size: int = 16,
+        chunk_delay: float = 0.0,
+        drop: bool = False,
+    ):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self._server.delay = delay
+        self._server.drop = drop
+        self._server.text = text
+        self._server.chunk_size = chunk_size
+        self._server.chunk_delay = chunk_delay
+        self._server.requests = []
+        self._server.prompts_seen = set()
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def requests(self) -> list:
+        return self._server.requests
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+
+def parse_body(content_type: str, body: bytes) -> dict:
+    """JSON, urlencoded or multipart/form-data → dict; uploaded files become (filename, bytes)."""
+    if content_type.startswith("application/x-www-form-urlencoded"):
+        return dict(parse_qsl(body.decode()))
+    if not content_type.startswith("multipart/"):
+        return json.loads(body or b"{}")
+    message = BytesParser(policy=HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body
+    )
+    fields = {}
+    for part in message.iter_parts():
+        name = part.get_param("name", header="content-disposition")
+        data = part.get_payload(decode=True)
+        filename = part.get_filename()
+        fields[name] = (filename, data) if filename else data.decode()
+    return fields
+
+
+class _DeliveryHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def _send_json(self, body: dict, status: int = 200):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _handle(self):
+        length = int(self.headers.get("Content-Length", 0))
+        fields = parse_body(self.headers.get("Content-Type", ""), self.rfile.read(length))
+        with self.server.lock:
+            self.server.requests.append((self.command, self.path, fields))
+            self.server.connections.add(self.client_address)
+            n = len(self.server.requests)
+        time.sleep(self.server.delay)
+
+        path = self.path.split("?", 1)[0]
+        if n <= self.server.rate_limited:
+            # The first `rate_limited` requests are throttled, the way each API says it
+            wait = self.server.retry_after
+            if path.startswith("/webhook"):
+                self._send_json({"message": "You are being rate limited.", "retry_after": wait, "global": False}, 429)
+            else:
+                self._send_json({"ok": False, "error_code": 429, "description": "Too Many Requests",
+                                 "parameters": {"retry_after": wait}}, 429)
+        elif self.server.rejected and self.server.rejected_path in path:
+            if path.startswith("/webhook"):
+                self._send_json({"message": "Invalid Form Body", "code": 50035}, self.server.rejected)
+            else:
+                self._send_json({"ok": False, "error_code": self.server.rejected,
+                                 "description": "Bad Request: chat not found"}, self.server.rejected)
+        elif path.startswith("/webhook"):
+            payload = json.loads(fields.get("payload_json", "{}")) if "payload_json" in fields else fields
+            files = [v[0] for v in fields.values() if isinstance(v, tuple)]
+            message_id = path.rsplit("/", 1)[1] if "/messages/" in path else str(n)
+            self._send_json({
+                "id": message_id,
+                "embeds": payload.get("embeds", []),
+                "attachments": [{"url": f"https://cdn.discord.test/{n}/{name}"} for name in files],
+            })
+        elif path.startswith("/bot"):
+            result = {"message_id": n}
+            if path.endswith("/sendPhoto"):
+                result["photo"] = [{"file_id": f"thumb-{n}"}, {"file_id": f"photo-{n}"}]
+            self._send_json({"ok": True, "result": result})
+        else:
+            self._send_json({"error": "not found"}, status=404)
+
+    do_POST = _handle
+    do_PATCH = _handle
+
+
+class StubDeliveryServer:
+    """
+    Threaded local Discord webhook + Telegram Bot API. `requests` holds
+    (method, path, fields) tuples, `connections` the client addresses that sent
+    them; `webhook_url` / `url` go into settings. The first `rate_limited`
+    requests get a 429 asking to retry after `retry_after` seconds. With
+    `rejected` set, every other request whose path contains `rejected_path` is
+    refused with that status.
+    """
+
+    def __init__(self, delay: float = 0.0, rate_limited: int = 0, retry_after: float = 0.2,
+                 rejected: int = 0, rejected_path: str = ""):
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), _DeliveryHandler)
+        self._server.delay = delay
+        self._server.rejected = rejected
+        self._server.rejected_path = rejected_path
+        self._server.rate_limited = rate_limited
+        self._server.retry_after = retry_after
+        self._server.requests = []
+        self._server.connections = set()
+        self._server.lock = threading.Lock()
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    @property
+    def webhook_url(self) -> str:
+        return f"{self.url}/webhook"
+
+    @property
+    def requests(self) -> list:
+        return self._server.requests
+
+    @property
+    def connections(self) -> set:
+        return self._server.connections
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
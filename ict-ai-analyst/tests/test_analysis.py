@@ -4,15 +4,33 @@ Run with: pytest tests/test_analysis.py -v
 """
 import pytest
 import json
+import time
+import base64
+import asyncio
+import threading
+from io import BytesIO
 from pathlib import Path
+from PIL import Image
 
 # Add parent to path for imports
 import sys
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+from config import settings
 from webhook.models import TradingViewPayload
-from analysis.engine import format_payload_for_ai
+from analysis.engine import format_payload_for_ai, analyze_with_ai, payload_fingerprint, _record_usage
+from analysis.cache import AnalysisCache, get_analysis_cache
+from analysis.engine import run_analysis_pipeline
+from analysis.singleflight import SingleFlight
+from analysis.streaming import SectionStream
+from analysis.geometry import compute_geometry
+from analysis.rules import evaluate_rules, render_rule_analysis, NO_TRADE, DEVELOPING, ACTIVE
 from analysis.prompts import ICT_SYSTEM_PROMPT
+from analysis.providers import close_provider_clients
+from analysis.vision import record_vision_latency, expected_vision_seconds
+from screenshot.frame import ChartFrame, encode_frame
+from utils.metrics import metrics
+from tests.stubs import StubAIServer, STUB_ANALYSIS
 
 
 def load_sample_payload():
@@ -138,5 +156,708 @@ class TestModelTypes:
         assert model_name in formatted
 
 
+class TestProviderClients:
+    """The provider pool should pay connection setup once, then reuse it."""
+
+    def test_deepseek_connection_reused_after_warmup(self, monkeypatch):
+        monkeypatch.setattr(settings, "AI_PROVIDER", "deepseek")
+        monkeypatch.setattr(settings, "DEEPSEEK_API_KEY", "test-key")
+        monkeypatch.setattr(settings, "ANALYSIS_CACHE_ENABLED", False)
+        metrics.reset()
+
+        async def run(base_url):
+            monkeypatch.setattr(settings, "DEEPSEEK_BASE_URL", base_url)
+            payload = TradingViewPayload(**load_sample_payload())
+            try:
+                results = [await analyze_with_ai(payload) for _ in range(3)]
+            finally:
+                await close_provider_clients()
+            return results
+
+        with StubAIServer() as server:
+            results = asyncio.run(run(server.url))
+
+        assert results == [STUB_ANALYSIS] * 3
+        samples = list(metrics.timings["ai.deepseek.connect_ms"])
+        assert len(samples) == 3
+        assert samples[0] > 0
+        assert samples[1:] == [0, 0]
+
+
+class TestAnalysisCache:
+    def test_fingerprint_ignores_trigger_and_timestamp(self):
+        first = load_sample_payload()
+        second = load_sample_payload()
+        second["trigger"] = "CONVICTION_CROSSED"
+        second["ts"] = first["ts"] + 1000
+        assert payload_fingerprint(TradingViewPayload(**first)) == \
+            payload_fingerprint(TradingViewPayload(**second))
+
+    def test_fingerprint_buckets_prices_to_tick(self):
+        first = load_sample_payload()
+        second = load_sample_payload()
+        second["px"] = 17845.26       # same MNQ tick as 17845.25
+        second["levels"]["pdh"] = 17900.04
+        assert payload_fingerprint(TradingViewPayload(**first)) == \
+            payload_fingerprint(TradingViewPayload(**second))
+
+    def test_fingerprint_changes_with_rendered_data(self):
+        first = load_sample_payload()
+        second = load_sample_payload()
+        second["narr"]["score"] = 55
+        assert payload_fingerprint(TradingViewPayload(**first)) != \
+            payload_fingerprint(TradingViewPayload(**second))
+
+    def test_lru_eviction(self):
+        cache = AnalysisCache(max_entries=2, ttl=60)
+
+        async def run():
+            await cache.put("a", "A")
+            await cache.put("b", "B")
+            assert await cache.get("a") == "A"  # a is now most recent
+            await cache.put("c", "C")
+            assert await cache.get("b") is None
+            assert await cache.get("a") == "A"
+            assert await cache.get("c") == "C"
+
+        asyncio.run(run())
+
+    def test_ttl_expiry(self):
+        cache = AnalysisCache(max_entries=2, ttl=-1)
+        asyncio.run(cache.put("a", "A"))
+        assert asyncio.run(cache.get("a")) is None
+        assert len(cache) == 0
+
+    def test_persistent_backend_survives_restart(self, tmp_path):
+        path = str(tmp_path / "cache.db")
+        asyncio.run(AnalysisCache(ttl=60, path=path).put("a", "A"))
+        assert asyncio.run(AnalysisCache(ttl=60, path=path).get("a")) == "A"
+
+    def test_persistent_backend_stays_off_the_event_loop(self, tmp_path, monkeypatch):
+        cache = AnalysisCache(ttl=60, path=str(tmp_path / "cache.db"))
+        loop_thread = threading.get_ident()
+        threads = []
+        connect = cache._connect
+
+        def tracked_connect():
+            threads.append(threading.get_ident())
+            return connect()
+
+        monkeypatch.setattr(cache, "_connect", tracked_connect)
+
+        async def run():
+            await cache.put("a", "A")
+            cache._entries.clear()  # force the read to go to disk
+            return await cache.get("a")
+
+        assert asyncio.run(run()) == "A"
+        assert len(threads) == 2 and loop_thread not in threads
+
+    def test_duplicate_alert_skips_provider(self, monkeypatch):
+        monkeypatch.setattr(settings, "AI_PROVIDER", "deepseek")
+        monkeypatch.setattr(settings, "DEEPSEEK_API_KEY", "test-key")
+        get_analysis_cache().clear()
+        metrics.reset()
+
+        first = TradingViewPayload(**load_sample_payload())
+        refired = load_sample_payload()
+        refired["trigger"] = "CONVICTION_CROSSED"
+        second = TradingViewPayload(**refired)
+
+        async def run(base_url):
+            monkeypatch.setattr(settings, "DEEPSEEK_BASE_URL", base_url)
+            try:
+                return await analyze_with_ai(first), await analyze_with_ai(second)
+            finally:
+                await close_provider_clients()
+
+        with StubAIServer() as server:
+            results = asyncio.run(run(server.url))
+            assert len(server.requests) == 1
+
+        assert results == (STUB_ANALYSIS, STUB_ANALYSIS)
+        assert metrics.counters["analysis_cache.hits"] == 1
+        assert metrics.counters["analysis_cache.misses"] == 1
+        get_analysis_cache().clear()
+
+
+class TestSingleFlight:
+    def test_concurrent_calls_share_one_execution(self):
+        metrics.reset()
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            return "result"
+
+        async def run():
+            flight = SingleFlight("test")
+            return await asyncio.gather(*[flight.do("k", work) for _ in range(5)])
+
+        assert asyncio.run(run()) == ["result"] * 5
+        assert calls == 1
+        assert metrics.counters["singleflight.test.coalesced"] == 4
+
+    def test_errors_reach_every_waiter_and_are_not_remembered(self):
+        calls = 0
+
+        async def fail():
+            nonlocal calls
+            calls += 1
+            await asyncio.sleep(0.01)
+            raise RuntimeError("provider down")
+
+        async def run():
+            flight = SingleFlight("test", linger=60)
+            results = await asyncio.gather(*[flight.do("k", fail) for _ in range(3)], return_exceptions=True)
+            with pytest.raises(RuntimeError):
+                await flight.do("k", fail)
+            return results
+
+        results = asyncio.run(run())
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert calls == 2
+
+    def test_linger_coalesces_a_late_retry(self):
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            return calls
+
+        async def run():
+            flight = SingleFlight("test", linger=60)
+            return await flight.do("k", work), await flight.do("k", work), await flight.do("other", work)
+
+        assert asyncio.run(run()) == (1, 1, 2)
+
+    def test_only_kept_results_linger(self):
+        calls = 0
+
+        async def work():
+            nonlocal calls
+            calls += 1
+            return calls > 1
+
+        async def run():
+            flight = SingleFlight("test", linger=60, keep=bool)
+            return [await flight.do("k", work) for _ in range(3)]
+
+        assert asyncio.run(run()) == [False, True, True]
+        assert calls == 2
+
+    def test_retry_of_undelivered_alert_and_next_bar_go_out(self, monkeypatch):
+        import delivery.discord_bot
+
+        monkeypatch.setattr(settings, "DELIVERY_METHOD", "discord")
+        monkeypatch.setattr(settings, "DISCORD_WEBHOOK_URL", "https://discord.test/webhook")
+        monkeypatch.setattr(settings, "AI_STREAMING", False)
+        attempts = []
+
+        async def flaky_discord(payload, analysis, chart=None, webhook_url=None):
+            attempts.append(payload.ts)
+            if len(attempts) == 1:
+                raise RuntimeError("discord 503")
+
+        monkeypatch.setattr(delivery.discord_bot, "send_discord_alert", flaky_discord)
+        payload_data = load_sample_payload()
+        payload_data["narr"]["score"] = 73  # own flight key, apart from other tests' payloads
+        payload = TradingViewPayload(**payload_data)
+        payload_data["ts"] += 5 * 60 * 1000  # next bar, same levels
+        next_bar = TradingViewPayload(**payload_data)
+
+        async def run():
+            for alert in (payload, payload, payload, next_bar):
+                await run_analysis_pipeline(alert, analysis="analysis")
+
+        asyncio.run(run())
+        # The failed send is retried, the delivered one coalesced, the next bar sent
+        assert attempts == [payload.ts, payload.ts, next_bar.ts]
+
+    def test_identical_pipelines_call_provider_and_deliver_once(self, monkeypatch):
+        import delivery.discord_bot
+
+        monkeypatch.setattr(settings, "AI_PROVIDER", "deepseek")
+        monkeypatch.setattr(settings, "DEEPSEEK_API_KEY", "test-key")
+        monkeypatch.setattr(settings, "ANALYSIS_CACHE_ENABLED", False)
+        monkeypatch.setattr(settings, "DELIVERY_METHOD", "discord")
+        monkeypatch.setattr(settings, "DISCORD_WEBHOOK_URL", "https://discord.test/webhook")
+        metrics.reset()
+
+        delivered = []
+
+        async def fake_discord(payload, analysis, chart=None, webhook_url=None):
+            delivered.append(analysis)
+
+        monkeypatch.setattr(delivery.discord_bot, "send_discord_alert", fake_discord)
+        payload_data = load_sample_payload()
+        payload_data["narr"]["score"] = 77  # own flight key, apart from other tests' payloads
+        payload = TradingViewPayload(**payload_data)
+
+        async def run(base_url):
+            monkeypatch.setattr(settings, "DEEPSEEK_BASE_URL", base_url)
+            try:
+                await asyncio.gather(*[run_analysis_pipeline(payload) for _ in range(3)])
+            finally:
+                await close_provider_clients()
+
+        with StubAIServer(delay=0.2) as server:
+            asyncio.run(run(server.url))
+            assert len(server.requests) == 1
+
+        assert delivered == [STUB_ANALYSIS]
+        assert metrics.counters["singleflight.pipeline.coalesced"] == 2
+
+
+class TestRulesFastPath:
+    def test_sample_setup_needs_llm(self):
+        verdict = evaluate_rules(TradingViewPayload(**load_sample_payload()))
+        assert verdict.status == ACTIVE
+        assert verdict.needs_llm
+
+    @pytest.mark.parametrize("section,field,value,status", [
+        ("narr", "score", 42, NO_TRADE),
+        ("bias", "dol_status", "DELIVERED", NO_TRADE),
+        ("model", "name", "GENERIC", DEVELOPING),
+        ("struct", "mss", "NONE", DEVELOPING),
+    ])
+    def test_critical_rules(self, section, field, value, status):
+        data = load_sample_payload()
+        data[section][field] = value
+        assert evaluate_rules(TradingViewPayload(**data)).status == status
+
+    def test_kill_zone_rule_exempts_2022_and_unicorn(self):
+        data = load_sample_payload()
+        data["session"]["kz"] = "NONE"
+        assert evaluate_rules(TradingViewPayload(**data)).status == ACTIVE
+        data["model"]["name"] = "SILVER_BULLET"
+        verdict = evaluate_rules(TradingViewPayload(**data))
+        assert verdict.status == NO_TRADE
+        assert verdict.reasons == ["No Kill Zone active"]
+
+    def test_no_trade_outranks_developing(self):
+        data = load_sample_payload()
+        data["narr"]["score"] = 30
+        data["model"]["name"] = "GENERIC"
+        verdict = evaluate_rules(TradingViewPayload(**data))
+        assert verdict.status == NO_TRADE
+        assert "GENERIC" in render_rule_analysis(TradingViewPayload(**data), verdict)
+
+    def test_no_trade_alert_skips_provider(self, monkeypatch):
+        monkeypatch.setattr(settings, "AI_PROVIDER", "deepseek")
+        monkeypatch.setattr(settings, "DEEPSEEK_API_KEY", "test-key")
+        metrics.reset()
+        data = load_sample_payload()
+        data["narr"]["score"] = 35
+        payload = TradingViewPayload(**data)
+
+        async def run(base_url):
+            monkeypatch.setattr(settings, "DEEPSEEK_BASE_URL", base_url)
+            try:
+                return await analyze_with_ai(payload)
+            finally:
+                await close_provider_clients()
+
+        with StubAIServer() as server:
+            analysis = asyncio.run(run(server.url))
+            assert server.requests == []
+
+        assert "**Status:** NO TRADE" in analysis
+        assert "Conviction 35% is below 50%" in analysis
+        assert metrics.counters["rules.llm_calls_avoided"] == 1
+
+        monkeypatch.setattr(settings, "RULES_FAST_PATH", False)
+        with StubAIServer() as server:
+            assert asyncio.run(run(server.url)) == STUB_ANALYSIS
+
+
+class TestTradeGeometry:
+    def test_long_from_sample(self):
+        g = compute_geometry(TradingViewPayload(**load_sample_payload()))
+        assert (g.direction, g.entry, g.stop, g.risk) == ("LONG", 17802.5, 17790.0, 12.5)
+        assert (g.t1.price, g.t1.points, g.t1.r, g.t1.source) == (17825.0, 22.5, 1.8, "EQ")
+        assert (g.t2.price, g.t2.r) == (17920.5, 9.44)
+
+    def test_short_rounds_away_from_entry(self):
+        data = load_sample_payload()
+        data["sym"] = "ES1!"
+        data["bias"]["dol"] = 17750.0
+        data["entry"].update({"dir": "BEAR", "px": 17861.1, "top": 17865.1, "bot": 17858.0})
+        g = compute_geometry(TradingViewPayload(**data))
+        assert g.direction == "SHORT"
+        assert g.entry == 17861.25
+        assert g.stop == 17866.75          # 17865.1 + 1.5 ES buffer, rounded up
+        assert g.risk == 5.5
+        assert g.t1.price == 17825.0       # EQ, the nearest level below entry
+        assert g.t2.source == "DOL BSL x3"
+        assert all(t.price % 0.25 == 0 for t in g.targets)
+
+    def test_no_entry_no_geometry(self):
+        data = load_sample_payload()
+        data["entry"]["found"] = False
+        assert compute_geometry(TradingViewPayload(**data)) is None
+
+    def test_geometry_in_prompt_with_smaller_max_tokens(self, monkeypatch):
+        monkeypatch.setattr(settings, "AI_PROVIDER", "deepseek")
+        monkeypatch.setattr(settings, "DEEPSEEK_API_KEY", "test-key")
+        monkeypatch.setattr(settings, "ANALYSIS_CACHE_ENABLED", False)
+        payload = TradingViewPayload(**load_sample_payload())
+
+        async def run(base_url):
+            monkeypatch.setattr(settings, "DEEPSEEK_BASE_URL", base_url)
+            try:
+                await analyze_with_ai(payload)
+            finally:
+                await close_provider_clients()
+
+        with StubAIServer() as server:
+            asyncio.run(run(server.url))
+            request = server.requests[0][1]
+
+        assert request["max_tokens"] == settings.AI_MAX_TOKENS_WITH_GEOMETRY
+        assert "- Stop Loss: 17790.0 (12.5 points risk)" in request["messages"][1]["content"]
+
+    def test_embed_fields_filled_when_ai_fails(self):
+        from delivery.discord_bot import build_discord_embed
+
+        payload = TradingViewPayload(**load_sample_payload())
+        embed = build_discord_embed(payload, "⚠️ AI analysis failed (status 500).")
+        fields = {f["name"]: f["value"] for f in embed["fields"]}
+        assert fields["🛑 Stop"] == "17790.0 (12.5 pts)"
+        assert fields["🏁 T1"] == "17825.0 (1.8R)"
+        assert fields["🏁 T2"] == "17920.5 (9.44R)"
+
+    @pytest.mark.parametrize("provider", ["deepseek", "anthropic"])
+    def test_dropped_provider_connection_still_delivers_levels(self, provider, monkeypatch):
+        import delivery.discord_bot
+        from delivery.discord_bot import build_discord_embed
+
+        monkeypatch.setattr(settings, "AI_PROVIDER", provider)
+        monkeypatch.setattr(settings, "DEEPSEEK_API_KEY", "test-key")
+        monkeypatch.setattr(settings, "ANTHROPIC_API_KEY", "test-key")
+        monkeypatch.setattr(settings, "ANALYSIS_CACHE_ENABLED", False)
+        monkeypatch.setattr(settings, "AI_STREAMING", False)
+        monkeypatch.setattr(settings, "DELIVERY_METHOD", "discord")
+        monkeypatch.setattr(settings, "DISCORD_WEBHOOK_URL", "https://discord.test/webhook")
+        metrics.reset()
+        delivered = []
+
+        async def fake_discord(payload, analysis, chart=None, webhook_url=None):
+            delivered.append(build_discord_embed(payload, analysis))
+
+        monkeypatch.setattr(delivery.discord_bot, "send_discord_alert", fake_discord)
+        payload_data = load_sample_payload()
+        # Own flight key per provider, apart from other tests' payloads
+        payload_data["narr"]["score"] = 74 if provider == "deepseek" else 78
+        payload = TradingViewPayload(**payload_data)
+
+        async def run(base_url):
+            monkeypatch.setattr(settings, "DEEPSEEK_BASE_URL", base_url)
+            monkeypatch.setattr(settings, "ANTHROPIC_BASE_URL", base_url)
+            try:
+                await run_analysis_pipeline(payload)
+            finally:
+                await close_provider_clients()
+
+        with StubAIServer(drop=True) as server:
+            asyncio.run(run(server.url))
+            assert server.requests
+
+        assert len(delivered) == 1
+        assert delivered[0]["description"].startswith("⚠️ AI analysis failed")
+        fields = {f["name"]: f["value"] for f in delivered[0]["fields"]}
+        assert fields["🛑 Stop"] == "17790.0 (12.5 pts)"
+        assert metrics.counters[f"ai.{provider}.errors"] == 1
+
+    @pytest.mark.parametrize("change,status", [
+        ({"narr": {"score": 35}}, NO_TRADE),
+        ({"struct": {"mss": "NONE"}}, DEVELOPING),
+    ])
+    def test_embed_has_no_levels_unless_setup_is_active(self, change, status):
+        from delivery.discord_bot import build_discord_embed
+
+        data = load_sample_payload()
+        for section, values in change.items():
+            data[section].update(values)
+        payload = TradingViewPayload(**data)
+        assert compute_geometry(payload) is not None  # the entry alone would give levels
+        assert evaluate_rules(payload).status == status
+
+        embed = build_discord_embed(payload, render_rule_analysis(payload, evaluate_rules(payload)))
+        names = [f["name"] for f in embed["fields"]]
+        assert not any(n in ("🛑 Stop", "🏁 T1", "🏁 T2") for n in names)
+
+
+class TestPromptCaching:
+    @pytest.mark.parametrize("streaming", [False, True])
+    def test_anthropic_system_prompt_is_cache_breakpoint(self, streaming, monkeypatch):
+        monkeypatch.setattr(settings, "AI_PROVIDER", "anthropic")
+        monkeypatch.setattr(settings, "ANTHROPIC_API_KEY", "test-key")
+        monkeypatch.setattr(settings, "ANALYSIS_CACHE_ENABLED", False)
+        metrics.reset()
+        first = TradingViewPayload(**load_sample_payload())
+        second_data = load_sample_payload()
+        second_data["px"] = 17850.0
+        second = TradingViewPayload(**second_data)
+        on_section = (lambda text: None) if streaming else None
+
+        async def run(base_url):
+            monkeypatch.setattr(settings, "ANTHROPIC_BASE_URL", base_url)
+            try:
+                await analyze_with_ai(first, on_section=on_section)
+                await analyze_with_ai(second, on_section=on_section)
+            finally:
+                await close_provider_clients()
+
+        with StubAIServer() as server:
+            asyncio.run(run(server.url))
+            system = server.requests[0][1]["system"]
+
+        assert system == [{"type": "text", "text": ICT_SYSTEM_PROMPT, "cache_control": {"type": "ephemeral"}}]
+        assert metrics.counters["ai.anthropic.cache_write_tokens"] == 1500
+        assert metrics.counters["ai.anthropic.cache_read_tokens"] == 1500
+
+    @pytest.mark.parametrize("streaming", [False, True])
+    def test_deepseek_prefix_is_stable(self, streaming, monkeypatch):
+        monkeypatch.setattr(settings, "AI_PROVIDER", "deepseek")
+        monkeypatch.setattr(settings, "DEEPSEEK_API_KEY", "test-key")
+        monkeypatch.setattr(settings, "ANALYSIS_CACHE_ENABLED", False)
+        metrics.reset()
+        first = TradingViewPayload(**load_sample_payload())
+        second_data = load_sample_payload()
+        second_data["trigger"] = "CONVICTION_CROSSED"
+        second_data["px"] = 17850.0
+        second = TradingViewPayload(**second_data)
+        on_section = (lambda text: None) if streaming else None
+
+        async def run(base_url):
+            monkeypatch.setattr(settings, "DEEPSEEK_BASE_URL", base_url)
+            try:
+                await analyze_with_ai(first, on_section=on_section)
+                await analyze_with_ai(second, on_section=on_section)
+            finally:
+                await close_provider_clients()
+
+        with StubAIServer() as server:
+            asyncio.run(run(server.url))
+            prompts = [r[1]["messages"] for r in server.requests]
+
+        assert [m[0] for m in prompts] == [{"role": "system", "content": ICT_SYSTEM_PROMPT}] * 2
+        # Everything before the per-alert data is byte-identical
+        first_user, second_user = prompts[0][1]["content"], prompts[1][1]["content"]
+        shared = first_user[:first_user.index("**Alert Trigger:**")]
+        assert second_user.startswith(shared) and "exact output format" in shared
+        assert metrics.counters["ai.deepseek.cache_read_tokens"] == 1500
+
+    def test_deepseek_misses_are_uncached_not_written(self):
+        metrics.reset()
+        # As returned by /chat/completions for a prompt whose prefix was partly cached
+        _record_usage("deepseek", {
+            "prompt_tokens": 1800,
+            "completion_tokens": 412,
+            "total_tokens": 2212,
+            "prompt_tokens_details": {"cached_tokens": 1536},
+            "prompt_cache_hit_tokens": 1536,
+            "prompt_cache_miss_tokens": 264,
+        })
+        assert metrics.counters["ai.deepseek.cache_read_tokens"] == 1536
+        assert metrics.counters["ai.deepseek.uncached_input_tokens"] == 264
+        assert metrics.counters.get("ai.deepseek.cache_write_tokens", 0) == 0
+        # Every prompt token is counted exactly once
+        assert sum(metrics.counters.get(f"ai.deepseek.{k}", 0) for k in
+                   ("cache_read_tokens", "cache_write_tokens", "uncached_input_tokens")) == 1800
+
+
+STREAMED_ANALYSIS = (
+    "### 📊 DIRECTIONAL BIAS: BULLISH\n**DOL Target:** 17920.5 (BSL x3)\n\n"
+    "### 🎯 TRADE SETUP\n- Entry: 17845.25 (FVG)\n- Stop: 17828.0\n\n"
+    "### 🧠 NARRATIVE\nAsia low swept into London, MSS confirmed.\n"
+)
+
+
+def chart_frame(width=1920, height=1080) -> ChartFrame:
+    out = BytesIO()
+    Image.linear_gradient("L").transpose(Image.ROTATE_270).resize((width, height)).convert("RGB").save(out, "PNG")
+    return encode_frame(out.getvalue(), max_width=0)
+
+
+class TestVision:
+    @pytest.fixture(autouse=True)
+    def fresh_latency_samples(self, monkeypatch):
+        import analysis.vision
+        monkeypatch.setattr(analysis.vision, "_vision_latency", {})
+
+    def run_analysis(self, monkeypatch, provider, chart, started_at=None):
+        monkeypatch.setattr(settings, "AI_PROVIDER", provider)
+        monkeypatch.setattr(settings, f"{provider.upper()}_API_KEY", "test-key")
+        monkeypatch.setattr(settings, "ANALYSIS_CACHE_ENABLED", False)
+        payload = TradingViewPayload(**load_sample_payload())
+
+        async def run(base_url):
+            monkeypatch.setattr(settings, f"{provider.upper()}_BASE_URL", base_url)
+            try:
+                await analyze_with_ai(payload, chart, started_at=started_at)
+            finally:
+                await close_provider_clients()
+
+        with StubAIServer() as server:
+            asyncio.run(run(server.url))
+            return server.requests[0][1]["messages"][-1]["content"]
+
+    def test_anthropic_gets_resized_image_before_text(self, monkeypatch):
+        monkeypatch.setattr(settings, "AI_VISION_MAX_TOKENS", 1000)
+        metrics.reset()
+
+        content = self.run_analysis(monkeypatch, "anthropic", chart_frame())
+
+        image, text = content
+        assert image["type"] == "image" and image["source"]["media_type"] == "image/jpeg"
+        with Image.open(BytesIO(base64.b64decode(image["source"]["data"]))) as sent:
+            assert sent.width * sent.height <= 1000 * 750
+        assert "attached chart screenshot" in text["text"]
+        assert metrics.counters["ai.vision.images_sent"] == 1
+        assert metrics.counters["ai.anthropic.image_tokens"] <= 1000
+        assert metrics.summary("ai.anthropic.vision_request_ms")["count"] == 1
+
+    def test_near_duplicate_chart_is_still_shown_to_the_model(self, monkeypatch):
+        # Provider requests are stateless: consecutive bars each need the chart attached
+        metrics.reset()
+        chart = chart_frame(800, 450)
+
+        first = self.run_analysis(monkeypatch, "anthropic", chart)
+        second = self.run_analysis(monkeypatch, "anthropic", encode_frame(chart.data, quality=50))
+
+        assert [block["type"] for block in first] == ["image", "text"]
+        assert [block["type"] for block in second] == ["image", "text"]
+        assert "attached chart screenshot" in second[1]["text"]
+        assert metrics.counters["ai.vision.images_sent"] == 2
+
+    def test_openai_compatible_provider_gets_data_url(self, monkeypatch):
+        monkeypatch.setattr(settings, "AI_VISION_PROVIDERS", "anthropic,deepseek")
+
+        content = self.run_analysis(monkeypatch, "deepseek", chart_frame(800, 450))
+
+        assert content[0]["image_url"]["url"].startswith("data:image/jpeg;base64,")
+        assert content[1]["type"] == "text"
+
+    def test_text_only_provider_gets_no_image(self, monkeypatch):
+        monkeypatch.setattr(settings, "AI_VISION_PROVIDERS", "anthropic")
+
+        content = self.run_analysis(monkeypatch, "deepseek", chart_frame(800, 450))
+
+        assert isinstance(content, str)
+        assert "attached chart" not in content
+
+    def test_image_dropped_when_latency_budget_is_spent(self, monkeypatch):
+        monkeypatch.setattr(settings, "AI_LATENCY_BUDGET", 5.0)
+        metrics.reset()
+        record_vision_latency("anthropic", 4000)
+
+        content = self.run_analysis(monkeypatch, "anthropic", chart_frame(800, 450),
+                                    started_at=time.perf_counter() - 2.0)
+
+        assert [block["type"] for block in content] == ["text"]
+        assert metrics.counters["ai.vision.images_dropped"] == 1
+
+    def test_slow_outlier_ages_out_of_the_estimate(self, monkeypatch):
+        monkeypatch.setattr(settings, "AI_LATENCY_BUDGET", 5.0)
+        monkeypatch.setattr(settings, "AI_VISION_LATENCY_WINDOW", 0.2)
+        metrics.reset()
+        record_vision_latency("anthropic", 30000)  # one stalled request
+
+        time.sleep(0.3)
+        content = self.run_analysis(monkeypatch, "anthropic", chart_frame(800, 450),
+                                    started_at=time.perf_counter())
+
+        assert [block["type"] for block in content] == ["image", "text"]
+        assert "ai.vision.images_dropped" not in metrics.counters
+        assert expected_vision_seconds("anthropic") < 5.0  # the fresh sample replaced it
+
+class TestStreaming:
+    def test_sections_reported_once_complete(self):
+        for size in (1, 3, 7, len(STREAMED_ANALYSIS)):
+            seen = []
+            stream = SectionStream(seen.append)
+            for i in range(0, len(STREAMED_ANALYSIS), size):
+                stream.feed(STREAMED_ANALYSIS[i:i + size])
+
+            assert stream.text == STREAMED_ANALYSIS
+            assert len(seen) == 2
+            assert seen[0].endswith("(BSL x3)")
+            assert seen[1].endswith("Stop: 17828.0")
+
+    @pytest.mark.parametrize("provider", ["deepseek", "anthropic"])
+    def test_provider_stream_reports_sections(self, provider, monkeypatch):
+        monkeypatch.setattr(settings, "AI_PROVIDER", provider)
+        monkeypatch.setattr(settings, "DEEPSEEK_API_KEY", "test-key")
+        monkeypatch.setattr(settings, "ANTHROPIC_API_KEY", "test-key")
+        monkeypatch.setattr(settings, "ANALYSIS_CACHE_ENABLED", False)
+        payload = TradingViewPayload(**load_sample_payload())
+        seen = []
+
+        async def run(base_url):
+            monkeypatch.setattr(settings, "DEEPSEEK_BASE_URL", base_url)
+            monkeypatch.setattr(settings, "ANTHROPIC_BASE_URL", base_url)
+            try:
+                return await analyze_with_ai(payload, on_section=seen.append)
+            finally:
+                await close_provider_clients()
+
+        with StubAIServer(text=STREAMED_ANALYSIS, chunk_size=5) as server:
+            result = asyncio.run(run(server.url))
+            assert server.requests[0][1]["stream"] is True
+
+        assert result == STREAMED_ANALYSIS
+        assert [s.splitlines()[-1] for s in seen] == ["**DOL Target:** 17920.5 (BSL x3)", "- Stop: 17828.0"]
+
+    def test_pipeline_delivers_bias_before_stream_ends(self, monkeypatch):
+        import delivery.progressive
+
+        monkeypatch.setattr(settings, "AI_PROVIDER", "deepseek")
+        monkeypatch.setattr(settings, "DEEPSEEK_API_KEY", "test-key")
+        monkeypatch.setattr(settings, "ANALYSIS_CACHE_ENABLED", False)
+        monkeypatch.setattr(settings, "AI_STREAMING", True)
+        monkeypatch.setattr(settings, "DELIVERY_METHOD", "discord")
+        monkeypatch.setattr(settings, "DISCORD_WEBHOOK_URL", "https://discord.test/webhook")
+        metrics.reset()
+
+        events = []
+
+        class FakeLiveMessage:
+            def __init__(self, payload, webhook_url=None):
+                pass
+
+            async def update(self, analysis):
+                events.append(("update", analysis))
+
+            async def finalize(self, analysis, chart=None):
+                events.append(("final", analysis))
+
+        monkeypatch.setattr(delivery.progressive, "DiscordLiveMessage", FakeLiveMessage)
+        payload_data = load_sample_payload()
+        payload_data["narr"]["score"] = 76  # own flight key, apart from other tests' payloads
+        payload = TradingViewPayload(**payload_data)
+
+        async def run(base_url):
+            monkeypatch.setattr(settings, "DEEPSEEK_BASE_URL", base_url)
+            try:
+                await run_analysis_pipeline(payload)
+            finally:
+                await close_provider_clients()
+
+        with StubAIServer(text=STREAMED_ANALYSIS, chunk_size=8, chunk_delay=0.02) as server:
+            asyncio.run(run(server.url))
+
+        assert events[0][0] == "update"
+        assert events[0][1].startswith("### 📊 DIRECTIONAL BIAS")
+        assert "NARRATIVE" not in events[0][1]
+        assert events[-1] == ("final", STREAMED_ANALYSIS)
+        first_section = metrics.summary("pipeline.time_to_first_section_ms")["p50"]
+        assert first_section < metrics.summary("pipeline.total_ms")["p50"]
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
@@ -0,0 +1,438 @@
+"""
+Tests for Discord / Telegram delivery against a local stub of both APIs.
+Run with: pytest tests/test_delivery.py -v
+"""
+import pytest
+import json
+import time
+import random
+import socket
+import asyncio
+from pathlib import Path
+
+# Add parent to path for imports
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import screenshot.dedup
+from screenshot.dedup import bar_key
+from config import settings
+from webhook.models import TradingViewPayload
+from delivery.discord_bot import send_discord_alert
+from delivery.telegram_bot import send_telegram_alert
+from delivery.transport import close_delivery_transport
+from delivery.fanout import deliver_alert
+from delivery.ratelimit import TokenBucket, trigger_priority
+from delivery.telegram_format import telegram_text, markdown_to_entities, validate_entities, utf16_len
+from analysis.rules import evaluate_rules, render_rule_analysis
+from tests.stubs import STUB_ANALYSIS
+from screenshot.frame import ChartFrame
+from utils.metrics import metrics
+from tests.stubs import StubDeliveryServer
+
+
+def load_sample_payload():
+    """Load the sample payload from JSON file."""
+    sample_path = Path(__file__).parent / "sample_payload.json"
+    with open(sample_path) as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def stub(monkeypatch):
+    """Both channels pointed at a local stub, with a fresh chart history."""
+    monkeypatch.setattr(screenshot.dedup, "_history", None)
+    with StubDeliveryServer() as server:
+        monkeypatch.setattr(settings, "DISCORD_WEBHOOK_URL", server.webhook_url)
+        monkeypatch.setattr(settings, "TELEGRAM_API_URL", server.url)
+        monkeypatch.setattr(settings, "TELEGRAM_BOT_TOKEN", "123:abc")
+        monkeypatch.setattr(settings, "TELEGRAM_CHAT_ID", "42")
+        yield server
+
+
+def deliver(payload, charts):
+    async def run():
+        for chart in charts:
+            await send_discord_alert(payload, "analysis", chart)
+            await send_telegram_alert(payload, "analysis", chart)
+        await close_delivery_transport()
+    asyncio.run(run())
+
+
+class TestTransport:
+    def test_alerts_reuse_one_connection(self, stub):
+        metrics.reset()
+        payload = TradingViewPayload(**load_sample_payload())
+
+        deliver(payload, [None, None, None])
+
+        assert len(stub.requests) == 6
+        assert len(stub.connections) == 1
+        for channel in ("discord", "telegram"):
+            assert metrics.summary(f"delivery.{channel}.total_ms")["count"] == 3
+            assert metrics.summary(f"delivery.{channel}.ttfb_ms")["count"] == 3
+        # Only the very first request paid for a connection
+        connects = list(metrics.timings["delivery.discord.connect_ms"]) + list(metrics.timings["delivery.telegram.connect_ms"])
+        assert sum(1 for ms in connects if ms > 0) == 1
+
+
+def refused_url() -> str:
+    """A local URL nothing listens on."""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}/webhook"
+
+
+def fan_out(payload) -> float:
+    async def run():
+        started = time.perf_counter()
+        await deliver_alert(payload, "analysis")
+        elapsed = time.perf_counter() - started
+        await close_delivery_transport()
+        return elapsed
+    return asyncio.run(run())
+
+
+class TestFanOut:
+    def test_destinations_are_sent_to_concurrently(self, stub, monkeypatch):
+        metrics.reset()
+        monkeypatch.setattr(settings, "DELIVERY_METHOD", "both")
+        monkeypatch.setattr(settings, "DISCORD_BATCH_WINDOW", 0)
+        monkeypatch.setattr(settings, "TELEGRAM_CHAT_IDS", "43")
+        with StubDeliveryServer(delay=0.3) as slow, StubDeliveryServer(delay=0.3) as slower:
+            monkeypatch.setattr(settings, "DISCORD_WEBHOOK_URLS", f"{slow.webhook_url},{slower.webhook_url},{refused_url()}")
+            elapsed = fan_out(TradingViewPayload(**load_sample_payload()))
+
+            assert len(slow.requests) == len(slower.requests) == 1
+        chats = sorted(fields["chat_id"] for _, path, fields in stub.requests if path.endswith("/sendMessage"))
+        assert chats == ["42", "43"]
+        assert elapsed < 0.55  # the slowest destination, not the sum of them
+        assert metrics.counters["delivery.discord.errors"] == 1
+
+    def test_slow_destination_is_cut_off(self, stub, monkeypatch):
+        metrics.reset()
+        monkeypatch.setattr(settings, "DELIVERY_METHOD", "both")
+        monkeypatch.setattr(settings, "DISCORD_BATCH_WINDOW", 0)
+        monkeypatch.setattr(settings, "DELIVERY_DESTINATION_TIMEOUT", 0.2)
+        with StubDeliveryServer(delay=1.0) as hung:
+            monkeypatch.setattr(settings, "DISCORD_WEBHOOK_URLS", hung.webhook_url)
+            elapsed = fan_out(TradingViewPayload(**load_sample_payload()))
+
+        assert elapsed < 0.8
+        assert sorted(path.split("/")[-1] for _, path, _ in stub.requests) == ["sendMessage", "webhook?wait=true"]
+        assert metrics.counters["delivery.discord.timeouts"] == 1
+
+
+    def test_rejected_sends_are_counted_as_failed(self, stub, monkeypatch):
+        metrics.reset()
+        monkeypatch.setattr(settings, "DELIVERY_METHOD", "both")
+        monkeypatch.setattr(settings, "DISCORD_BATCH_WINDOW", 0)
+        chart = ChartFrame(b"chart", "jpeg", 1600, 900, dhash=7)
+        with StubDeliveryServer(rejected=400) as rejecting:
+            monkeypatch.setattr(settings, "DISCORD_WEBHOOK_URL", rejecting.webhook_url)
+            monkeypatch.setattr(settings, "TELEGRAM_API_URL", rejecting.url)
+
+            async def run():
+                await deliver_alert(TradingViewPayload(**load_sample_payload()), "analysis", chart)
+                await close_delivery_transport()
+
+            asyncio.run(run())
+            paths = sorted(path.split("/")[-1] for _, path, _ in rejecting.requests)
+
+        # A refused photo doesn't stop the analysis text from being tried
+        assert paths == ["sendMessage", "sendPhoto", "webhook?wait=true"]
+        assert metrics.counters["delivery.discord.errors"] == 1
+        assert metrics.counters["delivery.telegram.errors"] == 1
+
+    def test_refused_photo_fails_the_telegram_send(self, monkeypatch):
+        metrics.reset()
+        monkeypatch.setattr(settings, "DELIVERY_METHOD", "telegram")
+        monkeypatch.setattr(settings, "TELEGRAM_BOT_TOKEN", "123:abc")
+        monkeypatch.setattr(settings, "TELEGRAM_CHAT_ID", "42")
+        chart = ChartFrame(b"chart", "jpeg", 1600, 900, dhash=7)
+        with StubDeliveryServer(rejected=400, rejected_path="/sendPhoto") as server:
+            monkeypatch.setattr(settings, "TELEGRAM_API_URL", server.url)
+
+            async def run():
+                await deliver_alert(TradingViewPayload(**load_sample_payload()), "analysis", chart)
+                await close_delivery_transport()
+
+            asyncio.run(run())
+            paths = [path.split("/")[-1] for _, path, _ in server.requests]
+
+        assert paths == ["sendPhoto", "sendMessage"]
+        assert metrics.counters["delivery.telegram.errors"] == 1
+
+
+class TestRateLimits:
+    def test_burst_load_never_exceeds_the_limit(self):
+        async def run():
+            bucket = TokenBucket(limit=5, period=0.25, burst=2)
+            sent = []
+
+            async def send():
+                await bucket.acquire()
+                sent.append(time.monotonic())
+
+            await asyncio.gather(*[send() for _ in range(12)])
+            return sent
+
+        sent = asyncio.run(run())
+        assert len(sent) == 12
+        # No window of one period ever holds more than `limit` sends
+        assert max(sum(1 for t in sent if start <= t < start + 0.25) for start in sent) <= 5
+
+    def test_throttled_sends_go_out_by_trigger_priority(self):
+        async def run():
+            bucket = TokenBucket(limit=2, period=0.1, burst=1)
+            await bucket.acquire()  # bucket now empty
+            order = []
+
+            async def send(trigger):
+                await bucket.acquire(trigger_priority(trigger))
+                order.append(trigger)
+
+            await asyncio.gather(send("PRE_MARKET_0915"), send("KZ_OPEN_NY_AM"), send("SETUP_FORMING"))
+            return order
+
+        assert asyncio.run(run()) == ["SETUP_FORMING", "KZ_OPEN_NY_AM", "PRE_MARKET_0915"]
+
+    def test_burst_behind_rate_limits_loses_no_alert(self, stub, monkeypatch):
+        # Queue waits and 429 pauses are far longer than one attempt's timeout
+        metrics.reset()
+        monkeypatch.setattr(settings, "DISCORD_BATCH_WINDOW", 0)
+        monkeypatch.setattr(settings, "DISCORD_RATE_PER_MINUTE", 600)  # 10/s
+        monkeypatch.setattr(settings, "DISCORD_BURST", 2)
+        monkeypatch.setattr(settings, "DELIVERY_DESTINATION_TIMEOUT", 0.3)
+        stub._server.rate_limited = 1
+        stub._server.retry_after = 0.5
+        payloads = [symbol_payload(f"SYM{n}") for n in range(10)]
+
+        async def run():
+            started = time.perf_counter()
+            await asyncio.gather(*[deliver_alert(p, "analysis") for p in payloads])
+            elapsed = time.perf_counter() - started
+            await close_delivery_transport()
+            return elapsed
+
+        elapsed = asyncio.run(run())
+        delivered = {f["embeds"][0]["title"] for _, _, f in stub.requests[1:]}  # after the 429'd one
+        assert len(delivered) == 10
+        assert elapsed > 0.5
+        assert "delivery.discord.timeouts" not in metrics.counters
+        assert "delivery.discord.errors" not in metrics.counters
+
+    def test_429_is_retried_after_retry_after(self, monkeypatch):
+        metrics.reset()
+        monkeypatch.setattr(screenshot.dedup, "_history", None)
+        payload = TradingViewPayload(**load_sample_payload())
+        chart = ChartFrame(b"chart", "jpeg", 1600, 900, dhash=7)
+        with StubDeliveryServer(rate_limited=1, retry_after=0.2) as server:
+            monkeypatch.setattr(settings, "DISCORD_WEBHOOK_URL", server.webhook_url)
+            started = time.perf_counter()
+            deliver(payload, [chart])
+            elapsed = time.perf_counter() - started
+
+        discord = [fields for _, path, fields in server.requests if path.startswith("/webhook")]
+        assert len(discord) == 2
+        assert discord[1]["file"] == ("chart.jpg", b"chart")  # the upload is rebuilt for the retry
+        assert elapsed >= 0.2
+        assert metrics.counters["delivery.discord.rate_limited"] == 1
+
+
+def burst(payloads, charts=None):
+    """Fire alerts at the same moment, as several symbols do at a kill-zone open."""
+    charts = charts or [None] * len(payloads)
+
+    async def run():
+        await asyncio.gather(*[
+            send_discord_alert(payload, "analysis", chart) for payload, chart in zip(payloads, charts)
+        ])
+        await close_delivery_transport()
+    asyncio.run(run())
+
+
+def symbol_payload(sym: str) -> TradingViewPayload:
+    data = load_sample_payload()
+    data["sym"] = sym
+    return TradingViewPayload(**data)
+
+
+class TestDiscordBatching:
+    def test_simultaneous_alerts_share_one_message(self, stub):
+        metrics.reset()
+        payloads = [symbol_payload(sym) for sym in ("MNQ1!", "MES1!", "M2K1!")]
+        charts = [ChartFrame(b"mnq", "jpeg", 1600, 900, dhash=0xF0F0),
+                  None,
+                  ChartFrame(b"m2k", "jpeg", 1600, 900, dhash=0x0F0F_FFFF)]
+
+        burst(payloads, charts)
+
+        assert len(stub.requests) == 1
+        fields = stub.requests[0][2]
+        embeds = json.loads(fields["payload_json"])["embeds"]
+        assert [e["title"].rsplit(" ", 1)[1] for e in embeds] == ["MNQ1!", "MES1!", "M2K1!"]
+        assert embeds[0]["image"]["url"] == "attachment://chart.jpg"
+        assert "image" not in embeds[1]
+        assert embeds[2]["image"]["url"] == "attachment://chart-1.jpg"
+        assert fields["file"] == ("chart.jpg", b"mnq") and fields["file1"] == ("chart-1.jpg", b"m2k")
+        # Each chart's CDN URL is remembered for its own layout
+        history = screenshot.dedup.get_chart_history()
+        bar = bar_key(payloads[2].ts, payloads[2].px)
+        assert history.match("M2K1!|5", charts[2], bar).discord_url.endswith("/chart-1.jpg")
+
+    def test_batches_respect_embed_count_and_length(self, stub, monkeypatch):
+        monkeypatch.setattr(settings, "DISCORD_BATCH_MAX_EMBEDS", 10)
+        burst([symbol_payload(f"SYM{n}") for n in range(12)])
+        assert [len(f["embeds"]) for _, _, f in stub.requests] == [10, 2]
+
+        stub.requests.clear()
+        long_analysis = "x" * 2500  # 1990 characters after truncation, plus fields
+        payloads = [symbol_payload(f"SYM{n}") for n in range(3)]
+
+        async def run():
+            await asyncio.gather(*[send_discord_alert(p, long_analysis) for p in payloads])
+            await close_delivery_transport()
+        asyncio.run(run())
+
+        sizes = sorted(len(f["embeds"]) for _, _, f in stub.requests)
+        assert sizes == [1, 2]
+
+
+def recorded_analyses():
+    """Analyses in the shapes the pipeline produces: LLM output and rule-rendered breakdowns."""
+    analyses = [
+        STUB_ANALYSIS,
+        "### 📊 DIRECTIONAL BIAS: BULLISH\n**DOL Target:** 17920.5 (BSL x3)\n\n"
+        "### 🎯 TRADE SETUP\n- Entry: 17845.25 (FVG)\n- Stop: 17828.0\n\n"
+        "### 🧠 NARRATIVE\nAsia low swept into London, MSS confirmed. Watch `PDH` and *displacement*.\n",
+    ]
+    for score, mss in [(42, "BULL"), (80, "NONE"), (90, "BULL")]:
+        data = load_sample_payload()
+        data["narr"]["score"] = score
+        data["struct"]["mss"] = mss
+        payload = TradingViewPayload(**data)
+        analyses.append(render_rule_analysis(payload, evaluate_rules(payload)))
+    return analyses
+
+
+# What breaks Telegram's Markdown parser: stray markers, underscores in names, brackets, astral emoji
+NOISE = ["**", "*", "_", "__", "`", "### ", "[", "]", "(", "🚀", "📈", "\n", " ", "KZ_OPEN_NY_AM", "\\"]
+
+
+def mutate(text: str, rng: random.Random) -> str:
+    chars = list(text)
+    for _ in range(rng.randint(0, 12)):
+        chars.insert(rng.randint(0, len(chars)), rng.choice(NOISE))
+    return "".join(chars)
+
+
+class TestTelegramFormat:
+    def test_headings_and_bold_become_entities(self):
+        text, entities = markdown_to_entities("### 📊 BIAS: BULLISH\n**DOL Target:** 17920.5 `PDH`")
+        assert text == "📊 BIAS: BULLISH\nDOL Target: 17920.5 PDH"
+        heading = utf16_len("📊 BIAS: BULLISH")  # the emoji is two UTF-16 units
+        assert entities == [
+            {"type": "bold", "offset": 0, "length": heading},
+            {"type": "bold", "offset": heading + 1, "length": len("DOL Target:")},
+            {"type": "code", "offset": heading + 1 + len("DOL Target: 17920.5 "), "length": 3},
+        ]
+
+    def test_unmatched_markers_stay_text(self):
+        text, entities = markdown_to_entities("KZ_OPEN_NY_AM ** swept 2 * 3 `open")
+        assert text == "KZ_OPEN_NY_AM ** swept 2 * 3 `open"
+        assert entities == []
+
+    def test_truncation_clips_entities(self):
+        text, entities = telegram_text("**" + "x" * 50 + "**", limit=10)
+        assert text == "x" * 10
+        assert entities == [{"type": "bold", "offset": 0, "length": 10}]
+
+    def test_fuzzed_analyses_never_fall_back(self):
+        metrics.reset()
+        rng = random.Random(7)
+        analyses = [mutate(text, rng) for text in recorded_analyses() for _ in range(400)]
+
+        started = time.perf_counter()
+        converted = [telegram_text(text, limit=4090) for text in analyses]
+        elapsed = time.perf_counter() - started
+
+        assert all(validate_entities(text, entities) for text, entities in converted)
+        assert "delivery.telegram.entity_fallbacks" not in metrics.counters
+        assert elapsed / len(analyses) < 0.005  # well under a millisecond each in practice
+
+    def test_each_message_is_one_request(self, stub):
+        payload = TradingViewPayload(**load_sample_payload())
+        rng = random.Random(11)
+        analyses = [mutate(text, rng) for text in recorded_analyses()]
+
+        async def run():
+            for analysis in analyses:
+                await send_telegram_alert(payload, analysis)
+            await close_delivery_transport()
+        asyncio.run(run())
+
+        sent = [fields for _, path, fields in stub.requests if path.endswith("/sendMessage")]
+        assert len(sent) == len(analyses)
+        assert all("parse_mode" not in fields for fields in sent)
+        assert any(fields.get("entities") for fields in sent)
+
+
+class TestChartDedup:
+    def test_near_duplicate_chart_reuses_uploads(self, stub):
+        metrics.reset()
+        payload = TradingViewPayload(**load_sample_payload())
+        first = ChartFrame(b"chart-1", "jpeg", 1600, 900, dhash=0xF0F0_0000_FFFF_0F0F)
+        redrawn = ChartFrame(b"chart-2", "jpeg", 1600, 900, dhash=0xF0F0_0000_FFFF_0F0E)
+        new_swing = ChartFrame(b"chart-3", "jpeg", 1600, 900, dhash=0x0F0F_FFFF_0000_F0F0)
+
+        deliver(payload, [first, redrawn, new_swing])
+
+        discord = [fields for _, path, fields in stub.requests if path.startswith("/webhook")]
+        photos = [fields["photo"] for _, path, fields in stub.requests if path.endswith("/sendPhoto")]
+
+        assert discord[0]["file"] == ("chart.jpg", b"chart-1")
+        uploaded_url = json.loads(discord[0]["payload_json"])["embeds"][0]["image"]["url"]
+        assert uploaded_url == "attachment://chart.jpg"
+        # Second alert: plain JSON pointing at the first upload, no bytes
+        assert "file" not in discord[1]
+        assert discord[1]["embeds"][0]["image"]["url"].startswith("https://cdn.discord.test/1/")
+        assert discord[2]["file"] == ("chart.jpg", b"chart-3")
+
+        assert photos[0] == ("chart.jpg", b"chart-1")
+        assert photos[1].startswith("photo-")
+        assert photos[2] == ("chart.jpg", b"chart-3")
+        assert metrics.counters["screenshot.dedup.discord_reused"] == 1
+        assert metrics.counters["screenshot.dedup.telegram_reused"] == 1
+
+    def test_new_candle_forces_a_fresh_upload(self, stub):
+        data = load_sample_payload()
+        this_bar = TradingViewPayload(**data)
+        data["ts"] += 5 * 60 * 1000  # the next 5-minute bar
+        data["px"] += 3.25
+        next_bar = TradingViewPayload(**data)
+        # A new candle on a full-width chart barely moves the hash, if at all
+        chart = ChartFrame(b"chart-1", "jpeg", 1600, 900, dhash=0xF0F0_0000_FFFF_0F0F)
+        with_candle = ChartFrame(b"chart-2", "jpeg", 1600, 900, dhash=0xF0F0_0000_FFFF_0F0F)
+
+        deliver(this_bar, [chart])
+        deliver(next_bar, [with_candle])
+
+        discord = [fields for _, path, fields in stub.requests if path.startswith("/webhook")]
+        photos = [fields["photo"] for _, path, fields in stub.requests if path.endswith("/sendPhoto")]
+        assert [d["file"] for d in discord] == [("chart.jpg", b"chart-1"), ("chart.jpg", b"chart-2")]
+        assert photos == [("chart.jpg", b"chart-1"), ("chart.jpg", b"chart-2")]
+
+    def test_dedup_off_always_uploads(self, stub, monkeypatch):
+        monkeypatch.setattr(settings, "SCREENSHOT_DEDUP", False)
+        payload = TradingViewPayload(**load_sample_payload())
+        chart = ChartFrame(b"chart", "jpeg", 1600, 900, dhash=7)
+
+        deliver(payload, [chart, chart])
+
+        discord = [fields for _, path, fields in stub.requests if path.startswith("/webhook")]
+        assert all(fields["file"] == ("chart.jpg", b"chart") for fields in discord)
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
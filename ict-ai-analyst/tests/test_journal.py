@@ -0,0 +1,222 @@
+"""
+Tests for the durable job journal and restart replay.
+Run with: pytest tests/test_journal.py -v
+"""
+import pytest
+import asyncio
+import json
+import sqlite3
+from pathlib import Path
+
+# Add parent to path for imports
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import settings
+from jobs.journal import JobJournal, close_journal, journal_path
+from webhook.models import TradingViewPayload
+from webhook import receiver
+from utils.metrics import metrics
+from tests.stubs import StubDeliveryServer
+
+
+def load_sample_payload():
+    """Load the sample payload from JSON file."""
+    sample_path = Path(__file__).parent / "sample_payload.json"
+    with open(sample_path) as f:
+        return json.load(f)
+
+
+def sample_json() -> str:
+    return TradingViewPayload(**load_sample_payload()).model_dump_json()
+
+
+class TestJobJournal:
+    def test_unfinished_tracks_latest_stage(self, tmp_path):
+        journal = JobJournal(str(tmp_path / "journal.db"))
+
+        async def run():
+            delivered = await journal.record_received(sample_json())
+            analyzed = await journal.record_received(sample_json())
+            received = await journal.record_received(sample_json())
+            journal.record(delivered, "analyzed", analysis="done")
+            journal.record(delivered, "delivered")
+            await journal.record(analyzed, "analyzed", analysis="### 📊 DIRECTIONAL BIAS", wait=True)
+            return delivered, analyzed, received
+
+        delivered, analyzed, received = asyncio.run(run())
+        journal.close()
+
+        entries = journal.unfinished()
+        assert [e.job_id for e in entries] == [analyzed, received]
+        assert entries[0].stage == "analyzed"
+        assert entries[0].analysis == "### 📊 DIRECTIONAL BIAS"
+        assert entries[1].stage == "received"
+        assert entries[1].analysis is None
+        assert TradingViewPayload.model_validate_json(entries[1].payload).sym == "MNQ1!"
+
+    def test_stale_jobs_are_not_replayed(self, tmp_path):
+        journal = JobJournal(str(tmp_path / "journal.db"))
+        asyncio.run(journal.record_received(sample_json()))
+        journal.close()
+
+        assert len(journal.unfinished(max_age=60)) == 1
+        assert journal.unfinished(max_age=-1) == []
+
+    def test_compact_keeps_only_listed_jobs(self, tmp_path):
+        journal = JobJournal(str(tmp_path / "journal.db"))
+
+        async def run():
+            return [await journal.record_received(sample_json()) for _ in range(3)]
+
+        ids = asyncio.run(run())
+        journal.close()
+        journal.compact(keep=[ids[1]])
+        assert [e.job_id for e in journal.unfinished()] == [ids[1]]
+
+    def test_writer_prunes_finished_jobs(self, tmp_path):
+        metrics.reset()
+        path = str(tmp_path / "journal.db")
+        journal = JobJournal(path, compact_every=3, max_age=60)
+
+        async def run():
+            done = await journal.record_received(sample_json())
+            await journal.record(done, "delivered", wait=True)
+            pending = await journal.record_received(sample_json())  # third commit: prune runs
+            return pending
+
+        pending = asyncio.run(run())
+        journal.close()
+
+        with sqlite3.connect(path) as conn:
+            assert [row[0] for row in conn.execute("SELECT DISTINCT job_id FROM events")] == [pending]
+        assert metrics.counters["journal.compactions"] == 1
+
+    def test_writer_prunes_jobs_too_old_to_replay(self, tmp_path):
+        journal = JobJournal(str(tmp_path / "journal.db"), compact_every=1, max_age=-1)
+        asyncio.run(journal.record_received(sample_json()))
+        journal.close()
+        assert journal.unfinished() == []
+
+    def test_burst_is_group_committed(self, tmp_path):
+        metrics.reset()
+        journal = JobJournal(str(tmp_path / "journal.db"))
+
+        async def run():
+            await asyncio.gather(*[journal.record_received(sample_json()) for _ in range(200)])
+
+        asyncio.run(run())
+        journal.close()
+
+        assert len(journal.unfinished()) == 200
+        # Fewer transactions than writes: concurrent appends share commits
+        assert metrics.summary("journal.batch_size")["count"] < 200
+        assert metrics.summary("journal.append_ms")["count"] == 200
+
+    def test_checkpoints(self, tmp_path):
+        journal = JobJournal(str(tmp_path / "journal.db"))
+        assert journal.get_checkpoint("poller.last_alert_ts") is None
+        journal.set_checkpoint("poller.last_alert_ts", "2026-02-10T21:00:03.409Z")
+        journal.set_checkpoint("poller.last_alert_ts", "2026-02-11T09:30:00.000Z")
+        assert journal.get_checkpoint("poller.last_alert_ts") == "2026-02-11T09:30:00.000Z"
+
+    def test_path_does_not_depend_on_working_directory(self, tmp_path, monkeypatch):
+        app_dir = Path(__file__).resolve().parent.parent
+        monkeypatch.setattr(settings, "JOURNAL_PATH", "data/journal.db")
+        monkeypatch.chdir(tmp_path)
+        assert journal_path() == app_dir / "data" / "journal.db"
+
+        monkeypatch.setattr(settings, "JOURNAL_PATH", str(tmp_path / "journal.db"))
+        assert journal_path() == tmp_path / "journal.db"
+
+
+class TestReplay:
+    def test_unfinished_jobs_are_requeued_after_restart(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(settings, "JOURNAL_PATH", str(tmp_path / "journal.db"))
+        close_journal()
+        journal = receiver.get_journal()
+
+        async def before_restart():
+            job_id = await journal.record_received(sample_json())
+            await journal.record(job_id, "analyzed", analysis="cached analysis", wait=True)
+            return job_id
+
+        job_id = asyncio.run(before_restart())
+        close_journal()
+
+        handled = []
+
+        async def fake_process(job):
+            handled.append(job)
+
+        async def after_restart():
+            monkeypatch.setattr(receiver.pipeline_queue, "handler", fake_process)
+            assert receiver.replay_unfinished_jobs() == 1
+            await receiver.pipeline_queue.start()
+            await receiver.pipeline_queue.join()
+            await receiver.pipeline_queue.stop()
+
+        asyncio.run(after_restart())
+        close_journal()
+
+        assert len(handled) == 1
+        assert handled[0].job_id == job_id
+        assert handled[0].analysis == "cached analysis"
+        assert handled[0].payload.trigger == "SETUP_FORMING"
+
+
+class TestDeliveryOutcome:
+    def stages(self, path, job_id):
+        with sqlite3.connect(path) as conn:
+            return [row[0] for row in conn.execute("SELECT stage FROM events WHERE job_id = ? ORDER BY seq", (job_id,))]
+
+    @pytest.mark.parametrize("rejected,stage", [(400, "failed"), (0, "delivered")])
+    def test_alert_nobody_received_is_not_delivered(self, rejected, stage, tmp_path, monkeypatch):
+        from analysis.engine import run_analysis_pipeline
+        from delivery.transport import close_delivery_transport
+
+        path = str(tmp_path / "journal.db")
+        monkeypatch.setattr(settings, "JOURNAL_PATH", path)
+        monkeypatch.setattr(settings, "DELIVERY_METHOD", "both")
+        monkeypatch.setattr(settings, "DISCORD_BATCH_WINDOW", 0)
+        monkeypatch.setattr(settings, "TELEGRAM_BOT_TOKEN", "123:abc")
+        monkeypatch.setattr(settings, "TELEGRAM_CHAT_ID", "42")
+        monkeypatch.setattr(settings, "AI_STREAMING", False)
+        close_journal()
+        data = load_sample_payload()
+        data["narr"]["score"] = 72 if rejected else 71  # own flight key, apart from other tests' payloads
+        payload = TradingViewPayload(**data)
+
+        async def run():
+            job_id = await receiver.get_journal().record_received(payload.model_dump_json())
+            # Replayed after analysis, so no provider is called
+            await run_analysis_pipeline(payload, job_id=job_id, analysis="cached analysis")
+            await close_delivery_transport()
+            return job_id
+
+        with StubDeliveryServer(rejected=rejected) as server:
+            monkeypatch.setattr(settings, "DISCORD_WEBHOOK_URL", server.webhook_url)
+            monkeypatch.setattr(settings, "TELEGRAM_API_URL", server.url)
+            job_id = asyncio.run(run())
+        close_journal()
+
+        assert self.stages(path, job_id) == ["received", stage]
+
+
+class TestPollerCheckpoint:
+    def test_legacy_file_is_migrated(self, tmp_path, monkeypatch):
+        import poller
+
+        legacy = tmp_path / ".last-alert-ts"
+        legacy.write_text("2026-02-10T21:00:03.409Z\n")
+        monkeypatch.setattr(poller, "LAST_SEEN_FILE", legacy)
+        monkeypatch.setattr(poller, "journal", JobJournal(str(tmp_path / "journal.db")))
+
+        assert poller.get_last_seen() == "2026-02-10T21:00:03.409Z"
+        poller.set_last_seen("2026-02-11T09:30:00.000Z")
+        assert poller.get_last_seen() == "2026-02-11T09:30:00.000Z"
+        assert poller.journal.get_checkpoint(poller.LAST_SEEN_CHECKPOINT) == "2026-02-11T09:30:00.000Z"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
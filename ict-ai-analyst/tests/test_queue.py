@@ -0,0 +1,122 @@
+"""
+Tests for the pipeline job queue.
+Run with: pytest tests/test_queue.py -v
+"""
+import pytest
+import asyncio
+import json
+from pathlib import Path
+
+# Add parent to path for imports
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from fastapi.testclient import TestClient
+from main import app
+from jobs.queue import PipelineQueue, QueueFull
+from webhook.receiver import pipeline_queue
+from utils.metrics import metrics
+
+
+def load_sample_payload():
+    """Load the sample payload from JSON file."""
+    sample_path = Path(__file__).parent / "sample_payload.json"
+    with open(sample_path) as f:
+        return json.load(f)
+
+
+class TestPipelineQueue:
+    def test_burst_runs_at_bounded_concurrency(self):
+        metrics.reset()
+        running = 0
+        peak = 0
+        done = []
+
+        async def handler(item):
+            nonlocal running, peak
+            running += 1
+            peak = max(peak, running)
+            await asyncio.sleep(0.001)
+            running -= 1
+            done.append(item)
+
+        async def run():
+            queue = PipelineQueue(handler, workers=4, max_depth=500, name="test")
+            await queue.start()
+            for i in range(200):
+                queue.submit(f"SYM{i % 10}", i)
+            await queue.join()
+            await queue.stop()
+
+        asyncio.run(run())
+        assert sorted(done) == list(range(200))
+        assert peak == 4
+        assert metrics.summary("test.wait_ms")["count"] == 200
+        assert metrics.summary("test.service_ms")["count"] == 200
+        assert metrics.gauges["test.queue_depth"] == 0
+
+    def test_same_key_runs_in_order_one_at_a_time(self):
+        seen = {"A": [], "B": []}
+        active = set()
+
+        async def handler(item):
+            key, n = item
+            assert key not in active, "two jobs for one key ran concurrently"
+            active.add(key)
+            await asyncio.sleep(0.001)
+            seen[key].append(n)
+            active.discard(key)
+
+        async def run():
+            queue = PipelineQueue(handler, workers=8, max_depth=100)
+            await queue.start()
+            for n in range(20):
+                queue.submit("A", ("A", n))
+                queue.submit("B", ("B", n))
+            await queue.join()
+            await queue.stop()
+
+        asyncio.run(run())
+        assert seen["A"] == list(range(20))
+        assert seen["B"] == list(range(20))
+
+    def test_submit_rejects_past_max_depth(self):
+        async def handler(item):
+            pass
+
+        queue = PipelineQueue(handler, workers=1, max_depth=3)
+        for i in range(3):
+            queue.submit("MNQ1!", i)
+        with pytest.raises(QueueFull):
+            queue.submit("MNQ1!", 3)
+        assert queue.depth == 3
+
+    def test_jobs_submitted_before_start_are_processed(self):
+        done = []
+
+        async def handler(item):
+            done.append(item)
+
+        async def run():
+            queue = PipelineQueue(handler, workers=2, max_depth=10)
+            queue.submit("MNQ1!", 1)
+            queue.submit("MES1!", 2)
+            await queue.start()
+            await queue.join()
+            await queue.stop()
+
+        asyncio.run(run())
+        assert sorted(done) == [1, 2]
+
+
+class TestWebhookBackpressure:
+    def test_webhook_returns_503_when_queue_full(self, monkeypatch):
+        monkeypatch.setattr(pipeline_queue, "max_depth", 0)
+        client = TestClient(app)
+        response = client.post("/webhook", json=load_sample_payload())
+        assert response.status_code == 503
+        assert response.headers["retry-after"] == "5"
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -0,0 +1,842 @@
+"""
+Tests for the warm chart page pool, render-readiness probe, in-memory frame
+encoding, chart dedup, worker processes, saved login session and speculative pre-capture.
+Run with: pytest tests/test_screenshot.py -v
+"""
+import pytest
+import time
+import httpx
+import random
+import socket
+import asyncio
+from aiohttp import web
+from io import BytesIO
+from pathlib import Path
+from PIL import Image, ImageDraw
+
+# Add parent to path for imports
+import sys
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from config import settings
+from screenshot.pool import PagePool
+from screenshot.capture import TradingViewScreenshot, chart_layout, layout_url
+from screenshot.readiness import CANVAS_PROBE, wait_for_chart_ready
+from screenshot.frame import ChartFrame, encode_frame, archive_frame, hamming
+from screenshot.dedup import ChartHistory
+from screenshot.service import build_app
+from screenshot.workers import WorkerSupervisor, WorkerUnavailable
+from screenshot.session import SessionStore, session_is_valid
+from screenshot.precapture import PreCapture, next_trigger, MARKET_TZ
+from datetime import datetime, timedelta
+from utils.metrics import metrics
+
+
+def chart_png(width: int = 1920, height: int = 1080, seed: int = 1) -> bytes:
+    """A chart-like PNG the size of a viewport screenshot: dark noisy background, a random-walk of candles."""
+    rng = random.Random(seed)
+    noise = Image.effect_noise((width, height), 12).point(lambda v: v // 6)
+    image = Image.merge("RGB", [noise] * 3)
+    draw = ImageDraw.Draw(image)
+    price = height / 2
+    for x in range(0, width, 12):
+        move = rng.uniform(-40, 40)
+        top, bottom = sorted((price, price + move))
+        draw.rectangle((x, top - 10, x + 7, bottom + 10), fill=(38, 166, 154) if move < 0 else (239, 83, 80))
+        price = min(height - 60, max(60, price + move))
+    out = BytesIO()
+    image.save(out, "PNG")
+    return out.getvalue()
+
+
+CHART_PNG = chart_png()
+
+
+class FakePage:
+    """Stands in for a Playwright page: records calls, no browser needed."""
+
+    def __init__(self, url: str = "", frames=None, pane=None):
+        self.url = url
+        self.pane = pane  # bounding box of the price pane, None when it isn't found
+        self.closed = False
+        self.healthy = True
+        self.calls = []
+        # Successive canvas probe results; the last one repeats once the chart settles
+        self.frames = list(frames or [{"canvases": 3, "checksum": 1, "overlay": True}])
+
+    def is_closed(self) -> bool:
+        return self.closed
+
+    async def evaluate(self, script, arg=None):
+        if not self.healthy:
+            raise RuntimeError("Target crashed")
+        if script == CANVAS_PROBE:
+            self.calls.append("probe")
+            return self.frames.pop(0) if len(self.frames) > 1 else self.frames[0]
+        self.calls.append("evaluate")
+        return True
+
+    async def screenshot(self, path=None, full_page=False, clip=None, **options):
+        self.calls.append("screenshot")
+        self.clip = clip
+        return chart_png(int(clip["width"]), int(clip["height"])) if clip else CHART_PNG
+
+    async def query_selector(self, selector):
+        return None
+
+    def locator(self, selector):
+        page = self
+
+        class Locator:
+            first = None
+
+            async def bounding_box(self, timeout=None):
+                return page.pane
+
+        locator = Locator()
+        locator.first = locator
+        return locator
+
+    async def close(self):
+        self.closed = True
+
+
+def make_pool(**kwargs):
+    opened = []
+
+    async def open_page(layout):
+        await asyncio.sleep(0.01)  # a real load takes seconds
+        page = FakePage(layout)
+        opened.append(page)
+        return page
+
+    return PagePool(open_page, health_interval=0, **kwargs), opened
+
+
+class TestPagePool:
+    def test_pages_are_reused(self):
+        pool, opened = make_pool()
+
+        async def run():
+            for _ in range(3):
+                async with pool.page("MNQ1!|5") as page:
+                    await page.screenshot(path="/dev/null")
+
+        asyncio.run(run())
+        assert len(opened) == 1
+        assert opened[0].calls == ["screenshot"] * 3
+
+    def test_concurrent_first_use_opens_once(self):
+        pool, opened = make_pool()
+
+        async def capture():
+            async with pool.page("MNQ1!|5"):
+                await asyncio.sleep(0.01)
+
+        async def run():
+            await asyncio.gather(*[capture() for _ in range(5)])
+
+        asyncio.run(run())
+        assert len(opened) == 1
+
+    def test_recycled_after_max_captures(self):
+        metrics.reset()
+        pool, opened = make_pool(max_captures=2)
+
+        async def run():
+            for _ in range(2):
+                async with pool.page("MNQ1!|5"):
+                    pass
+            await asyncio.sleep(0.05)  # let the background recycle finish
+            async with pool.page("MNQ1!|5") as page:
+                return page
+
+        page = asyncio.run(run())
+        assert len(opened) == 2
+        assert opened[0].closed
+        assert page is opened[1]
+        assert metrics.counters["screenshot.pool.recycled"] == 1
+
+    def test_least_recently_used_layout_is_evicted(self):
+        pool, opened = make_pool(size=2)
+
+        async def run():
+            for layout in ("A", "B", "A", "C"):
+                async with pool.page(layout):
+                    pass
+
+        asyncio.run(run())
+        assert [p.url for p in opened] == ["A", "B", "C"]
+        assert opened[1].closed and not opened[0].closed
+        assert len(pool) == 2
+
+    def test_health_check_replaces_dead_pages(self):
+        metrics.reset()
+        pool, opened = make_pool()
+
+        async def run():
+            await pool.start(["A", "B"])
+            opened[0].healthy = False
+            opened[1].closed = True
+            replaced = await pool.health_check()
+            async with pool.page("A") as page:
+                return replaced, page
+
+        replaced, page = asyncio.run(run())
+        assert replaced == 2
+        assert page is opened[2]
+        assert metrics.counters["screenshot.pool.unhealthy"] == 2
+
+
+class FakeContext:
+    def __init__(self, pane=None):
+        self.pages = []
+        self.pane = pane
+
+    async def new_page(self):
+        page = FakePage(pane=self.pane)
+
+        async def goto(url):
+            page.url = url
+
+        page.goto = goto
+        self.pages.append(page)
+        return page
+
+
+class TestCapture:
+    def test_layout_url(self, monkeypatch):
+        monkeypatch.setattr(settings, "TV_CHART_URL", "https://www.tradingview.com/chart/abc123/?theme=dark")
+        assert layout_url(chart_layout()) == "https://www.tradingview.com/chart/abc123/?theme=dark"
+        assert layout_url(chart_layout("MNQ1!", "5")) == \
+            "https://www.tradingview.com/chart/abc123/?theme=dark&symbol=MNQ1%21&interval=5"
+
+    def test_warm_capture_is_cleanup_plus_screenshot(self, monkeypatch):
+        monkeypatch.setattr(settings, "SCREENSHOT_FORMAT", "jpeg")
+        monkeypatch.setattr(settings, "SCREENSHOT_MAX_WIDTH", 1600)
+        monkeypatch.setattr(settings, "DEEPSEEK_PIXEL_BUDGET", 0)
+        monkeypatch.setattr(settings, "SCREENSHOT_COALESCE_WINDOW", 0.0)
+        metrics.reset()
+        shot = TradingViewScreenshot()
+        shot.context = FakeContext()
+        shot._authenticated = True
+
+        async def run():
+            frames = [await shot.capture("MNQ1!", "5") for _ in range(3)]
+            await shot.pool.close()
+            return frames
+
+        frames = asyncio.run(run())
+        assert all(isinstance(f, ChartFrame) and f.format == "jpeg" for f in frames)
+        assert (frames[0].width, frames[0].height) == (1600, 900)
+        assert len(frames[0]) <= settings.SCREENSHOT_TARGET_BYTES
+        assert len(shot.context.pages) == 1
+        calls = [c for c in shot.context.pages[0].calls if c != "probe"]
+        assert calls == ["evaluate", "screenshot"] * 3
+        assert metrics.summary("screenshot.capture_ms")["p50"] < 1000
+
+    def test_capture_is_clipped_to_the_price_pane(self, monkeypatch):
+        monkeypatch.setattr(settings, "DEEPSEEK_PIXEL_BUDGET", 0)
+        metrics.reset()
+        shot = TradingViewScreenshot()
+        shot.context = FakeContext(pane={"x": 56, "y": 38, "width": 1400, "height": 900})
+        shot._authenticated = True
+
+        async def run():
+            frame = await shot.capture("MNQ1!", "5")
+            await shot.pool.close()
+            return frame
+
+        frame = asyncio.run(run())
+        assert shot.context.pages[0].clip["width"] == 1400
+        assert (frame.width, frame.height) == (1400, 900)
+        assert "screenshot.clip_missed" not in metrics.counters
+
+    def test_missing_pane_falls_back_to_viewport(self):
+        metrics.reset()
+        shot = TradingViewScreenshot()
+        shot.context = FakeContext(pane=None)
+        shot._authenticated = True
+
+        async def run():
+            await shot.capture("MNQ1!", "5")
+            await shot.pool.close()
+
+        asyncio.run(run())
+        assert shot.context.pages[0].clip is None
+        assert metrics.counters["screenshot.clip_missed"] == 1
+
+    def test_composite_tiles_timeframes_within_pixel_budget(self, monkeypatch):
+        monkeypatch.setattr(settings, "AI_PROVIDER", "anthropic")
+        monkeypatch.setattr(settings, "ANTHROPIC_PIXEL_BUDGET", 1_000_000)
+        monkeypatch.setattr(settings, "SCREENSHOT_COMPOSITE_COLUMNS", 2)
+        shot = TradingViewScreenshot()
+        shot.context = FakeContext()
+        shot._authenticated = True
+
+        async def run():
+            frame = await shot.capture_composite("MNQ1!", ["1", "5", "15"])
+            await shot.pool.close()
+            return frame
+
+        frame = asyncio.run(run())
+        assert sorted(p.url.rsplit("interval=", 1)[1] for p in shot.context.pages) == ["1", "15", "5"]
+        assert frame.width * frame.height <= 1_000_000
+        assert abs(frame.width / frame.height - 16 / 9) < 0.01  # 2x2 grid of 16:9 tiles
+
+    def test_concurrent_requests_for_a_chart_share_one_capture(self):
+        metrics.reset()
+        shot = TradingViewScreenshot()
+        shot.context = FakeContext()
+        shot._authenticated = True
+
+        async def run():
+            frames = await asyncio.gather(*[shot.capture("MNQ1!", "5") for _ in range(4)], shot.capture("MNQ1!", "15"))
+            await shot.pool.close()
+            return frames
+
+        frames = asyncio.run(run())
+        assert all(frame is frames[0] for frame in frames[:4])
+        assert frames[4] is not frames[0]
+        screenshots = sorted(page.calls.count("screenshot") for page in shot.context.pages)
+        assert screenshots == [1, 1]
+        assert metrics.counters["screenshot.merged"] == 3
+
+    def test_failed_capture_is_not_shared(self):
+        shot = TradingViewScreenshot()
+        shot.context = FakeContext()
+        shot._authenticated = True
+        attempts = []
+
+        async def grab(layout):
+            attempts.append(layout)
+            if len(attempts) == 1:
+                raise RuntimeError("Target crashed")
+            return CHART_PNG
+
+        shot._grab = grab
+
+        async def run():
+            with pytest.raises(RuntimeError):
+                await shot.capture("MNQ1!", "5")
+            return await shot.capture("MNQ1!", "5")
+
+        assert isinstance(asyncio.run(run()), ChartFrame)
+        assert len(attempts) == 2
+
+    def test_browser_is_launched_once(self, monkeypatch):
+        import screenshot.capture as capture
+        monkeypatch.setattr(capture, "_screenshotter", None)
+        launches = []
+
+        async def initialize(self):
+            launches.append(self)
+            await asyncio.sleep(0.01)
+
+        monkeypatch.setattr(TradingViewScreenshot, "initialize", initialize)
+
+        async def run():
+            return await asyncio.gather(*[capture.get_screenshotter() for _ in range(5)])
+
+        shots = asyncio.run(run())
+        assert len(launches) == 1
+        assert all(shot is launches[0] for shot in shots)
+
+    def test_archive_is_written_in_the_background(self, tmp_path):
+        shot = TradingViewScreenshot()
+        shot.context = FakeContext()
+        shot._authenticated = True
+
+        async def run():
+            frame = await shot.capture("MNQ1!", "5", archive_path=str(tmp_path / "alert.png"))
+            await shot.close()
+            return frame
+
+        frame = asyncio.run(run())
+        assert (tmp_path / "alert.jpg").read_bytes() == frame.data
+
+
+class SignedOutContext(FakeContext):
+    """TradingView that bounces chart pages to the sign-in form until `login()`."""
+
+    def __init__(self):
+        super().__init__()
+        self.signed_in = False
+
+    async def new_page(self):
+        page = await super().new_page()
+
+        async def goto(url):
+            page.url = url if self.signed_in else "https://www.tradingview.com/accounts/signin/?next=/chart/"
+
+        page.goto = goto
+        return page
+
+
+class TestRestoredSession:
+    def make_shot(self, tmp_path, context):
+        shot = TradingViewScreenshot()
+        shot.context = context
+        shot.sessions = SessionStore(str(tmp_path / "tv-session.enc"), secret="hunter2")
+        shot.sessions.path.write_bytes(b"saved")
+        shot._authenticated = shot._unverified_session = True  # as initialize() leaves a restored session
+        logins = []
+
+        async def login():
+            logins.append(1)
+            context.signed_in = True
+
+        shot._login = login
+        return shot, logins
+
+    def test_revoked_session_logs_in_again(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(settings, "TV_CHART_URL", "https://www.tradingview.com/chart/abc123/")
+        metrics.reset()
+        shot, logins = self.make_shot(tmp_path, SignedOutContext())
+
+        async def run():
+            await asyncio.gather(shot.capture("MNQ1!", "5"), shot.capture("MNQ1!", "15"))
+            await shot.pool.close()
+
+        asyncio.run(run())
+        assert logins == [1]
+        assert not shot.sessions.path.exists()
+        assert all(p.url.startswith(settings.TV_CHART_URL) for p in shot.context.pages), [p.url for p in shot.context.pages]
+        assert metrics.counters["screenshot.session_revoked"] == 1
+
+    def test_live_session_is_kept(self, tmp_path):
+        context = SignedOutContext()
+        context.signed_in = True
+        shot, logins = self.make_shot(tmp_path, context)
+
+        async def run():
+            await shot.capture("MNQ1!", "5")
+            await shot.pool.close()
+
+        asyncio.run(run())
+        assert logins == []
+        assert shot.sessions.path.exists()
+        assert not shot._unverified_session
+
+    def test_chart_that_never_settles_is_not_a_revoked_session(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(settings, "SCREENSHOT_READY_TIMEOUT", 0.2)
+        monkeypatch.setattr(settings, "SCREENSHOT_READY_POLL", 0.01)
+        metrics.reset()
+        context = SignedOutContext()
+        context.signed_in = True
+        new_page = context.new_page
+
+        async def ticking_page():
+            page = await new_page()
+            # A live chart: every probe sees a different canvas
+            page.frames = [{"canvases": 3, "checksum": n, "overlay": True} for n in range(1000)]
+            return page
+
+        context.new_page = ticking_page
+        shot, logins = self.make_shot(tmp_path, context)
+
+        async def run():
+            await shot.capture("MNQ1!", "5")
+            await shot.pool.close()
+
+        asyncio.run(run())
+        assert logins == []
+        assert shot.sessions.path.exists()
+        assert metrics.counters["screenshot.time_to_ready_timeouts"] == 1
+        assert "screenshot.session_revoked" not in metrics.counters
+
+
+class TestFrameEncoding:
+    def test_webp_is_downscaled_and_typed(self):
+        frame = encode_frame(chart_png(3840, 2160), format="webp", max_width=1600, quality=80)
+        assert (frame.width, frame.height) == (1600, 900)
+        assert frame.data[8:12] == b"WEBP"
+        assert (frame.content_type, frame.filename) == ("image/webp", "chart.webp")
+
+    def test_quality_steps_down_to_target_bytes(self):
+        full = encode_frame(CHART_PNG, quality=90)
+        fitted = encode_frame(CHART_PNG, quality=90, target_bytes=len(full) // 2)
+        assert len(fitted) < len(full)
+
+    def test_pixel_budget_keeps_aspect_ratio(self):
+        frame = encode_frame(CHART_PNG, max_width=0, max_pixels=500_000)
+        assert frame.width * frame.height <= 500_000
+        assert frame.width > 900 and abs(frame.width / frame.height - 16 / 9) < 0.01
+
+    def test_small_images_are_not_upscaled(self):
+        frame = encode_frame(chart_png(800, 450), max_width=1600)
+        assert (frame.width, frame.height) == (800, 450)
+
+    def test_archive_failure_is_logged_not_raised(self, tmp_path):
+        blocker = tmp_path / "file"
+        blocker.write_bytes(b"")
+        frame = encode_frame(chart_png(200, 100))
+        assert asyncio.run(archive_frame(frame, str(blocker / "alert.png"))) is None
+
+
+class TestReadiness:
+    def test_ready_once_canvases_settle(self):
+        metrics.reset()
+        frames = [
+            {"canvases": 0, "checksum": 0, "overlay": False},   # still loading
+            {"canvases": 3, "checksum": 10, "overlay": False},  # price drawn, no indicator yet
+            {"canvases": 3, "checksum": 11, "overlay": True},
+            {"canvases": 3, "checksum": 12, "overlay": True},
+            {"canvases": 3, "checksum": 12, "overlay": True},
+        ]
+        page = FakePage(frames=frames)
+
+        ready = asyncio.run(wait_for_chart_ready(page, timeout=5, interval=0.001, stable_polls=3))
+
+        assert ready
+        assert page.calls.count("probe") == 7  # 12 seen, then three unchanged polls
+        assert metrics.summary("screenshot.time_to_ready_ms")["max"] < 1000
+
+    def test_timeout_is_the_upper_bound(self):
+        metrics.reset()
+        page = FakePage(frames=[{"canvases": 3, "checksum": n, "overlay": True} for n in range(1000)])
+
+        ready = asyncio.run(wait_for_chart_ready(page, timeout=0.05, interval=0.001))
+
+        assert not ready
+        assert metrics.counters["screenshot.time_to_ready_timeouts"] == 1
+        assert metrics.summary("screenshot.time_to_ready_ms")["max"] == 50
+
+
+class TestChartDedup:
+    def test_reencoded_chart_hashes_close_other_chart_far(self):
+        original = encode_frame(CHART_PNG, quality=90)
+        reencoded = encode_frame(CHART_PNG, format="webp", max_width=800, quality=50)
+        other = encode_frame(chart_png(seed=2))
+        assert hamming(original.dhash, reencoded.dhash) <= 4
+        assert hamming(original.dhash, other.dhash) > 4
+
+    def test_near_duplicates_keep_the_first_upload(self):
+        history = ChartHistory(threshold=4)
+        first = ChartFrame(b"a", "jpeg", 1600, 900, dhash=0b1111_0000)
+        close = ChartFrame(b"b", "jpeg", 1600, 900, dhash=0b1111_0011)
+        drifted = ChartFrame(b"c", "jpeg", 1600, 900, dhash=0b1100_1111)
+
+        history.remember("MNQ1!|5", first, discord_url="https://cdn/1")
+        assert history.match("MNQ1!|5", close).discord_url == "https://cdn/1"
+        assert history.match("ES1!|5", close) is None
+        history.remember("MNQ1!|5", close, telegram_file_id="photo-1")
+        # Still anchored on the first hash, so the drift is noticed
+        assert history.match("MNQ1!|5", drifted) is None
+        assert history.records["MNQ1!|5"].telegram_file_id == "photo-1"
+
+    def test_another_bar_is_never_a_duplicate(self):
+        history = ChartHistory(threshold=4)
+        frame = ChartFrame(b"a", "jpeg", 1600, 900, dhash=42)
+        history.remember("MNQ1!|5", frame, bar="1700000000000@17802.5", discord_url="https://cdn/1")
+        assert history.match("MNQ1!|5", frame, bar="1700000000000@17802.5") is not None
+        assert history.match("MNQ1!|5", frame, bar="1700000300000@17805.75") is None
+
+    def test_old_uploads_are_not_reused(self):
+        history = ChartHistory(max_age=-1)
+        frame = ChartFrame(b"a", "jpeg", 1600, 900, dhash=42)
+        history.remember("MNQ1!|5", frame, discord_url="https://cdn/1")
+        assert history.match("MNQ1!|5", frame) is None
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+SLEEPER = lambda worker, count: [sys.executable, "-c", "import time; time.sleep(30)"]
+
+
+class TestWorkers:
+    async def serve(self, app, port):
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, "127.0.0.1", port).start()
+        return runner
+
+    def test_capture_round_trips_through_the_worker(self):
+        frame = ChartFrame(b"jpeg-bytes", "jpeg", 1600, 900, captured_at=1.5, dhash=2**63 + 5)
+        seen = []
+
+        async def capture(symbol, tf, archive_path):
+            seen.append((symbol, tf))
+            return frame
+
+        async def run():
+            port = free_port()
+            supervisor = WorkerSupervisor(count=1, base_port=port, command=SLEEPER)
+            await supervisor.start()
+            runner = await self.serve(build_app(capture, capture), port)
+            try:
+                return await supervisor.capture("MNQ1!", "5")
+            finally:
+                await runner.cleanup()
+                await supervisor.stop()
+
+        assert asyncio.run(run()) == frame
+        assert seen == [("MNQ1!", "5")]
+
+    def test_wedged_capture_times_out_and_fails_health(self):
+        metrics.reset()
+
+        async def hang(*args):
+            await asyncio.sleep(10)
+
+        async def run():
+            port = free_port()
+            supervisor = WorkerSupervisor(count=1, base_port=port, command=SLEEPER)
+            await supervisor.start()
+            runner = await self.serve(build_app(hang, hang, concurrency=1, timeout=0.1), port)
+            try:
+                start = time.perf_counter()
+                results = await asyncio.gather(
+                    *[supervisor.capture("MNQ1!", "5") for _ in range(2)], return_exceptions=True
+                )
+                elapsed = time.perf_counter() - start
+                healthy = await supervisor._healthy(supervisor.workers[0])
+                return results, elapsed, healthy
+            finally:
+                await runner.cleanup()
+                await supervisor.stop()
+
+        results, elapsed, healthy = asyncio.run(run())
+        assert all("504" in str(r) for r in results)
+        assert elapsed < 1.0  # one slot: the second waits for the first, then times out too
+        assert not healthy
+        assert metrics.counters["screenshot.worker.capture_timeouts"] == 2
+
+    def test_rpc_timeout_bounds_the_caller(self):
+        metrics.reset()
+
+        async def stuck(request):
+            # A worker too wedged to honour the budget
+            await asyncio.sleep(2)
+            return web.Response()
+
+        async def run():
+            port = free_port()
+            supervisor = WorkerSupervisor(count=1, base_port=port, timeout=0.2, command=SLEEPER)
+            await supervisor.start()
+            app = web.Application()
+            app.router.add_post("/capture", stuck)
+            runner = await self.serve(app, port)
+            try:
+                start = time.perf_counter()
+                with pytest.raises(httpx.TimeoutException):
+                    await supervisor.capture("MNQ1!", "5")
+                return time.perf_counter() - start
+            finally:
+                await runner.cleanup()
+                await supervisor.stop()
+
+        assert asyncio.run(run()) < 1.0
+        assert metrics.counters["screenshot.rpc.timeouts"] == 1
+
+    def test_worker_gives_up_before_the_caller(self):
+        metrics.reset()
+        started = []
+
+        async def slow(*args):
+            started.append(args)
+            await asyncio.sleep(5)
+
+        async def run():
+            port = free_port()
+            supervisor = WorkerSupervisor(count=1, base_port=port, timeout=2.0, command=SLEEPER)
+            await supervisor.start()
+            runner = await self.serve(build_app(slow, slow, concurrency=1, timeout=5), port)
+            try:
+                start = time.perf_counter()
+                results = await asyncio.gather(
+                    *[supervisor.capture("MNQ1!", "5") for _ in range(2)], return_exceptions=True
+                )
+                return results, time.perf_counter() - start
+            finally:
+                await runner.cleanup()
+                await supervisor.stop()
+
+        results, elapsed = asyncio.run(run())
+        # The worker answers inside the caller's deadline and counts the wedge itself
+        assert all("504" in str(r) for r in results)
+        assert elapsed < 2.0
+        assert "screenshot.rpc.timeouts" not in metrics.counters
+        assert metrics.counters["screenshot.worker.capture_timeouts"] == 1
+        # The second caller's budget ran out waiting for the slot: no capture for it
+        assert len(started) == 1
+        assert metrics.counters["screenshot.worker.abandoned"] == 1
+
+    def test_crashed_worker_is_respawned(self):
+        metrics.reset()
+        crashing = lambda worker, count: [sys.executable, "-c", "raise SystemExit(3)"]
+
+        async def run():
+            supervisor = WorkerSupervisor(count=1, base_port=free_port(), command=crashing)
+            await supervisor.start()
+            first = supervisor.workers[0].process
+            await first.wait()
+            with pytest.raises(WorkerUnavailable):
+                await supervisor.capture("MNQ1!", "5")
+            await supervisor.check()
+            respawned = supervisor.workers[0].process
+            await supervisor.stop()
+            return first, respawned
+
+        first, respawned = asyncio.run(run())
+        assert first.returncode == 3
+        assert respawned is not None and respawned is not first
+        assert metrics.counters["screenshot.worker.crashes"] == 1
+        assert metrics.counters["screenshot.worker.restarts"] == 1
+
+    def test_silent_worker_is_killed(self):
+        metrics.reset()
+
+        async def run():
+            # Never listens: once the startup grace (timeout) is over, health checks fail
+            supervisor = WorkerSupervisor(count=1, base_port=free_port(), timeout=0.05, command=SLEEPER)
+            await supervisor.start()
+            stuck = supervisor.workers[0].process
+            await asyncio.sleep(0.1)
+            for _ in range(3):
+                await supervisor.check()
+            replacement = supervisor.workers[0].process
+            await supervisor.stop()
+            return stuck, replacement
+
+        stuck, replacement = asyncio.run(run())
+        assert stuck.returncode is not None
+        assert replacement is not stuck
+        assert metrics.counters["screenshot.worker.unhealthy"] == 1
+
+STORAGE_STATE = {
+    "cookies": [{"name": "sessionid", "value": "abc123", "domain": ".tradingview.com",
+                 "path": "/", "expires": -1, "httpOnly": True, "secure": True, "sameSite": "Lax"}],
+    "origins": [],
+}
+
+
+class FakeCookieContext:
+    def __init__(self, cookies):
+        self._cookies = cookies
+
+    async def cookies(self, url):
+        return self._cookies
+
+
+class TestSessionStore:
+    def test_round_trip_is_encrypted_at_rest(self, tmp_path):
+        pytest.importorskip("cryptography")
+        path = tmp_path / "tv-session.enc"
+        asyncio.run(SessionStore(str(path), secret="hunter2").save(STORAGE_STATE))
+
+        assert b"abc123" not in path.read_bytes()
+        assert path.stat().st_mode & 0o777 == 0o600
+        assert asyncio.run(SessionStore(str(path), secret="hunter2").load()) == STORAGE_STATE
+
+    def test_wrong_key_means_fresh_login(self, tmp_path):
+        pytest.importorskip("cryptography")
+        path = tmp_path / "tv-session.enc"
+        asyncio.run(SessionStore(str(path), secret="hunter2").save(STORAGE_STATE))
+        assert asyncio.run(SessionStore(str(path), secret="changed").load()) is None
+
+    def test_key_is_derived_off_the_event_loop(self, tmp_path):
+        pytest.importorskip("cryptography")
+        store = SessionStore(str(tmp_path / "tv-session.enc"), secret="hunter2")
+        assert store._fernet is None  # constructing it is free
+
+        async def run():
+            ticks = 0
+
+            async def tick():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0.001)
+
+            ticker = asyncio.create_task(tick())
+            await asyncio.sleep(0)
+            await store.save(STORAGE_STATE)
+            ticker.cancel()
+            return ticks
+
+        assert asyncio.run(run()) > 1
+        assert store.path.exists()
+
+    def test_nothing_written_without_cryptography(self, tmp_path, monkeypatch):
+        import screenshot.session as session
+        monkeypatch.setattr(session, "HAS_CRYPTOGRAPHY", False)
+        store = SessionStore(str(tmp_path / "tv-session.enc"), secret="hunter2")
+        asyncio.run(store.save(STORAGE_STATE))
+        assert not store.path.exists()
+        assert asyncio.run(store.load()) is None
+
+    def test_nothing_written_without_a_secret(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(settings, "TV_SESSION_KEY", "")
+        store = SessionStore(str(tmp_path / "tv-session.enc"), secret="")
+        asyncio.run(store.save(STORAGE_STATE))
+        assert not store.enabled
+        assert not store.path.exists()
+
+    @pytest.mark.parametrize("cookies,valid", [
+        (STORAGE_STATE["cookies"], True),
+        ([{"name": "sessionid", "value": "abc123", "expires": 1.0}], False),
+        ([{"name": "png", "value": "x", "expires": -1}], False),
+        ([], False),
+    ])
+    def test_session_validity(self, cookies, valid):
+        assert asyncio.run(session_is_valid(FakeCookieContext(cookies))) is valid
+
+
+class TestPreCapture:
+    def test_next_trigger(self):
+        friday_close = datetime(2026, 2, 13, 16, 0, tzinfo=MARKET_TZ)
+        assert next_trigger(friday_close) == ("KZ_OPEN_LONDON", datetime(2026, 2, 16, 2, 0, tzinfo=MARKET_TZ))
+        pre_open = datetime(2026, 2, 16, 9, 29, tzinfo=MARKET_TZ)
+        assert next_trigger(pre_open)[0] == "KZ_OPEN_NY_AM"
+
+    def test_captures_ahead_of_trigger_and_serves_fresh_frames(self, monkeypatch):
+        import screenshot.precapture
+
+        metrics.reset()
+        captured = []
+
+        async def capture(layout):
+            await asyncio.sleep(0.02)
+            captured.append((layout, datetime.now(MARKET_TZ)))
+            return ChartFrame(b"jpeg", "jpeg", 1600, 900)
+
+        fires = datetime.now(MARKET_TZ) + timedelta(seconds=0.2)
+        monkeypatch.setattr(screenshot.precapture, "next_trigger", lambda now: ("KZ_OPEN_NY_AM", fires))
+        pre = PreCapture(capture, ["MNQ1!|5"], lead=0.1, max_age=60)
+
+        async def run():
+            pre.start()
+            await asyncio.sleep(0.25)
+            await pre.stop()
+
+        asyncio.run(run())
+
+        assert len(captured) == 1
+        assert captured[0][1] < fires
+        frame = pre.take("MNQ1!|5")
+        assert frame.trigger == "KZ_OPEN_NY_AM"
+        assert frame.image.data == b"jpeg"
+        assert metrics.counters["screenshot.precapture.hits"] == 1
+        assert metrics.summary("screenshot.precapture.saved_ms")["max"] >= 20
+
+    def test_stale_frames_are_misses(self):
+        metrics.reset()
+
+        async def capture(layout):
+            return ChartFrame(b"jpeg", "jpeg", 1600, 900)
+
+        pre = PreCapture(capture, ["MNQ1!|5"], max_age=-1)
+        asyncio.run(pre.capture_all("PRE_OPEN_0929"))
+
+        assert pre.take("MNQ1!|5") is None
+        assert pre.take("ES1!|15") is None  # not a pre-captured layout
+        assert metrics.counters["screenshot.precapture.misses"] == 1
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, "-v"])
@@ -3,8 +3,14 @@ Tests for webhook receiver and payload validation.
 Run with: pytest tests/test_webhook.py -v
 """
 import pytest
+import gc
 import json
+import socket
+import threading
+import time
 from pathlib import Path
+import httpx
+import uvicorn
 from fastapi.testclient import TestClient
 
 # Add parent to path for imports
@@ -12,7 +18,9 @@ import sys
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
 from main import app
+from config import settings
 from webhook.models import TradingViewPayload
+from tests.stubs import StubAIServer
 
 
 client = TestClient(app)
@@ -185,5 +193,61 @@ class TestPayloadModel:
         assert parsed.levels.pdh is None
 
 
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class TestEventLoopNotBlocked:
+    """A slow AI completion must not stall the webhook receiver."""
+
+    def test_webhook_accepted_while_anthropic_analysis_in_flight(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(settings, "JOURNAL_PATH", str(tmp_path / "journal.db"))
+        with StubAIServer(delay=1.5) as stub:
+            monkeypatch.setattr(settings, "AI_PROVIDER", "anthropic")
+            monkeypatch.setattr(settings, "ANTHROPIC_API_KEY", "test-key")
+            monkeypatch.setattr(settings, "ANTHROPIC_BASE_URL", stub.url)
+            monkeypatch.setattr(settings, "AI_POOL_WARMUP", False)
+            monkeypatch.setattr(settings, "ANALYSIS_CACHE_ENABLED", False)
+            monkeypatch.setattr(settings, "DISCORD_WEBHOOK_URL", "")
+            monkeypatch.setattr(settings, "DELIVERY_METHOD", "discord")
+
+            server = uvicorn.Server(uvicorn.Config(
+                app, host="127.0.0.1", port=_free_port(), log_level="warning"
+            ))
+            thread = threading.Thread(target=server.run, daemon=True)
+            thread.start()
+            try:
+                while not server.started:
+                    time.sleep(0.01)
+                base_url = f"http://127.0.0.1:{server.config.port}"
+
+                with httpx.Client(base_url=base_url) as http:
+                    payload = load_sample_payload()
+                    assert http.post("/webhook", json=payload).status_code == 200
+
+                    # Wait until the analysis is actually sitting on the slow provider
+                    deadline = time.monotonic() + 5
+                    while not stub.requests and time.monotonic() < deadline:
+                        time.sleep(0.01)
+                    assert stub.requests, "analysis never reached the provider"
+
+                    # A full GC pass over the whole test session's heap would stall the
+                    # loop for reasons that have nothing to do with the webhook
+                    gc.collect()
+                    latencies = []
+                    for _ in range(5):
+                        start = time.perf_counter()
+                        response = http.post("/webhook", json=payload)
+                        latencies.append(time.perf_counter() - start)
+                        assert response.status_code == 200
+
+                    assert max(latencies) < 0.05, latencies
+            finally:
+                server.should_exit = True
+                thread.join(timeout=10)
+
+
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
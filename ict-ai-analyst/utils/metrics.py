@@ -0,0 +1,71 @@
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict
+
+
+class Metrics:
+    """
+    Tiny in-process metrics registry.
+    Counters, gauges and timing windows (last N samples) — exposed on /metrics.
+    """
+
+    def __init__(self, window: int = 1000):
+        self.window = window
+        self.counters: Dict[str, int] = {}
+        self.gauges: Dict[str, float] = {}
+        self.timings: Dict[str, deque] = {}
+
+    def incr(self, name: str, value: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: float):
+        self.gauges[name] = value
+
+    def observe(self, name: str, value: float):
+        """Record one timing sample (milliseconds by convention)."""
+        samples = self.timings.get(name)
+        if samples is None:
+            samples = self.timings[name] = deque(maxlen=self.window)
+        samples.append(value)
+
+    @contextmanager
+    def timer(self, name: str):
+        """Time a block and record it in milliseconds."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, (time.perf_counter() - start) * 1000)
+
+    def summary(self, name: str) -> dict:
+        samples = sorted(self.timings.get(name, ()))
+        if not samples:
+            return {"count": 0}
+
+        def pct(p: float) -> float:
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))], 3)
+
+        return {
+            "count": len(samples),
+            "p50": pct(0.50),
+            "p95": pct(0.95),
+            "p99": pct(0.99),
+            "max": round(samples[-1], 3),
+        }
+
+    def snapshot(self) -> dict:
+        return {
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+            "timings": {name: self.summary(name) for name in self.timings},
+        }
+
+    def reset(self):
+        self.counters.clear()
+        self.gauges.clear()
+        self.timings.clear()
+
+
+# Process-wide registry
+metrics = Metrics()
@@ -1,22 +1,60 @@
-from fastapi import APIRouter, Request, HTTPException, BackgroundTasks
+from typing import Optional
+from dataclasses import dataclass
+from fastapi import APIRouter, Request, HTTPException
 from .models import TradingViewPayload
+from config import settings
+from jobs.queue import PipelineQueue, QueueFull
+from jobs.journal import get_journal
 import structlog
 
 router = APIRouter()
 logger = structlog.get_logger()
 
 
-async def process_webhook(payload: TradingViewPayload):
-    """Background task to process the webhook through the analysis pipeline."""
+@dataclass
+class PipelineJob:
+    job_id: str                     # Job journal id
+    payload: TradingViewPayload
+    analysis: Optional[str] = None  # Already analyzed before a restart — only deliver
+
+
+async def process_webhook(job: PipelineJob):
+    """Queue worker job: run one webhook through the analysis pipeline."""
     try:
         from analysis.engine import run_analysis_pipeline
-        await run_analysis_pipeline(payload)
+        await run_analysis_pipeline(job.payload, job_id=job.job_id, analysis=job.analysis)
     except Exception as e:
-        logger.error("pipeline_error", error=str(e), trigger=payload.trigger)
+        logger.error("pipeline_error", error=str(e), trigger=job.payload.trigger)
+        get_journal().record(job.job_id, "failed")
+
+
+# Bounded worker pool; started and stopped by the app lifespan
+pipeline_queue = PipelineQueue(
+    process_webhook,
+    workers=settings.PIPELINE_WORKERS,
+    max_depth=settings.PIPELINE_MAX_QUEUE,
+)
+
+
+def replay_unfinished_jobs() -> int:
+    """
+    Re-queue alerts that were accepted but not delivered before the last shutdown.
+    Alerts older than JOURNAL_REPLAY_MAX_AGE are stale for trading and dropped.
+    """
+    journal = get_journal()
+    entries = journal.unfinished(max_age=settings.JOURNAL_REPLAY_MAX_AGE)
+    journal.compact(keep=[entry.job_id for entry in entries])
+
+    for entry in entries:
+        payload = TradingViewPayload.model_validate_json(entry.payload)
+        pipeline_queue.submit(payload.sym, PipelineJob(entry.job_id, payload, entry.analysis), force=True)
+        logger.info("job_replayed", job_id=entry.job_id, stage=entry.stage, trigger=payload.trigger)
+
+    return len(entries)
 
 
 @router.post("/webhook")
-async def receive_webhook(request: Request, background_tasks: BackgroundTasks):
+async def receive_webhook(request: Request):
     """
     Receives JSON webhook from TradingView alert.
     TradingView sends the alert message body as the POST body.
@@ -33,11 +71,25 @@ async def receive_webhook(request: Request, background_tasks: BackgroundTasks):
             entry_found=payload.entry.found
         )
 
-        # Process in background to return quickly to TradingView
-        background_tasks.add_task(process_webhook, payload)
+        if pipeline_queue.full:
+            raise QueueFull("pipeline queue full")
+
+        # Journal before acknowledging so a restart can't lose the alert
+        job_id = await get_journal().record_received(payload.model_dump_json())
+
+        # Queue for the worker pool to return quickly to TradingView.
+        # Keyed by symbol so alerts for one chart are analyzed in order.
+        pipeline_queue.submit(payload.sym, PipelineJob(job_id, payload), force=True)
 
         return {"status": "ok", "trigger": payload.trigger}
 
+    except QueueFull:
+        logger.warning("webhook_rejected", reason="queue_full", depth=pipeline_queue.depth)
+        raise HTTPException(
+            status_code=503,
+            detail="Pipeline queue full",
+            headers={"Retry-After": "5"}
+        )
     except Exception as e:
         logger.error("webhook_error", error=str(e))
         raise HTTPException(status_code=400, detail=str(e))